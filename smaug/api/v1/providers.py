@@ -14,6 +14,7 @@
 
 from oslo_config import cfg
 from oslo_log import log as logging
+from oslo_utils import timeutils
 from oslo_utils import uuidutils
 
 from webob import exc
@@ -40,11 +41,13 @@ query_provider_filters_opt = \
 
 query_checkpoint_filters_opt = \
     cfg.ListOpt('query_checkpoint_filters',
-                default=['project_id', 'status'],
+                default=['project_id', 'status', 'plan_id', 'start_date',
+                         'end_date'],
                 help="Checkpoint filter options which "
                      "non-admin user could use to "
                      "query checkpoints. Default values "
-                     "are: ['project_id', 'status']")
+                     "are: ['project_id', 'status', 'plan_id', "
+                     "'start_date', 'end_date']")
 
 CONF = cfg.CONF
 CONF.register_opt(query_provider_filters_opt)
@@ -135,6 +138,7 @@ class CheckpointViewBuilder(common.ViewBuilder):
                 'provider_id': checkpoint.get('provider_id'),
                 'protection_plan': checkpoint.get('protection_plan'),
                 'resource_graph': checkpoint.get('resource_graph'),
+                'usage': checkpoint.get('usage'),
             }
         }
         return checkpoint_ref
@@ -333,6 +337,17 @@ class ProvidersController(wsgi.Controller):
             msg = _('limit param must be an integer')
             raise exception.InvalidInput(reason=msg)
 
+        for name in ('start_date', 'end_date'):
+            if filters.get(name) is None:
+                continue
+            # check_filters may have evaluated the date as a number
+            filters[name] = six.text_type(filters[name])
+            try:
+                timeutils.parse_isotime(filters[name])
+            except ValueError:
+                msg = _('%s param must be an ISO 8601 date') % name
+                raise exception.InvalidInput(reason=msg)
+
         if filters:
             LOG.debug("Searching by: %s.", six.text_type(filters))
 
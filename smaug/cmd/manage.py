@@ -20,6 +20,7 @@ from __future__ import print_function
 
 import os
 import sys
+import uuid
 
 from oslo_config import cfg
 from oslo_db.sqlalchemy import migration
@@ -34,8 +35,15 @@ from smaug import context
 from smaug import db
 from smaug.db import migration as db_migration
 from smaug.db.sqlalchemy import api as db_api
+from smaug import exception
 from smaug.i18n import _
 from smaug import objects
+from smaug import resource
+from smaug.services.protection import bank_benchmark
+from smaug.services.protection import bank_codecs
+from smaug.services.protection import bank_gc
+from smaug.services.protection import graph
+from smaug.services.protection import provider
 from smaug import utils
 from smaug import version
 
@@ -132,7 +140,203 @@ class ServiceCommands(object):
                                   svc['updated_at']))
 
 
+class BankCommands(object):
+    """Methods for the protection bank."""
+
+    @staticmethod
+    def _sample_checkpoint_index(resources):
+        servers = []
+        for i in range(resources // 2):
+            volume = resource.Resource(type="OS::Cinder::Volume",
+                                       id=str(uuid.uuid4()),
+                                       name="volume-%d" % i)
+            server = resource.Resource(type="OS::Nova::Server",
+                                       id=str(uuid.uuid4()),
+                                       name="server-%d" % i)
+            servers.append(graph.GraphNode(
+                value=server,
+                child_nodes=(graph.GraphNode(value=volume,
+                                             child_nodes=()),)))
+        packed_graph = graph.pack_graph(servers)
+        return {
+            "version": "0.9",
+            "id": str(uuid.uuid4()),
+            "status": "available",
+            "owner_id": str(uuid.uuid4()),
+            "protection_plan": {
+                "id": str(uuid.uuid4()),
+                "name": "benchmark",
+                "resources": [
+                    {"id": node.value.id, "type": node.value.type,
+                     "name": node.value.name} for node in servers
+                ],
+            },
+            "resource_graph": [
+                {sid: list(value)
+                 for sid, value in packed_graph.nodes.items()},
+                packed_graph.adjacency,
+            ],
+        }
+
+    @args('--resources', type=int, default=1000,
+          help='Number of resources in the sample checkpoint index '
+               '(default: %(default)s)')
+    @args('--iterations', type=int, default=100,
+          help='Number of times each codec is run (default: %(default)s)')
+    def benchmark_codecs(self, resources=1000, iterations=100):
+        """Compare the bank value codecs on a sample checkpoint index."""
+        value = self._sample_checkpoint_index(resources)
+        results = bank_codecs.benchmark(value, iterations)
+        print_format = "%-12s %12s %14s %14s"
+        print(print_format % (_('Codec'),
+                              _('Size'),
+                              _('Encode (ms)'),
+                              _('Decode (ms)')))
+        for result in results:
+            print(print_format % (result["codec"],
+                                  result["size"],
+                                  "%.3f" % (result["encode_time"] * 1000),
+                                  "%.3f" % (result["decode_time"] * 1000)))
+
+    @args('--plugin', default='smaug-memory-bank-plugin',
+          help='Bank plugin to benchmark, an entry point name or a class '
+               '(default: %(default)s)')
+    @args('--operations', type=int, default=1000,
+          help='Number of operations to run (default: %(default)s)')
+    @args('--object-size', dest='object_size', type=int, default=65536,
+          help='Size in bytes of the written objects (default: %(default)s)')
+    @args('--keys', type=int, default=100,
+          help='Number of distinct object keys (default: %(default)s)')
+    @args('--concurrency', type=int, default=8,
+          help='Number of concurrent operations (default: %(default)s)')
+    @args('--mix', default='read=60,write=25,list=10,delete=5',
+          help='Relative weights of the operations (default: %(default)s)')
+    def benchmark(self, plugin='smaug-memory-bank-plugin', operations=1000,
+                  object_size=65536, keys=100, concurrency=8,
+                  mix='read=60,write=25,list=10,delete=5'):
+        """Measure the throughput and latency of a bank plugin."""
+        try:
+            mix = bank_benchmark.parse_mix(mix)
+        except exception.InvalidInput as err:
+            print(err)
+            sys.exit(2)
+        bank = utils.load_plugin(provider.PROTECTION_NAMESPACE, plugin,
+                                 CONF, context.get_admin_context())
+        results = bank_benchmark.BankBenchmark(
+            bank, operations=operations, object_size=object_size,
+            keys=keys, concurrency=concurrency, mix=mix).run()
+
+        print_format = "%-8s %8s %8s %10s %12s %10s %10s %10s %10s"
+        print(print_format % (_('Op'),
+                              _('Count'),
+                              _('Errors'),
+                              _('Ops/s'),
+                              _('MB/s'),
+                              _('p50 (ms)'),
+                              _('p90 (ms)'),
+                              _('p99 (ms)'),
+                              _('Max (ms)')))
+        for name in bank_benchmark.OPERATIONS:
+            stats = results["by_operation"][name]
+            print(print_format % (
+                name,
+                stats["count"],
+                stats["errors"],
+                "%.1f" % stats["ops_per_second"],
+                "%.3f" % (stats["bytes_per_second"] / 1048576.0),
+                "%.3f" % (stats["p50"] * 1000),
+                "%.3f" % (stats["p90"] * 1000),
+                "%.3f" % (stats["p99"] * 1000),
+                "%.3f" % (stats["max"] * 1000)))
+        print(_("%(operations)d operations in %(elapsed).3fs: "
+                "%(ops).1f ops/s, %(mbps).3f MB/s") %
+              {"operations": results["operations"],
+               "elapsed": results["elapsed"],
+               "ops": results["ops_per_second"],
+               "mbps": results["bytes_per_second"] / 1048576.0})
+
+    @args('--provider', default=None,
+          help='Id of the provider whose bank is collected (default: all '
+               'providers)')
+    @args('--batch-size', dest='batch_size', type=int, default=None,
+          help='Number of objects deleted at once (default: '
+               'bank_gc_batch_size)')
+    @args('--rate', type=float, default=None,
+          help='Maximum number of objects deleted per second, 0 means no '
+               'limit (default: bank_gc_delete_rate)')
+    @args('--dry-run', dest='dry_run', action='store_true', default=False,
+          help='Only count the orphaned objects')
+    def gc(self, provider_id=None, batch_size=None, rate=None,
+           dry_run=False):
+        """Delete the resource data of checkpoints without an index."""
+        registry = provider.ProviderRegistry()
+        if provider_id is None:
+            provider_ids = [info["id"] for info in registry.list_providers()]
+        else:
+            provider_ids = [provider_id]
+
+        print_format = "%-36s %12s %10s %10s %10s"
+        print(print_format % (_('Provider'),
+                              _('Checkpoints'),
+                              _('Orphans'),
+                              _('Deleted'),
+                              _('Kept')))
+        for provider_id in provider_ids:
+            protection_provider = registry.show_provider(provider_id)
+            if protection_provider is None:
+                print(_("Provider %s not found") % provider_id)
+                sys.exit(2)
+            result = bank_gc.BankGarbageCollector(
+                protection_provider.bank, batch_size=batch_size,
+                delete_rate=rate, dry_run=dry_run).collect()
+            print(print_format % (provider_id,
+                                  result["checkpoints"],
+                                  result["orphans"],
+                                  result["deleted"],
+                                  result["kept"]))
+
+    @args('provider_id', help='Id of the provider whose bank is reported')
+    def usage(self, provider_id):
+        """Show the bank usage of the protection plans of a provider."""
+        registry = provider.ProviderRegistry()
+        protection_provider = registry.show_provider(provider_id)
+        if protection_provider is None:
+            print(_("Provider %s not found") % provider_id)
+            sys.exit(2)
+        checkpoint_collection = protection_provider.get_checkpoint_collection()
+        if not checkpoint_collection.tracks_usage:
+            print(_("The bank of provider %s does not track usage, see the "
+                    "bank_track_usage option") % provider_id)
+            sys.exit(2)
+        usage = checkpoint_collection.get_plan_usage()
+
+        print_format = "%-36s %12s %12s %16s"
+        print(print_format % (_('Plan'),
+                              _('Checkpoints'),
+                              _('Objects'),
+                              _('Size (bytes)')))
+        for plan_id, plan_usage in sorted(usage.items(),
+                                          key=lambda item: str(item[0])):
+            print(print_format % (plan_id,
+                                  plan_usage["checkpoints"],
+                                  plan_usage["objects"],
+                                  plan_usage["size"]))
+
+    @args('provider_id', help='Id of the provider whose bank is indexed')
+    def reindex(self, provider_id):
+        """Rebuild the checkpoint index of the bank of a provider."""
+        registry = provider.ProviderRegistry()
+        protection_provider = registry.show_provider(provider_id)
+        if protection_provider is None:
+            print(_("Provider %s not found") % provider_id)
+            sys.exit(2)
+        count = protection_provider.get_checkpoint_collection(
+        ).rebuild_indices()
+        print(_("Indexed %d checkpoints") % count)
+
+
 CATEGORIES = {
+    'bank': BankCommands,
     'config': ConfigCommands,
     'db': DbCommands,
     'service': ServiceCommands,
@@ -198,7 +402,7 @@ def get_arg_string(args):
 def fetch_func_args(func):
     fn_args = []
     for args, kwargs in getattr(func, 'args', []):
-        arg = get_arg_string(args[0])
+        arg = kwargs.get('dest') or get_arg_string(args[0])
         fn_args.append(getattr(CONF.category, arg))
 
     return fn_args
@@ -81,6 +81,10 @@ global_opts = [
     cfg.IntOpt('lease_validity_window',
                default=100,
                help='validity_window for bank lease, in seconds'),
+    cfg.IntOpt('bank_bulk_operation_concurrency',
+               default=16,
+               help='The number of concurrent requests used by bank plugins '
+                    'without native support for bulk operations'),
 ]
 
 CONF.register_opts(global_opts)
@@ -296,6 +296,10 @@ class BankGetObjectFailed(SmaugException):
     message = _("Get Object %(key)s in Bank Failed: %(reason)s")
 
 
+class BankObjectNotFound(BankGetObjectFailed):
+    message = _("Object %(key)s not found in Bank")
+
+
 class BankListObjectsFailed(SmaugException):
     message = _("Get Object in Bank Failed: %(reason)s")
 
@@ -0,0 +1,196 @@
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+
+"""Throughput benchmark for bank plugins
+
+Runs a weighted mix of read, write, list and delete operations against a
+bank plugin from a green pool, and reports the throughput and the latency
+percentiles of every kind of operation.
+"""
+
+import math
+import os
+import random
+import time
+
+from eventlet import greenpool
+
+from smaug import exception
+
+OPERATIONS = ("read", "write", "list", "delete")
+DEFAULT_MIX = {"read": 60, "write": 25, "list": 10, "delete": 5}
+PERCENTILES = (50, 90, 99)
+
+
+def parse_mix(mix):
+    """Parse an operation mix such as 'read=60,write=25,list=10,delete=5'"""
+    weights = dict.fromkeys(OPERATIONS, 0)
+    for item in mix.split(","):
+        name, _sep, weight = item.partition("=")
+        name = name.strip()
+        if name not in weights:
+            raise exception.InvalidInput(
+                reason="Unknown bank benchmark operation: %s" % name)
+        try:
+            weights[name] = int(weight)
+        except ValueError:
+            raise exception.InvalidInput(
+                reason="Invalid weight of bank benchmark operation %s: %s" %
+                       (name, weight))
+    if sum(weights.values()) <= 0:
+        raise exception.InvalidInput(
+            reason="The bank benchmark mix has no operations")
+    return weights
+
+
+def percentile(sorted_values, percent):
+    """Nearest rank percentile of a sorted list"""
+    if not sorted_values:
+        return 0.0
+    rank = int(math.ceil(percent / 100.0 * len(sorted_values))) - 1
+    return sorted_values[min(max(rank, 0), len(sorted_values) - 1)]
+
+
+class BankBenchmark(object):
+    """Weighted operation mix against a bank plugin
+
+    All the objects live below prefix. keys objects are written before the
+    run so reads, lists and deletes have targets, and everything below the
+    prefix is deleted afterwards.
+    """
+    def __init__(self, plugin, operations=1000, object_size=65536,
+                 keys=100, concurrency=8, mix=None, prefix="/benchmark",
+                 seed=None):
+        self._plugin = plugin
+        self._operations = operations
+        self._keys = max(keys, 1)
+        self._concurrency = concurrency
+        self._mix = mix or DEFAULT_MIX
+        self._prefix = prefix.rstrip("/")
+        self._random = random.Random(seed)
+        self._value = os.urandom(object_size)
+        self._stored = []
+        self._stored_index = {}
+        self._latencies = {name: [] for name in OPERATIONS}
+        self._bytes = dict.fromkeys(OPERATIONS, 0)
+        self._errors = dict.fromkeys(OPERATIONS, 0)
+
+    def _key(self, index):
+        return "%s/object-%08d" % (self._prefix, index)
+
+    def _choose(self):
+        names = [name for name in OPERATIONS if self._mix.get(name)]
+        weights = [self._mix[name] for name in names]
+        point = self._random.uniform(0, sum(weights))
+        for name, weight in zip(names, weights):
+            point -= weight
+            if point <= 0:
+                return name
+        return names[-1]
+
+    def _add_stored(self, key):
+        if key not in self._stored_index:
+            self._stored_index[key] = len(self._stored)
+            self._stored.append(key)
+
+    def _remove_stored(self, key):
+        index = self._stored_index.pop(key)
+        last = self._stored.pop()
+        if last != key:
+            self._stored[index] = last
+            self._stored_index[last] = index
+
+    def _read(self):
+        key = self._random.choice(self._stored)
+        return len(self._plugin.get_object(key))
+
+    def _write(self):
+        key = self._key(self._random.randrange(self._keys))
+        self._plugin.create_object(key, self._value)
+        self._add_stored(key)
+        return len(self._value)
+
+    def _list(self):
+        self._plugin.list_objects(prefix=self._prefix + "/", limit=100)
+        return 0
+
+    def _delete(self):
+        key = self._random.choice(self._stored)
+        # Claim the key first, a concurrent read or delete must not pick it
+        self._remove_stored(key)
+        self._plugin.delete_object(key)
+        return 0
+
+    def _run_operation(self, name):
+        if name in ("read", "delete") and not self._stored:
+            name = "write"
+        start = time.time()
+        try:
+            size = getattr(self, "_" + name)()
+        except Exception:
+            self._errors[name] += 1
+            return
+        self._latencies[name].append(time.time() - start)
+        self._bytes[name] += size
+
+    def _populate(self):
+        self._plugin.create_objects(
+            {self._key(index): self._value for index in range(self._keys)})
+        for index in range(self._keys):
+            self._add_stored(self._key(index))
+
+    def _cleanup(self):
+        self._plugin.delete_objects(
+            list(self._plugin.iter_objects(prefix=self._prefix + "/")))
+
+    def run(self):
+        """Run the benchmark and return its results
+
+        The result is a dict with the elapsed time, the total operation
+        and byte rates, and per operation the count of successful and
+        failed operations, the rates and the latency percentiles in
+        seconds. Failed operations are not part of the rates.
+        """
+        self._populate()
+        pool = greenpool.GreenPool(self._concurrency)
+        start = time.time()
+        try:
+            for _i in range(self._operations):
+                pool.spawn(self._run_operation, self._choose())
+            pool.waitall()
+            elapsed = max(time.time() - start, 1e-9)
+        finally:
+            self._cleanup()
+
+        results = {
+            "elapsed": elapsed,
+            "operations": sum(len(latencies)
+                              for latencies in self._latencies.values()),
+            "bytes": sum(self._bytes.values()),
+            "errors": sum(self._errors.values()),
+            "by_operation": {},
+        }
+        results["ops_per_second"] = results["operations"] / elapsed
+        results["bytes_per_second"] = results["bytes"] / elapsed
+        for name in OPERATIONS:
+            latencies = sorted(self._latencies[name])
+            stats = {
+                "count": len(latencies),
+                "errors": self._errors[name],
+                "ops_per_second": len(latencies) / elapsed,
+                "bytes_per_second": self._bytes[name] / elapsed,
+                "max": latencies[-1] if latencies else 0.0,
+            }
+            for percent in PERCENTILES:
+                stats["p%d" % percent] = percentile(latencies, percent)
+            results["by_operation"][name] = stats
+        return results
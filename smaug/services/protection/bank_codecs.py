@@ -0,0 +1,153 @@
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+
+"""Value codecs for bank objects
+
+A codec turns an object value into bytes before it is handed to the bank
+plugin. Encoded values start with a header naming the codec, so values
+written with any codec, as well as values written before codecs existed,
+can always be read back.
+"""
+
+import abc
+import struct
+import time
+import zlib
+
+from oslo_serialization import jsonutils
+from oslo_serialization import msgpackutils
+import six
+
+from smaug import exception
+
+JSON_CODEC = "json"
+
+_HEADER_MAGIC = b"\x00SMGCODEC"
+_HEADER_FORMAT = "!%dsB" % len(_HEADER_MAGIC)
+_HEADER_SIZE = struct.calcsize(_HEADER_FORMAT)
+
+_codecs = {}
+
+
+@six.add_metaclass(abc.ABCMeta)
+class BankCodec(object):
+    """Encodes bank object values to bytes and back"""
+    name = None
+
+    @abc.abstractmethod
+    def encode(self, value):
+        return
+
+    @abc.abstractmethod
+    def decode(self, data):
+        return
+
+
+class JsonCodec(BankCodec):
+    name = JSON_CODEC
+
+    def encode(self, value):
+        return jsonutils.dump_as_bytes(value)
+
+    def decode(self, data):
+        return jsonutils.loads(data)
+
+
+class MsgpackCodec(BankCodec):
+    name = "msgpack"
+
+    def encode(self, value):
+        return msgpackutils.dumps(value)
+
+    def decode(self, data):
+        return msgpackutils.loads(data)
+
+
+class ZlibJsonCodec(BankCodec):
+    name = "json+zlib"
+
+    def __init__(self, level=6):
+        self._level = level
+
+    def encode(self, value):
+        return zlib.compress(jsonutils.dump_as_bytes(value), self._level)
+
+    def decode(self, data):
+        return jsonutils.loads(zlib.decompress(data))
+
+
+def register_codec(codec):
+    _codecs[codec.name] = codec
+
+
+def get_codec(name):
+    try:
+        return _codecs[name]
+    except KeyError:
+        raise exception.InvalidInput(
+            reason="Unknown bank codec: %s" % name)
+
+
+def list_codecs():
+    return sorted(_codecs)
+
+
+def encode(codec_name, value):
+    """Encode value with the named codec and prepend the codec header"""
+    name = codec_name.encode("ascii")
+    header = struct.pack(_HEADER_FORMAT, _HEADER_MAGIC, len(name))
+    return header + name + get_codec(codec_name).encode(value)
+
+
+def decode(data):
+    """Decode a value written by encode()
+
+    Values which do not carry a codec header are returned unchanged.
+    """
+    if (not isinstance(data, six.binary_type) or
+            not data.startswith(_HEADER_MAGIC)):
+        return data
+    _magic, name_length = struct.unpack(_HEADER_FORMAT,
+                                        data[:_HEADER_SIZE])
+    name_end = _HEADER_SIZE + name_length
+    codec_name = data[_HEADER_SIZE:name_end].decode("ascii")
+    return get_codec(codec_name).decode(data[name_end:])
+
+
+def benchmark(value, iterations=100):
+    """Measure the encoded size and encode/decode time of every codec
+
+    Returns a list of dicts with the codec name, the encoded size in bytes
+    and the average encode and decode time in seconds.
+    """
+    results = []
+    for codec_name in list_codecs():
+        codec = get_codec(codec_name)
+        start = time.time()
+        for _i in range(iterations):
+            data = codec.encode(value)
+        encode_time = (time.time() - start) / iterations
+        start = time.time()
+        for _i in range(iterations):
+            codec.decode(data)
+        decode_time = (time.time() - start) / iterations
+        results.append({
+            "codec": codec_name,
+            "size": len(data),
+            "encode_time": encode_time,
+            "decode_time": decode_time,
+        })
+    return results
+
+
+for _codec in (JsonCodec(), MsgpackCodec(), ZlibJsonCodec()):
+    register_codec(_codec)
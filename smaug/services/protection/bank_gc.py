@@ -0,0 +1,194 @@
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+
+"""Garbage collector of orphaned checkpoint resource data
+
+Flows which fail or are reverted can leave objects below
+'/resource-data/<checkpoint_id>/' while the index of the checkpoint is gone.
+The collector walks the bank listing page by page, so memory holds the set
+of live checkpoint ids and one delete batch no matter how many objects the
+bank has. The data of a checkpoint is only deleted when the checkpoint has
+no index, and the data of a resource is kept while a live checkpoint still
+references it through a 'refs/<checkpoint_id>' marker, as image backups
+reused by later checkpoints do. Resource data written through the chunk
+store releases its chunks before its manifest is deleted, and the index
+entries and usage summary of the orphaned checkpoints are removed as well.
+"""
+
+import time
+
+import eventlet
+from oslo_config import cfg
+from oslo_log import log as logging
+
+from smaug import exception
+from smaug.i18n import _LI
+from smaug.services.protection import checkpoint
+from smaug.services.protection import chunk_store
+
+bank_gc_opts = [
+    cfg.IntOpt('bank_gc_interval',
+               default=0,
+               help='Interval, in seconds, between collections of orphaned '
+                    'checkpoint resource data. 0 disables the collection'),
+    cfg.IntOpt('bank_gc_batch_size',
+               default=1000,
+               help='The number of orphaned objects deleted at once'),
+    cfg.FloatOpt('bank_gc_delete_rate',
+                 default=100,
+                 help='The maximum number of orphaned objects deleted per '
+                      'second, 0 means no limit'),
+]
+
+CONF = cfg.CONF
+CONF.register_opts(bank_gc_opts)
+
+LOG = logging.getLogger(__name__)
+
+CHECKPOINTS_PREFIX = "/checkpoints"
+RESOURCE_DATA_PREFIX = "/resource-data"
+REFERENCES_PREFIX = "refs"
+INDICES_PREFIX = "/indices"
+# The manifest of resource data, which refers to the chunk store when the
+# data was written through it
+MANIFEST_KEY = "manifest"
+
+_INDEX_FILE_SUFFIX = ".index.json"
+
+
+class BankGarbageCollector(object):
+    def __init__(self, bank, batch_size=None, delete_rate=None,
+                 dry_run=False):
+        self._bank = bank
+        self._batch_size = max(batch_size or CONF.bank_gc_batch_size, 1)
+        if delete_rate is None:
+            delete_rate = CONF.bank_gc_delete_rate
+        self._delete_rate = delete_rate
+        self._dry_run = dry_run
+        self._batch = []
+        self._next_delete = 0
+
+    def _iter_live_ids(self):
+        for key in self._bank.iter_objects(prefix=CHECKPOINTS_PREFIX):
+            name = key.rsplit("/", 1)[-1]
+            if name.endswith(_INDEX_FILE_SUFFIX):
+                yield name[:-len(_INDEX_FILE_SUFFIX)]
+
+    def _is_live(self, checkpoint_id, live_ids):
+        """Whether the checkpoint has an index
+
+        The index is looked up again for checkpoints created after the
+        live ids were listed, their index is written before any data.
+        """
+        if checkpoint_id in live_ids:
+            return True
+        try:
+            self._bank.stat_object("%s/%s%s" % (
+                CHECKPOINTS_PREFIX, checkpoint_id, _INDEX_FILE_SUFFIX))
+        except exception.BankObjectNotFound:
+            return False
+        live_ids.add(checkpoint_id)
+        return True
+
+    def _is_referenced(self, resource_prefix, live_ids):
+        references = self._bank.iter_objects(
+            prefix="%s/%s" % (resource_prefix, REFERENCES_PREFIX))
+        return any(self._is_live(key.rsplit("/", 1)[-1], live_ids)
+                   for key in references)
+
+    def _release_chunks(self, resource_prefix, key):
+        """Drop the chunk store references of an orphaned manifest"""
+        try:
+            manifest = self._bank.get_object(key)
+        except exception.BankObjectNotFound:
+            return
+        if not isinstance(manifest, dict) or "chunk_store" not in manifest:
+            return
+        if not self._dry_run:
+            chunk_store.ChunkStore(self._bank).release(
+                chunk_store.owner_of_prefix(resource_prefix),
+                manifest["chunk_store"])
+
+    def _delete_indices(self, orphan_ids):
+        """Delete the index entries and usage of orphaned checkpoints"""
+        for key in self._bank.iter_objects(prefix=INDICES_PREFIX):
+            if checkpoint.checkpoint_of_index_entry(key) in orphan_ids:
+                self._delete(key)
+        self._flush()
+        if not self._dry_run:
+            self._bank.delete_usage(orphan_ids)
+
+    def _delete(self, key):
+        self._batch.append(key)
+        if len(self._batch) >= self._batch_size:
+            self._flush()
+
+    def _flush(self):
+        if not self._batch:
+            return
+        if self._delete_rate > 0 and not self._dry_run:
+            delay = self._next_delete - time.time()
+            if delay > 0:
+                eventlet.sleep(delay)
+            self._next_delete = (max(self._next_delete, time.time()) +
+                                 len(self._batch) / float(self._delete_rate))
+        if not self._dry_run:
+            self._bank.delete_objects(self._batch)
+        self._batch = []
+
+    def collect(self):
+        """Delete the resource data of checkpoints without an index
+
+        Returns a dict with the number of live checkpoints, the number of
+        orphaned checkpoints found, and the number of deleted objects and
+        of orphaned objects kept because a live checkpoint references them.
+        In a dry run the objects are counted as deleted but not deleted.
+        """
+        live_ids = set(self._iter_live_ids())
+        result = {"checkpoints": len(live_ids), "orphans": 0,
+                  "deleted": 0, "kept": 0}
+        orphan_ids = set()
+        checkpoint_id = resource_prefix = None
+        orphan = delete = False
+        for key in self._bank.iter_objects(prefix=RESOURCE_DATA_PREFIX):
+            parts = key[len(RESOURCE_DATA_PREFIX) + 1:].split("/", 2)
+            if len(parts) < 3:
+                continue
+            if parts[0] != checkpoint_id:
+                checkpoint_id = parts[0]
+                resource_prefix = None
+                orphan = not self._is_live(checkpoint_id, live_ids)
+                if orphan:
+                    orphan_ids.add(checkpoint_id)
+                    result["orphans"] += 1
+            if not orphan:
+                continue
+            prefix = "%s/%s/%s" % (RESOURCE_DATA_PREFIX, checkpoint_id,
+                                   parts[1])
+            if prefix != resource_prefix:
+                resource_prefix = prefix
+                delete = not self._is_referenced(prefix, live_ids)
+            if delete:
+                if parts[2] == MANIFEST_KEY:
+                    self._release_chunks(prefix, key)
+                self._delete(key)
+                result["deleted"] += 1
+            else:
+                result["kept"] += 1
+        self._flush()
+        if orphan_ids:
+            self._delete_indices(orphan_ids)
+        LOG.info(_LI("Bank garbage collection%(dry_run)s: %(deleted)d "
+                     "objects of %(orphans)d orphaned checkpoints deleted, "
+                     "%(kept)d referenced objects kept"),
+                 dict(result, dry_run=" (dry run)" if self._dry_run else ""))
+        return result
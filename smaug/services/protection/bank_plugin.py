@@ -11,18 +11,61 @@
 #    under the License.
 
 import abc
+import collections
+import copy
+import hashlib
 import os
+import re
 import six
+import threading
+import time
+import uuid
 
+import eventlet
+from eventlet import greenpool
 from oslo_config import cfg
 from oslo_log import log as logging
+from oslo_serialization import jsonutils
 
 from smaug import exception
+from smaug.i18n import _LE
+from smaug.services.protection import bank_codecs
 
 CONF = cfg.CONF
 
 LOG = logging.getLogger(__name__)
 
+DEFAULT_STREAM_CHUNK_SIZE = 65536
+DEFAULT_LIST_PAGE_SIZE = 1000
+
+
+def iter_stream(stream, chunk_size=DEFAULT_STREAM_CHUNK_SIZE):
+    """Iterates over a file-like object, an iterable or a bytes value"""
+    if isinstance(stream, six.binary_type):
+        chunks = [stream]
+    elif hasattr(stream, "read"):
+        chunks = iter(lambda: stream.read(chunk_size), b"")
+    else:
+        chunks = stream
+    for chunk in chunks:
+        if chunk:
+            yield chunk
+
+
+def _value_bytes(value):
+    """Returns the bytes of a value as plugins serialize it"""
+    if not isinstance(value, six.binary_type):
+        if not isinstance(value, six.text_type):
+            value = jsonutils.dumps(value)
+        value = value.encode("utf-8")
+    return value
+
+
+def _slice(value, offset, length):
+    if length is None:
+        return value[offset:]
+    return value[offset:offset + length]
+
 
 @six.add_metaclass(abc.ABCMeta)
 class LeasePlugin(object):
@@ -71,10 +114,367 @@ class BankPlugin(object):
     def get_owner_id(self):
         return
 
+    def get_objects(self, keys):
+        """Returns a dict mapping the given keys to their values
+
+        Keys which do not exist in the bank are left out of the result.
+        Plugins with native support for bulk reads should override this.
+        """
+        values = {}
+
+        def _get_object(key):
+            try:
+                values[key] = self.get_object(key)
+            except exception.BankObjectNotFound:
+                pass
+
+        self._run_concurrently(_get_object, keys)
+        return values
+
+    def create_objects(self, objects):
+        """Creates all the objects of a dict mapping keys to values"""
+        self._run_concurrently(lambda item: self.create_object(*item),
+                               list(objects.items()))
+
+    def delete_objects(self, keys):
+        """Deletes all the objects of the given keys"""
+        self._run_concurrently(self.delete_object, keys)
+
+    def stat_object(self, key):
+        """Returns the attributes of an object without its data
+
+        The result is a dict with the size in bytes, the etag (md5 of the
+        data), the last modification time as a unix timestamp and the user
+        metadata of the object. Unknown attributes are None. Raises
+        BankObjectNotFound if the object does not exist.
+
+        This default implementation reads the whole object, plugins which
+        can look up the attributes alone should override it.
+        """
+        value = _value_bytes(self.get_object(key))
+        return {
+            "size": len(value),
+            "etag": hashlib.md5(value).hexdigest(),
+            "last_modified": None,
+            "metadata": {},
+        }
+
+    def iter_objects(self, prefix=None, marker=None,
+                     page_size=DEFAULT_LIST_PAGE_SIZE):
+        """Lazily iterates over the keys of all the objects below prefix
+
+        Keys are listed page by page, following the last key of each page
+        as the marker of the next one, so only one page is held in memory
+        and callers may stop early.
+        """
+        while True:
+            keys = list(self.list_objects(prefix=prefix, limit=page_size,
+                                          marker=marker))
+            for key in keys:
+                yield key
+            if not keys or len(keys) < page_size:
+                return
+            marker = keys[-1]
+
+    def get_object_range(self, key, offset, length=None):
+        """Returns length bytes of the data of an object from offset
+
+        Without a length the data up to the end of the object is returned.
+        The result is shorter than length, or empty, when the range goes
+        past the end of the object.
+
+        This default implementation reads the whole object, plugins which
+        can read a part of an object should override it.
+        """
+        return _slice(_value_bytes(self.get_object(key)), offset, length)
+
+    def put_object_stream(self, key, stream):
+        """Stores the binary data of a stream as an object
+
+        The stream is either a file-like object or an iterable of bytes.
+        Plugins which can upload data without holding all of it in memory
+        should override this.
+        """
+        self.create_object(key, b"".join(iter_stream(stream)))
+
+    def get_object_stream(self, key,
+                          chunk_size=DEFAULT_STREAM_CHUNK_SIZE):
+        """Returns an iterator over the binary data of an object
+
+        Plugins which can download data in pieces should override this.
+        """
+        value = self.get_object(key)
+        for start in range(0, len(value), chunk_size):
+            yield value[start:start + chunk_size]
+
+    @staticmethod
+    def _run_concurrently(func, items):
+        """Calls func for every item on a green pool
+
+        All the items are processed even if some of the calls fail, the
+        first failure is raised afterwards.
+        """
+        pool = greenpool.GreenPool(CONF.bank_bulk_operation_concurrency)
+        failures = []
+
+        def _run(item):
+            try:
+                func(item)
+            except Exception as err:
+                failures.append(err)
+
+        for item in items:
+            pool.spawn_n(_run, item)
+        pool.waitall()
+        if failures:
+            raise failures[0]
+
+
+class BankCache(object):
+    """Bounded LRU cache of bank objects
+
+    Entries expire after ttl seconds. Keys known to be missing are cached
+    as well, so repeated lookups of absent objects are served locally.
+    Values are copied in and out of the cache so callers can not modify
+    cached entries.
+    """
+    _MISSING = object()
+
+    def __init__(self, size, ttl):
+        self._size = size
+        self._ttl = ttl
+        self._entries = collections.OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, key):
+        """Returns (found, value), found is None when key is not cached"""
+        with self._lock:
+            entry = self._entries.pop(key, None)
+            if entry is None or entry[0] <= time.time():
+                self.misses += 1
+                return None, None
+            self._entries[key] = entry
+            self.hits += 1
+        if entry[1] is self._MISSING:
+            return False, None
+        return True, copy.deepcopy(entry[1])
+
+    def put(self, key, value):
+        self._put(key, copy.deepcopy(value))
+
+    def put_missing(self, key):
+        self._put(key, self._MISSING)
+
+    def _put(self, key, value):
+        with self._lock:
+            self._entries.pop(key, None)
+            self._entries[key] = (time.time() + self._ttl, value)
+            while len(self._entries) > self._size:
+                self._entries.popitem(last=False)
+
+    def invalidate(self, key):
+        with self._lock:
+            self._entries.pop(key, None)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def get_stats(self):
+        with self._lock:
+            return {
+                "hits": self.hits,
+                "misses": self.misses,
+                "size": len(self._entries),
+            }
+
+
+class WriteBehindQueue(object):
+    """Queue of deferred bank writes
+
+    Writes to the same key are coalesced, only the latest value is written.
+    Pending writes are flushed delay seconds after the first of them was
+    queued, or on flush(). Flushes run one at a time, so the writes of a
+    key always reach the bank in order.
+    """
+    def __init__(self, write_objects, delay):
+        self._write_objects = write_objects
+        self._delay = delay
+        self._pending = collections.OrderedDict()
+        self._in_flight = {}
+        self._lock = threading.Lock()
+        self._flush_lock = threading.Lock()
+        self._timer = None
+
+    def put(self, key, value):
+        with self._lock:
+            self._pending.pop(key, None)
+            self._pending[key] = copy.deepcopy(value)
+            if self._timer is None:
+                self._timer = eventlet.spawn_after(self._delay,
+                                                   self._flush_on_deadline)
+
+    def get(self, key):
+        """Returns (found, value) of the latest unwritten value of key"""
+        with self._lock:
+            for writes in (self._pending, self._in_flight):
+                if key in writes:
+                    return True, copy.deepcopy(writes[key])
+        return False, None
+
+    def has_prefix(self, prefix):
+        with self._lock:
+            return any(key.startswith(prefix)
+                       for writes in (self._pending, self._in_flight)
+                       for key in writes)
+
+    def discard(self, keys):
+        """Drop the pending writes of keys ahead of a direct write
+
+        Waits for a running flush which writes one of the keys, so it can
+        not overwrite the direct write.
+        """
+        with self._lock:
+            for key in keys:
+                self._pending.pop(key, None)
+            in_flight = any(key in self._in_flight for key in keys)
+        if in_flight:
+            with self._flush_lock:
+                pass
+
+    def flush(self):
+        with self._flush_lock:
+            with self._lock:
+                if self._timer is not None:
+                    self._timer.cancel()
+                    self._timer = None
+                self._in_flight = self._pending
+                self._pending = collections.OrderedDict()
+            if not self._in_flight:
+                return
+            try:
+                self._write_objects(dict(self._in_flight))
+            except Exception:
+                # Keep the failed writes unless they were superseded
+                with self._lock:
+                    pending = self._pending
+                    self._pending = collections.OrderedDict(
+                        (key, value)
+                        for key, value in self._in_flight.items()
+                        if key not in pending)
+                    self._pending.update(pending)
+                raise
+            finally:
+                with self._lock:
+                    self._in_flight = {}
+
+    def _flush_on_deadline(self):
+        with self._lock:
+            self._timer = None
+        try:
+            self.flush()
+        except Exception:
+            LOG.exception(_LE("Flushing deferred bank writes failed"))
+            with self._lock:
+                if self._pending and self._timer is None:
+                    self._timer = eventlet.spawn_after(
+                        self._delay, self._flush_on_deadline)
+
+
+class BankUsage(object):
+    """Byte and object counters of the resource data of checkpoints
+
+    Changes are accumulated in memory and added to a small summary object
+    per checkpoint and writer when the bank is flushed, so the usage of a
+    checkpoint costs a short listing and a few reads instead of a listing
+    of all its objects. Every writer only updates its own summaries, so
+    protection services sharing a bank never overwrite each other's
+    changes. A writer deleting data it did not write has negative
+    counters, the usage of a checkpoint is the sum of its summaries.
+    """
+    PREFIX = "/usage/checkpoints"
+    _KEY_PATTERN = re.compile(r"^/resource-data/([^/]+)/")
+
+    def __init__(self):
+        self.writer_id = str(uuid.uuid4())
+        self._deltas = {}
+        self._lock = threading.Lock()
+
+    @classmethod
+    def checkpoint_of_key(cls, key):
+        """Returns the id of the checkpoint whose data key is, or None"""
+        match = cls._KEY_PATTERN.match(key)
+        return match.group(1) if match else None
+
+    @classmethod
+    def summary_prefix(cls, checkpoint_id):
+        return "%s/%s" % (cls.PREFIX, checkpoint_id)
+
+    def summary_key(self, checkpoint_id):
+        return "%s/%s" % (self.summary_prefix(checkpoint_id), self.writer_id)
+
+    def record(self, key, size, objects):
+        checkpoint_id = self.checkpoint_of_key(key)
+        if checkpoint_id is None or not (size or objects):
+            return
+        with self._lock:
+            delta = self._deltas.setdefault(checkpoint_id, [0, 0])
+            delta[0] += size
+            delta[1] += objects
+
+    def pop(self, checkpoint_ids=None):
+        """Returns and forgets the pending changes of the checkpoints
+
+        Without checkpoint ids the changes of all checkpoints are returned.
+        """
+        with self._lock:
+            if checkpoint_ids is None:
+                deltas, self._deltas = self._deltas, {}
+                return deltas
+            return {checkpoint_id: self._deltas.pop(checkpoint_id)
+                    for checkpoint_id in checkpoint_ids
+                    if checkpoint_id in self._deltas}
+
+    def restore(self, deltas):
+        """Put back changes which could not be written"""
+        with self._lock:
+            for checkpoint_id, (size, objects) in deltas.items():
+                delta = self._deltas.setdefault(checkpoint_id, [0, 0])
+                delta[0] += size
+                delta[1] += objects
+
 
 class Bank(object):
-    def __init__(self, plugin):
+    def __init__(self, plugin, cache_size=0, cache_ttl=30,
+                 codec=bank_codecs.JSON_CODEC, write_behind_delay=0,
+                 track_usage=False):
         self._plugin = plugin
+        self._cache = None
+        if cache_size > 0:
+            self._cache = BankCache(cache_size, cache_ttl)
+        self._write_behind = None
+        if write_behind_delay > 0:
+            self._write_behind = WriteBehindQueue(self._write_deferred,
+                                                  write_behind_delay)
+        self._usage = BankUsage() if track_usage else None
+        self._usage_lock = threading.Lock()
+        # The json codec leaves serialization to the plugin, which keeps
+        # objects readable by older versions
+        self._codec = None
+        if codec != bank_codecs.JSON_CODEC:
+            bank_codecs.get_codec(codec)
+            self._codec = codec
+
+    def _encode(self, value):
+        if self._codec is None or isinstance(value, six.binary_type):
+            return value
+        return bank_codecs.encode(self._codec, value)
+
+    @staticmethod
+    def _decode(value):
+        return bank_codecs.decode(value)
 
     def _normalize_key(self, key):
         """Normalizes the key
@@ -91,27 +491,347 @@ class Bank(object):
 
         return key
 
-    def create_object(self, key, value):
-        return self._plugin.create_object(self._normalize_key(key), value)
+    def _invalidate(self, key):
+        if self._cache is not None:
+            self._cache.invalidate(key)
 
-    def update_object(self, key, value):
-        return self._plugin.update_object(self._normalize_key(key), value)
+    def _discard_deferred(self, keys):
+        if self._write_behind is not None:
+            self._write_behind.discard(keys)
+
+    def _write_deferred(self, objects):
+        sizes = self._stored_sizes(list(objects))
+        try:
+            self._plugin.create_objects(objects)
+        finally:
+            for key in objects:
+                self._invalidate(key)
+        self._record_writes(list(objects), sizes)
+
+    def _defer(self, key, value):
+        self._write_behind.put(key, self._encode(value))
+        self._invalidate(key)
+
+    def _stored_sizes(self, keys):
+        """Returns the sizes of the existing objects among tracked keys
+
+        Only keys whose usage is tracked are looked up.
+        """
+        sizes = {}
+        if self._usage is None:
+            return sizes
+
+        def _stat(key):
+            try:
+                sizes[key] = self._plugin.stat_object(key)["size"]
+            except exception.BankObjectNotFound:
+                pass
+
+        BankPlugin._run_concurrently(
+            _stat, [key for key in keys
+                    if self._usage.checkpoint_of_key(key) is not None])
+        return sizes
+
+    def _record_writes(self, keys, sizes):
+        """Record written keys given the sizes stored before the write
+
+        The sizes the plugin stored are looked up again, deletes subtract
+        them and plugins such as the compressing one store fewer bytes than
+        they are given.
+        """
+        if self._usage is None:
+            return
+        for key, size in self._stored_sizes(keys).items():
+            self._usage.record(key, size - sizes.get(key, 0),
+                               0 if key in sizes else 1)
+
+    def _record_deletes(self, sizes):
+        if self._usage is None:
+            return
+        for key, size in sizes.items():
+            self._usage.record(key, -size, -1)
+
+    def _write(self, write, key, value):
+        value = self._encode(value)
+        sizes = self._stored_sizes([key])
+        try:
+            result = write(key, value)
+        finally:
+            self._invalidate(key)
+        self._record_writes([key], sizes)
+        return result
+
+    def create_object(self, key, value, deferred=False):
+        """Create an object
+
+        With deferred=True the write is queued and returns immediately when
+        the bank has a write-behind queue. Reads through this bank see the
+        queued value right away.
+        """
+        key = self._normalize_key(key)
+        if deferred and self._write_behind is not None:
+            return self._defer(key, value)
+        self._discard_deferred([key])
+        return self._write(self._plugin.create_object, key, value)
+
+    def update_object(self, key, value, deferred=False):
+        key = self._normalize_key(key)
+        if deferred and self._write_behind is not None:
+            return self._defer(key, value)
+        self._discard_deferred([key])
+        return self._write(self._plugin.update_object, key, value)
+
+    def flush(self):
+        """Write all deferred writes and usage changes to the bank"""
+        if self._write_behind is not None:
+            self._write_behind.flush()
+        if self._usage is not None:
+            self._write_usage(self._usage.pop())
+
+    def _write_usage(self, deltas):
+        """Add usage changes to the summary objects of this writer
+
+        Flushes of green threads sharing the bank are serialized, as they
+        update the same summaries.
+        """
+        with self._usage_lock:
+            for checkpoint_id in list(deltas):
+                size, objects = deltas[checkpoint_id]
+                key = self._usage.summary_key(checkpoint_id)
+                try:
+                    try:
+                        summary = self._decode(self._plugin.get_object(key))
+                        exists = True
+                    except exception.BankObjectNotFound:
+                        summary = {"size": 0, "objects": 0}
+                        exists = False
+                    summary["size"] += size
+                    summary["objects"] += objects
+                    if summary["size"] or summary["objects"]:
+                        self._plugin.update_object(key,
+                                                   self._encode(summary))
+                    elif exists:
+                        self._plugin.delete_object(key)
+                except Exception:
+                    self._usage.restore(deltas)
+                    raise
+                finally:
+                    self._invalidate(key)
+                del deltas[checkpoint_id]
+
+    def _usage_keys(self, checkpoint_ids):
+        """Returns the keys of the usage summaries of the checkpoints"""
+        keys = {}
+
+        def _list(checkpoint_id):
+            prefix = BankUsage.summary_prefix(checkpoint_id) + "/"
+            for key in self._plugin.iter_objects(prefix=prefix):
+                keys[key] = checkpoint_id
+
+        BankPlugin._run_concurrently(_list, checkpoint_ids)
+        return keys
+
+    @property
+    def tracks_usage(self):
+        return self._usage is not None
+
+    def get_usage(self, checkpoint_ids):
+        """Returns the usage of the resource data of checkpoints
+
+        The result maps every checkpoint id to a dict with the size in bytes
+        and the number of objects of its resource data. Checkpoints without
+        recorded usage have zero counters. Deferred writes count once they
+        are written.
+        """
+        checkpoint_ids = list(checkpoint_ids)
+        if self._usage is not None:
+            self._write_usage(self._usage.pop(checkpoint_ids))
+        keys = self._usage_keys(checkpoint_ids)
+        usage = {checkpoint_id: {"size": 0, "objects": 0}
+                 for checkpoint_id in checkpoint_ids}
+        for key, summary in self._plugin.get_objects(list(keys)).items():
+            summary = self._decode(summary)
+            checkpoint_usage = usage[keys[key]]
+            checkpoint_usage["size"] += summary.get("size", 0)
+            checkpoint_usage["objects"] += summary.get("objects", 0)
+        return usage
+
+    def delete_usage(self, checkpoint_ids):
+        """Drop the usage summaries of checkpoints which are gone"""
+        checkpoint_ids = list(checkpoint_ids)
+        if self._usage is not None:
+            self._usage.pop(checkpoint_ids)
+        keys = list(self._usage_keys(checkpoint_ids))
+        for key in keys:
+            self._invalidate(key)
+        if keys:
+            self._plugin.delete_objects(keys)
 
     def get_object(self, key):
-        return self._plugin.get_object(self._normalize_key(key))
+        key = self._normalize_key(key)
+        if self._write_behind is not None:
+            found, value = self._write_behind.get(key)
+            if found:
+                return self._decode(value)
+        if self._cache is None:
+            return self._decode(self._plugin.get_object(key))
+
+        found, value = self._cache.get(key)
+        if found:
+            return value
+        elif found is not None:
+            raise exception.BankObjectNotFound(key=key)
+
+        try:
+            value = self._decode(self._plugin.get_object(key))
+        except exception.BankObjectNotFound:
+            self._cache.put_missing(key)
+            raise
+        self._cache.put(key, value)
+        return value
+
+    def get_objects(self, keys):
+        keys = [self._normalize_key(key) for key in keys]
+        values = {}
+        if self._write_behind is not None:
+            unwritten_keys = []
+            for key in keys:
+                found, value = self._write_behind.get(key)
+                if found:
+                    values[key] = self._decode(value)
+                else:
+                    unwritten_keys.append(key)
+            keys = unwritten_keys
+        if not keys:
+            return values
+        if self._cache is None:
+            values.update((key, self._decode(value)) for key, value in
+                          self._plugin.get_objects(keys).items())
+            return values
+
+        uncached_keys = []
+        for key in keys:
+            found, value = self._cache.get(key)
+            if found:
+                values[key] = value
+            elif found is None:
+                uncached_keys.append(key)
+
+        if uncached_keys:
+            fetched = self._plugin.get_objects(uncached_keys)
+            for key in uncached_keys:
+                if key in fetched:
+                    values[key] = self._decode(fetched[key])
+                    self._cache.put(key, values[key])
+                else:
+                    self._cache.put_missing(key)
+        return values
+
+    def create_objects(self, objects):
+        objects = {self._normalize_key(key): self._encode(value)
+                   for key, value in objects.items()}
+        self._discard_deferred(list(objects))
+        sizes = self._stored_sizes(list(objects))
+        try:
+            result = self._plugin.create_objects(objects)
+        finally:
+            for key in objects:
+                self._invalidate(key)
+        self._record_writes(list(objects), sizes)
+        return result
+
+    def delete_objects(self, keys):
+        keys = [self._normalize_key(key) for key in keys]
+        self._discard_deferred(keys)
+        sizes = self._stored_sizes(keys)
+        try:
+            result = self._plugin.delete_objects(keys)
+        finally:
+            for key in keys:
+                self._invalidate(key)
+        self._record_deletes(sizes)
+        return result
+
+    def put_object_stream(self, key, stream):
+        key = self._normalize_key(key)
+        self._discard_deferred([key])
+        sizes = self._stored_sizes([key])
+        try:
+            result = self._plugin.put_object_stream(key, stream)
+        finally:
+            self._invalidate(key)
+        self._record_writes([key], sizes)
+        return result
+
+    def get_object_stream(self, key,
+                          chunk_size=DEFAULT_STREAM_CHUNK_SIZE):
+        key = self._normalize_key(key)
+        if (self._write_behind is not None and
+                self._write_behind.get(key)[0]):
+            self.flush()
+        return self._plugin.get_object_stream(key, chunk_size=chunk_size)
+
+    def get_object_range(self, key, offset, length=None):
+        key = self._normalize_key(key)
+        if (self._write_behind is not None and
+                self._write_behind.get(key)[0]):
+            self.flush()
+        return self._plugin.get_object_range(key, offset, length)
+
+    def _list_prefix(self, prefix):
+        prefix = self._normalize_key(prefix or "/")
+        if prefix != "/":
+            prefix += "/"
+        # Listings only come from the plugin, write out deferred objects
+        # which belong to them first
+        if (self._write_behind is not None and
+                self._write_behind.has_prefix(prefix)):
+            self.flush()
+        return prefix
+
+    def stat_object(self, key):
+        key = self._normalize_key(key)
+        if (self._write_behind is not None and
+                self._write_behind.get(key)[0]):
+            self.flush()
+        return self._plugin.stat_object(key)
 
     def list_objects(self, prefix=None, limit=None, marker=None):
-        if not prefix:
-            prefix = "/"
-
         return self._plugin.list_objects(
-            prefix=self._normalize_key(prefix) + "/",
+            prefix=self._list_prefix(prefix),
             limit=limit,
             marker=marker,
         )
 
+    def iter_objects(self, prefix=None, marker=None,
+                     page_size=DEFAULT_LIST_PAGE_SIZE):
+        """Lazily iterates over all the keys below prefix
+
+        Unlike list_objects, which returns a single page, this follows the
+        markers until the listing is exhausted.
+        """
+        return self._plugin.iter_objects(
+            prefix=self._list_prefix(prefix),
+            marker=marker,
+            page_size=page_size,
+        )
+
     def delete_object(self, key):
-        return self._plugin.delete_object(self._normalize_key(key))
+        key = self._normalize_key(key)
+        self._discard_deferred([key])
+        sizes = self._stored_sizes([key])
+        try:
+            result = self._plugin.delete_object(key)
+        finally:
+            self._invalidate(key)
+        self._record_deletes(sizes)
+        return result
+
+    def get_cache_stats(self):
+        """Returns the cache hit/miss counters, or None if not cached"""
+        if self._cache is None:
+            return None
+        return self._cache.get_stats()
 
     def get_sub_section(self, prefix, is_writable=True):
         return BankSection(self, prefix, is_writable)
@@ -133,7 +853,7 @@ class BankSection(object):
         self._bank = bank
         self._prefix = os.path.normpath(prefix or "/")
         if not self._prefix.startswith("/"):
-            prefix = "/" + prefix
+            self._prefix = "/" + self._prefix
 
         self._is_writable = is_writable
 
@@ -148,6 +868,10 @@ class BankSection(object):
     def is_writable(self):
         return self._is_writable
 
+    @property
+    def prefix(self):
+        return self._prefix
+
     @staticmethod
     def _validate_key(key):
         if not key:
@@ -171,18 +895,20 @@ class BankSection(object):
         if not self.is_writable:
             raise exception.BankReadonlyViolation()
 
-    def create_object(self, key, value):
+    def create_object(self, key, value, deferred=False):
         self._validate_writable()
         return self._bank.create_object(
             self._prepend_prefix(key),
             value,
+            deferred=deferred,
         )
 
-    def update_object(self, key, value):
+    def update_object(self, key, value, deferred=False):
         self._validate_writable()
         return self._bank.update_object(
             self._prepend_prefix(key),
             value,
+            deferred=deferred,
         )
 
     def get_object(self, key):
@@ -190,11 +916,60 @@ class BankSection(object):
             self._prepend_prefix(key),
         )
 
-    def list_objects(self, prefix=None, limit=None, marker=None):
+    def stat_object(self, key):
+        return self._bank.stat_object(
+            self._prepend_prefix(key),
+        )
+
+    def flush(self):
+        return self._bank.flush()
+
+    def get_objects(self, keys):
+        full_keys = {self._bank._normalize_key(self._prepend_prefix(key)): key
+                     for key in keys}
+        values = self._bank.get_objects(list(full_keys))
+        return {full_keys[full_key]: value
+                for full_key, value in values.items()}
+
+    def create_objects(self, objects):
+        self._validate_writable()
+        return self._bank.create_objects(
+            {self._prepend_prefix(key): value
+             for key, value in objects.items()})
+
+    def delete_objects(self, keys):
+        self._validate_writable()
+        return self._bank.delete_objects(
+            [self._prepend_prefix(key) for key in keys])
+
+    def put_object_stream(self, key, stream):
+        self._validate_writable()
+        return self._bank.put_object_stream(
+            self._prepend_prefix(key),
+            stream,
+        )
+
+    def get_object_stream(self, key,
+                          chunk_size=DEFAULT_STREAM_CHUNK_SIZE):
+        return self._bank.get_object_stream(
+            self._prepend_prefix(key),
+            chunk_size=chunk_size,
+        )
+
+    def get_object_range(self, key, offset, length=None):
+        return self._bank.get_object_range(
+            self._prepend_prefix(key),
+            offset,
+            length,
+        )
+
+    def _section_prefix(self, prefix):
         if not prefix:
-            prefix = self._prefix
-        else:
-            prefix = self._prepend_prefix(prefix)
+            return self._prefix
+        return self._prepend_prefix(prefix)
+
+    def list_objects(self, prefix=None, limit=None, marker=None):
+        prefix = self._section_prefix(prefix)
 
         if marker is not None:
             marker = self._prepend_prefix(marker)
@@ -207,6 +982,16 @@ class BankSection(object):
                     )
                 ]
 
+    def iter_objects(self, prefix=None, marker=None,
+                     page_size=DEFAULT_LIST_PAGE_SIZE):
+        prefix = self._section_prefix(prefix)
+
+        if marker is not None:
+            marker = self._prepend_prefix(marker)
+
+        for key in self._bank.iter_objects(prefix, marker, page_size):
+            yield key[len(self._prefix) + 1:]
+
     def delete_object(self, key):
         self._validate_writable()
         return self._bank.delete_object(
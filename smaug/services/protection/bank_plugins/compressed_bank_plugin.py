@@ -0,0 +1,332 @@
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+
+import bz2
+import struct
+import threading
+import time
+import zlib
+
+from oslo_config import cfg
+from oslo_log import log as logging
+import six
+
+from smaug import exception
+from smaug.services.protection import bank_plugin
+from smaug.services.protection.bank_plugin import BankPlugin
+
+try:
+    import lzma
+except ImportError:
+    lzma = None
+
+compressed_bank_plugin_opts = [
+    cfg.StrOpt('compression_algorithm',
+               default='none',
+               choices=['none', 'zlib', 'bz2', 'lzma'],
+               help='The algorithm used to compress binary bank objects, '
+                    'none disables compression'),
+    cfg.IntOpt('compression_level',
+               default=6,
+               min=1,
+               max=9,
+               help='The compression level, higher levels compress better '
+                    'and use more CPU time'),
+    cfg.FloatOpt('compression_max_ratio',
+                 default=0.9,
+                 help='Objects whose compressed size is above this fraction '
+                      'of their original size are stored uncompressed'),
+]
+
+LOG = logging.getLogger(__name__)
+
+# Sample size used to decide whether a stream is worth compressing
+_STREAM_PROBE_SIZE = 1024 * 1024
+
+_FRAME_MAGIC = b"\x00SMGCMPR"
+_HEADER_FORMAT = "!%dsB" % len(_FRAME_MAGIC)
+_HEADER_SIZE = struct.calcsize(_HEADER_FORMAT)
+_TRAILER_FORMAT = "!Q"
+_TRAILER_SIZE = struct.calcsize(_TRAILER_FORMAT)
+
+_STORED = 0
+_ALGORITHM_IDS = {"zlib": 1, "bz2": 2, "lzma": 3}
+
+try:
+    _process_time = time.process_time
+except AttributeError:
+    _process_time = time.clock
+
+
+def _compressor(algorithm_id, level):
+    if algorithm_id == _ALGORITHM_IDS["zlib"]:
+        return zlib.compressobj(level)
+    elif algorithm_id == _ALGORITHM_IDS["bz2"]:
+        return bz2.BZ2Compressor(level)
+    return lzma.LZMACompressor(preset=level)
+
+
+def _decompressor(algorithm_id):
+    if algorithm_id == _ALGORITHM_IDS["zlib"]:
+        return zlib.decompressobj()
+    elif algorithm_id == _ALGORITHM_IDS["bz2"]:
+        return bz2.BZ2Decompressor()
+    elif algorithm_id == _ALGORITHM_IDS["lzma"] and lzma is not None:
+        return lzma.LZMADecompressor()
+    raise ValueError("unsupported compression algorithm %d" % algorithm_id)
+
+
+def is_enabled(config):
+    config.register_opts(compressed_bank_plugin_opts,
+                         "compressed_bank_plugin")
+    return config.compressed_bank_plugin.compression_algorithm != "none"
+
+
+class CompressedBankPlugin(BankPlugin):
+    """Bank plugin compressing binary objects of another bank plugin
+
+    Binary values and streams are stored in a frame made of a header naming
+    the compression algorithm, the compressed data and a trailer holding
+    the original size. Objects which do not compress well are framed
+    uncompressed. Other values, and objects without a frame, are passed
+    through unchanged, so compression can be enabled on an existing bank.
+    """
+    def __init__(self, config, plugin):
+        super(CompressedBankPlugin, self).__init__(config)
+        is_enabled(config)
+        plugin_config = config.compressed_bank_plugin
+        algorithm = plugin_config.compression_algorithm
+        if algorithm == "lzma" and lzma is None:
+            raise exception.InvalidInput(
+                reason="lzma compression is not available")
+        self._plugin = plugin
+        self._algorithm_id = _ALGORITHM_IDS[algorithm]
+        self._level = plugin_config.compression_level
+        self._max_ratio = plugin_config.compression_max_ratio
+        self._stats_lock = threading.Lock()
+        self._stats = {
+            "objects": 0,
+            "skipped": 0,
+            "original_size": 0,
+            "stored_size": 0,
+            "cpu_time": 0.0,
+        }
+
+    @property
+    def plugin(self):
+        return self._plugin
+
+    def get_owner_id(self):
+        return self._plugin.get_owner_id()
+
+    def create_object(self, key, value):
+        return self._plugin.create_object(key, self._pack(key, value))
+
+    def update_object(self, key, value):
+        return self._plugin.update_object(key, self._pack(key, value))
+
+    def get_object(self, key):
+        return self._unpack(key, self._plugin.get_object(key))
+
+    def list_objects(self, prefix=None, limit=None, marker=None):
+        return self._plugin.list_objects(prefix=prefix, limit=limit,
+                                         marker=marker)
+
+    def stat_object(self, key):
+        """Returns the attributes of the stored, possibly compressed, object
+
+        The size and etag are those of the stored frame, reading the
+        original size would require reading the object.
+        """
+        return self._plugin.stat_object(key)
+
+    def iter_objects(self, prefix=None, marker=None,
+                     page_size=bank_plugin.DEFAULT_LIST_PAGE_SIZE):
+        return self._plugin.iter_objects(prefix=prefix, marker=marker,
+                                         page_size=page_size)
+
+    def delete_object(self, key):
+        return self._plugin.delete_object(key)
+
+    def get_objects(self, keys):
+        return {key: self._unpack(key, value)
+                for key, value in self._plugin.get_objects(keys).items()}
+
+    def create_objects(self, objects):
+        return self._plugin.create_objects(
+            {key: self._pack(key, value) for key, value in objects.items()})
+
+    def delete_objects(self, keys):
+        return self._plugin.delete_objects(keys)
+
+    def put_object_stream(self, key, stream):
+        return self._plugin.put_object_stream(
+            key, self._compress_stream(key, bank_plugin.iter_stream(stream)))
+
+    def get_object_stream(self, key,
+                          chunk_size=bank_plugin.DEFAULT_STREAM_CHUNK_SIZE):
+        return self._decompress_stream(
+            key, self._plugin.get_object_stream(key, chunk_size=chunk_size))
+
+    def get_compression_stats(self):
+        """Returns the totals of all objects compressed so far"""
+        with self._stats_lock:
+            stats = dict(self._stats)
+        stats["ratio"] = (float(stats["stored_size"]) /
+                          stats["original_size"]
+                          if stats["original_size"] else 1.0)
+        return stats
+
+    def _record(self, key, original_size, stored_size, cpu_time, skipped):
+        with self._stats_lock:
+            self._stats["objects"] += 1
+            self._stats["skipped"] += int(skipped)
+            self._stats["original_size"] += original_size
+            self._stats["stored_size"] += stored_size
+            self._stats["cpu_time"] += cpu_time
+        LOG.debug("Compressed bank object %(key)s: %(original)d -> "
+                  "%(stored)d bytes (ratio %(ratio).3f%(skipped)s) in "
+                  "%(cpu_time).3fs CPU time",
+                  {"key": key,
+                   "original": original_size,
+                   "stored": stored_size,
+                   "ratio": (float(stored_size) / original_size
+                             if original_size else 1.0),
+                   "skipped": ", stored uncompressed" if skipped else "",
+                   "cpu_time": cpu_time})
+
+    @staticmethod
+    def _header(algorithm_id):
+        return struct.pack(_HEADER_FORMAT, _FRAME_MAGIC, algorithm_id)
+
+    @staticmethod
+    def _trailer(original_size):
+        return struct.pack(_TRAILER_FORMAT, original_size)
+
+    def _pack(self, key, value):
+        if not isinstance(value, six.binary_type):
+            return value
+
+        start = _process_time()
+        compressor = _compressor(self._algorithm_id, self._level)
+        compressed = compressor.compress(value) + compressor.flush()
+        skipped = len(compressed) > len(value) * self._max_ratio
+        if skipped:
+            frame = self._header(_STORED) + value
+        else:
+            frame = self._header(self._algorithm_id) + compressed
+        frame += self._trailer(len(value))
+        self._record(key, len(value), len(frame), _process_time() - start,
+                     skipped)
+        return frame
+
+    def _unpack(self, key, value):
+        if (not isinstance(value, six.binary_type) or
+                not value.startswith(_FRAME_MAGIC)):
+            return value
+        _magic, algorithm_id = struct.unpack(_HEADER_FORMAT,
+                                             value[:_HEADER_SIZE])
+        body = value[_HEADER_SIZE:-_TRAILER_SIZE]
+        if algorithm_id != _STORED:
+            decompressor = _decompressor(algorithm_id)
+            body = decompressor.decompress(body)
+        self._verify_size(key, len(body), value[-_TRAILER_SIZE:])
+        return body
+
+    @staticmethod
+    def _verify_size(key, size, trailer):
+        if len(trailer) != _TRAILER_SIZE:
+            raise exception.BankGetObjectFailed(
+                key=key, reason="compressed object is truncated")
+        (original_size, ) = struct.unpack(_TRAILER_FORMAT, trailer)
+        if size != original_size:
+            raise exception.BankGetObjectFailed(
+                key=key,
+                reason="decompressed size %d does not match the original "
+                       "size %d" % (size, original_size))
+
+    def _compress_stream(self, key, chunks):
+        cpu_time = 0.0
+        probe = b""
+        for chunk in chunks:
+            probe += chunk
+            if len(probe) >= _STREAM_PROBE_SIZE:
+                break
+
+        start = _process_time()
+        probe_compressor = _compressor(self._algorithm_id, self._level)
+        compressed_probe = (probe_compressor.compress(probe) +
+                            probe_compressor.flush())
+        skipped = len(compressed_probe) > len(probe) * self._max_ratio
+        cpu_time += _process_time() - start
+
+        if skipped:
+            yield self._header(_STORED)
+        else:
+            yield self._header(self._algorithm_id)
+            compressor = _compressor(self._algorithm_id, self._level)
+
+        original_size = 0
+        stored_size = _HEADER_SIZE + _TRAILER_SIZE
+        for chunk in _prepend(probe, chunks):
+            original_size += len(chunk)
+            if not skipped:
+                start = _process_time()
+                chunk = compressor.compress(chunk)
+                cpu_time += _process_time() - start
+            if chunk:
+                stored_size += len(chunk)
+                yield chunk
+        if not skipped:
+            start = _process_time()
+            chunk = compressor.flush()
+            cpu_time += _process_time() - start
+            stored_size += len(chunk)
+            yield chunk
+        yield self._trailer(original_size)
+        self._record(key, original_size, stored_size, cpu_time, skipped)
+
+    def _decompress_stream(self, key, chunks):
+        buf = b""
+        for chunk in chunks:
+            buf += chunk
+            if len(buf) >= _HEADER_SIZE:
+                break
+        if not buf.startswith(_FRAME_MAGIC):
+            for chunk in _prepend(buf, chunks):
+                yield chunk
+            return
+
+        _magic, algorithm_id = struct.unpack(_HEADER_FORMAT,
+                                             buf[:_HEADER_SIZE])
+        decompressor = None
+        if algorithm_id != _STORED:
+            decompressor = _decompressor(algorithm_id)
+        size = 0
+        # The trailer is only known at the end, keep the last bytes back
+        tail = b""
+        for chunk in _prepend(buf[_HEADER_SIZE:], chunks):
+            tail += chunk
+            data, tail = tail[:-_TRAILER_SIZE], tail[-_TRAILER_SIZE:]
+            if decompressor is not None:
+                data = decompressor.decompress(data)
+            if data:
+                size += len(data)
+                yield data
+        self._verify_size(key, size, tail)
+
+
+def _prepend(first, chunks):
+    if first:
+        yield first
+    for chunk in chunks:
+        yield chunk
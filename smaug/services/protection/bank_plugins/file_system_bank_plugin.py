@@ -0,0 +1,406 @@
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+
+import errno
+import fcntl
+import hashlib
+import itertools
+import json
+import math
+import mmap
+import os
+import six
+import struct
+import tempfile
+import time
+import uuid
+
+from oslo_config import cfg
+from oslo_log import log as logging
+from oslo_service import loopingcall
+from smaug import exception
+from smaug.i18n import _LE
+from smaug.services.protection import bank_plugin
+from smaug.services.protection.bank_plugin import BankPlugin
+from smaug.services.protection.bank_plugin import LeasePlugin
+
+file_system_bank_plugin_opts = [
+    cfg.StrOpt('file_system_bank_path',
+               default='/var/lib/smaug/bank',
+               help='The root directory of the bank. It may reside on a '
+                    'local or a shared (e.g. NFS) file system.'),
+    cfg.IntOpt('file_system_bank_mmap_threshold',
+               default=1048576,
+               help='Objects of at least this size in bytes are read '
+                    'through mmap'),
+]
+
+LOG = logging.getLogger(__name__)
+
+_OBJECTS_DIR = "objects"
+_LEASES_DIR = "leases"
+_TEMP_FILE_PREFIX = ".tmp-"
+
+# Object files start with the magic, the length of the metadata and the
+# metadata as json, followed by the data
+_HEADER_MAGIC = b"SMAUGOBJ"
+_HEADER_PREFIX = struct.Struct(">8sI")
+_ETAG_PLACEHOLDER = "0" * 32
+
+
+def _encode_header(metadata):
+    encoded = json.dumps(metadata, sort_keys=True).encode("utf-8")
+    return _HEADER_PREFIX.pack(_HEADER_MAGIC, len(encoded)) + encoded
+
+
+class FileSystemBankPlugin(BankPlugin, LeasePlugin):
+    """Bank plugin storing objects in a directory tree
+
+    Every key maps to a file below the 'objects' directory of the bank,
+    which holds a header with the object metadata followed by the data.
+    Writes go to a temporary file which is renamed in place, so readers
+    never see partially written objects, nor metadata of another version.
+
+    A key can not be both an object and the parent of other objects, as it
+    would have to be a file and a directory at the same time.
+    """
+    def __init__(self, config, context=None):
+        super(FileSystemBankPlugin, self).__init__(config)
+        self._config.register_opts(file_system_bank_plugin_opts,
+                                   "file_system_bank_plugin")
+        plugin_config = self._config.file_system_bank_plugin
+        self.bank_path = plugin_config.file_system_bank_path
+        self.mmap_threshold = plugin_config.file_system_bank_mmap_threshold
+        self.lease_expire_window = self._config.lease_expire_window
+        self.lease_renew_window = self._config.lease_renew_window
+        self.lease_validity_window = self._config.lease_validity_window
+        self.context = context
+
+        self.owner_id = str(uuid.uuid4())
+        self.lease_expire_time = 0
+        self._lease_file = None
+
+        self._objects_path = os.path.join(self.bank_path, _OBJECTS_DIR)
+        self._leases_path = os.path.join(self.bank_path, _LEASES_DIR)
+        try:
+            for path in (self._objects_path, self._leases_path):
+                self._makedirs(path)
+        except OSError as err:
+            LOG.error(_LE("bank plugin create directories failed."))
+            raise exception.CreateContainerFailed(reason=err)
+
+        try:
+            self.acquire_lease()
+        except exception.AcquireLeaseFailed as err:
+            LOG.error(_LE("bank plugin acquire lease failed."))
+            raise err
+
+        renew_lease_loop = loopingcall.FixedIntervalLoopingCall(
+            self.renew_lease)
+        renew_lease_loop.start(interval=self.lease_renew_window,
+                               initial_delay=self.lease_renew_window)
+
+    def get_owner_id(self):
+        return self.owner_id
+
+    def create_object(self, key, value):
+        try:
+            self._write_object(key, value)
+        except (OSError, IOError) as err:
+            LOG.error(_LE("create object failed, err: %s."), err)
+            raise exception.BankCreateObjectFailed(reason=err,
+                                                   key=key)
+
+    def update_object(self, key, value):
+        try:
+            self._write_object(key, value)
+        except (OSError, IOError) as err:
+            LOG.error(_LE("update object failed, err: %s."), err)
+            raise exception.BankUpdateObjectFailed(reason=err,
+                                                   key=key)
+
+    def delete_object(self, key):
+        try:
+            os.remove(self._object_path(key))
+        except OSError as err:
+            LOG.error(_LE("delete object failed, err: %s."), err)
+            raise exception.BankDeleteObjectFailed(reason=err,
+                                                   key=key)
+
+    def get_object(self, key):
+        try:
+            metadata, body = self._read_object(key)
+        except (OSError, IOError) as err:
+            if err.errno == errno.ENOENT:
+                raise exception.BankObjectNotFound(key=key)
+            LOG.error(_LE("get object failed, err: %s."), err)
+            raise exception.BankGetObjectFailed(reason=err,
+                                                key=key)
+        if metadata.get("serialized"):
+            body = json.loads(body.decode("utf-8"))
+        return body
+
+    def get_object_range(self, key, offset, length=None):
+        try:
+            with open(self._object_path(key), "rb") as f:
+                metadata, data_offset = self._read_header(f)
+                if not metadata.get("serialized"):
+                    f.seek(data_offset + offset)
+                    return f.read(-1 if length is None else length)
+            return super(FileSystemBankPlugin, self).get_object_range(
+                key, offset, length)
+        except (OSError, IOError) as err:
+            if err.errno == errno.ENOENT:
+                raise exception.BankObjectNotFound(key=key)
+            LOG.error(_LE("get object range failed, err: %s."), err)
+            raise exception.BankGetObjectFailed(reason=err,
+                                                key=key)
+
+    def stat_object(self, key):
+        try:
+            with open(self._object_path(key), "rb") as f:
+                metadata, data_offset = self._read_header(f)
+                stat = os.fstat(f.fileno())
+        except (OSError, IOError) as err:
+            if err.errno == errno.ENOENT:
+                raise exception.BankObjectNotFound(key=key)
+            LOG.error(_LE("stat object failed, err: %s."), err)
+            raise exception.BankGetObjectFailed(reason=err,
+                                                key=key)
+        etag = metadata.pop("etag", None)
+        return {
+            "size": stat.st_size - data_offset,
+            "etag": etag,
+            "last_modified": stat.st_mtime,
+            "metadata": metadata,
+        }
+
+    def put_object_stream(self, key, stream):
+        md5 = hashlib.md5()
+        # The etag is known once the data is written, it replaces the
+        # placeholder of the same length in the header
+        chunks = itertools.chain(
+            [_encode_header({"serialized": False,
+                             "etag": _ETAG_PLACEHOLDER})],
+            _hash_chunks(md5, bank_plugin.iter_stream(stream)))
+        try:
+            self._write_file(
+                self._object_path(key), chunks,
+                header=lambda: _encode_header({"serialized": False,
+                                               "etag": md5.hexdigest()}))
+        except (OSError, IOError) as err:
+            LOG.error(_LE("put object stream failed, err: %s."), err)
+            raise exception.BankCreateObjectFailed(reason=err,
+                                                   key=key)
+
+    def get_object_stream(self, key,
+                          chunk_size=bank_plugin.DEFAULT_STREAM_CHUNK_SIZE):
+        try:
+            f = open(self._object_path(key), "rb")
+        except (OSError, IOError) as err:
+            if err.errno == errno.ENOENT:
+                raise exception.BankObjectNotFound(key=key)
+            LOG.error(_LE("get object stream failed, err: %s."), err)
+            raise exception.BankGetObjectFailed(reason=err,
+                                                key=key)
+        with f:
+            self._read_header(f)
+            for chunk in iter(lambda: f.read(chunk_size), b""):
+                yield chunk
+
+    def list_objects(self, prefix=None, limit=None, marker=None):
+        object_names = []
+        if limit is not None and limit <= 0:
+            return object_names
+        try:
+            for key in self._walk(self._objects_path, "/", prefix or "/",
+                                  marker):
+                object_names.append(key)
+                if limit is not None and len(object_names) >= limit:
+                    break
+        except OSError as err:
+            LOG.error(_LE("list objects failed, err: %s."), err)
+            raise exception.BankListObjectsFailed(reason=err)
+        return object_names
+
+    def acquire_lease(self):
+        path = os.path.join(self._leases_path, self.owner_id)
+        try:
+            if self._lease_file is None:
+                lease_file = open(path, "a+")
+                try:
+                    fcntl.lockf(lease_file, fcntl.LOCK_EX | fcntl.LOCK_NB)
+                except (OSError, IOError):
+                    lease_file.close()
+                    raise
+                self._lease_file = lease_file
+            self._touch_lease()
+        except (OSError, IOError) as err:
+            LOG.error(_LE("acquire lease failed, err:%s."), err)
+            raise exception.AcquireLeaseFailed(reason=err)
+
+    def renew_lease(self):
+        try:
+            self._touch_lease()
+        except (OSError, IOError) as err:
+            LOG.error(_LE("renew lease failed, err:%s."), err)
+
+    def check_lease_validity(self):
+        if (self.lease_expire_time - math.floor(time.time()) >=
+                self.lease_validity_window):
+            return True
+        else:
+            return False
+
+    def _touch_lease(self):
+        """Record the new lease expiry time in the locked lease file
+
+        The lease file stays locked for as long as this plugin lives, so
+        other bank users can tell live owners from stale lease files.
+        """
+        expire_time = math.floor(time.time()) + self.lease_expire_window
+        self._lease_file.seek(0)
+        self._lease_file.truncate()
+        self._lease_file.write("%d" % expire_time)
+        self._lease_file.flush()
+        self.lease_expire_time = expire_time
+
+    def _object_path(self, key):
+        return os.path.join(self._objects_path, key.lstrip("/"))
+
+    def _write_object(self, key, value):
+        serialized = False
+        if not isinstance(value, six.binary_type):
+            value = json.dumps(value).encode("utf-8")
+            serialized = True
+        header = _encode_header({"serialized": serialized,
+                                 "etag": hashlib.md5(value).hexdigest()})
+        self._write_file(self._object_path(key), [header, value])
+
+    @staticmethod
+    def _read_header(f):
+        """Read the metadata header of an open object file
+
+        Returns the metadata and the offset of the data, which is where the
+        file is left.
+        """
+        prefix = f.read(_HEADER_PREFIX.size)
+        if len(prefix) == _HEADER_PREFIX.size:
+            magic, length = _HEADER_PREFIX.unpack(prefix)
+            if magic == _HEADER_MAGIC:
+                metadata = json.loads(f.read(length).decode("utf-8"))
+                return metadata, _HEADER_PREFIX.size + length
+        raise IOError(errno.EINVAL, "Invalid object header", f.name)
+
+    def _read_object(self, key):
+        """Returns the metadata and the data of an object
+
+        Only the pages holding the data are mapped, the mapping offset is
+        rounded down to the allocation granularity as mmap requires.
+        """
+        with open(self._object_path(key), "rb") as f:
+            metadata, offset = self._read_header(f)
+            size = os.fstat(f.fileno()).st_size - offset
+            if size == 0 or size < self.mmap_threshold:
+                return metadata, f.read(size)
+            map_offset = offset - offset % mmap.ALLOCATIONGRANULARITY
+            start = offset - map_offset
+            mapped = mmap.mmap(f.fileno(), start + size,
+                               access=mmap.ACCESS_READ, offset=map_offset)
+            try:
+                return metadata, mapped[start:start + size]
+            finally:
+                mapped.close()
+
+    @classmethod
+    def _write_file(cls, path, chunks, header=None):
+        """Atomically replace the file at path with the given chunks
+
+        When given, header is called once all the chunks are written and
+        the bytes it returns overwrite the start of the file.
+        """
+        dir_name = os.path.dirname(path)
+        cls._makedirs(dir_name)
+        fd, temp_path = tempfile.mkstemp(dir=dir_name,
+                                         prefix=_TEMP_FILE_PREFIX)
+        try:
+            with os.fdopen(fd, "wb") as f:
+                for chunk in chunks:
+                    f.write(chunk)
+                if header is not None:
+                    f.seek(0)
+                    f.write(header())
+                f.flush()
+                os.fsync(f.fileno())
+            os.rename(temp_path, path)
+        except Exception:
+            try:
+                os.remove(temp_path)
+            except OSError:
+                pass
+            raise
+
+    @staticmethod
+    def _makedirs(path):
+        try:
+            os.makedirs(path)
+        except OSError as err:
+            if err.errno != errno.EEXIST or not os.path.isdir(path):
+                raise
+
+    def _walk(self, path, key_prefix, prefix, marker):
+        """Yield the keys below path in lexicographic order
+
+        Directory entries are sorted with a trailing '/' for directories, so
+        the order of the walk matches the order of the full keys. Directories
+        which can not hold keys matching the prefix or following the marker
+        are not entered.
+        """
+        try:
+            names = os.listdir(path)
+        except OSError as err:
+            if err.errno in (errno.ENOENT, errno.ENOTDIR):
+                return
+            raise
+
+        entries = []
+        for name in names:
+            if name.startswith(_TEMP_FILE_PREFIX):
+                continue
+            if os.path.isdir(os.path.join(path, name)):
+                entries.append((key_prefix + name + "/", name, True))
+            else:
+                entries.append((key_prefix + name, name, False))
+        entries.sort()
+
+        for key, name, is_dir in entries:
+            if is_dir:
+                if not (key.startswith(prefix) or prefix.startswith(key)):
+                    continue
+                if (marker is not None and marker >= key and
+                        not marker.startswith(key)):
+                    continue
+                for sub_key in self._walk(os.path.join(path, name), key,
+                                          prefix, marker):
+                    yield sub_key
+            else:
+                if not key.startswith(prefix):
+                    continue
+                if marker is not None and key <= marker:
+                    continue
+                yield key
+
+
+def _hash_chunks(md5, chunks):
+    for chunk in chunks:
+        md5.update(chunk)
+        yield chunk
@@ -0,0 +1,151 @@
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+
+import bisect
+import copy
+import hashlib
+import threading
+import time
+import uuid
+
+import eventlet
+from oslo_config import cfg
+from oslo_serialization import jsonutils
+import six
+
+from smaug import exception
+from smaug.services.protection.bank_plugin import BankPlugin
+from smaug.services.protection.bank_plugin import LeasePlugin
+
+memory_bank_plugin_opts = [
+    cfg.FloatOpt('memory_bank_latency',
+                 default=0,
+                 help='Time in seconds added to every bank operation, to '
+                      'emulate a remote bank'),
+]
+
+
+class MemoryBankPlugin(BankPlugin, LeasePlugin):
+    """Bank plugin keeping the objects in process memory
+
+    Objects are lost when the process exits, so this plugin is meant for
+    tests, development and benchmarks. Keys are kept sorted, so listings
+    with a prefix, a marker and a limit behave like those of the other
+    plugins.
+    """
+    def __init__(self, config=None, context=None):
+        super(MemoryBankPlugin, self).__init__(config)
+        self._latency = 0
+        if config is not None:
+            config.register_opts(memory_bank_plugin_opts,
+                                 "memory_bank_plugin")
+            self._latency = config.memory_bank_plugin.memory_bank_latency
+        self.context = context
+        self.owner_id = str(uuid.uuid4())
+        self._objects = {}
+        self._keys = []
+        self._lock = threading.Lock()
+
+    def _delay(self):
+        if self._latency > 0:
+            eventlet.sleep(self._latency)
+
+    def get_owner_id(self):
+        return self.owner_id
+
+    def create_object(self, key, value):
+        self._delay()
+        value = copy.deepcopy(value)
+        with self._lock:
+            if key not in self._objects:
+                bisect.insort(self._keys, key)
+            self._objects[key] = (value, time.time())
+
+    def update_object(self, key, value):
+        self.create_object(key, value)
+
+    def get_object(self, key):
+        self._delay()
+        with self._lock:
+            try:
+                value, _mtime = self._objects[key]
+            except KeyError:
+                raise exception.BankObjectNotFound(key=key)
+        return copy.deepcopy(value)
+
+    def get_object_range(self, key, offset, length=None):
+        self._delay()
+        with self._lock:
+            try:
+                value, _mtime = self._objects[key]
+            except KeyError:
+                raise exception.BankObjectNotFound(key=key)
+        if not isinstance(value, six.binary_type):
+            return super(MemoryBankPlugin, self).get_object_range(
+                key, offset, length)
+        if length is None:
+            return value[offset:]
+        return value[offset:offset + length]
+
+    def stat_object(self, key):
+        self._delay()
+        with self._lock:
+            try:
+                value, mtime = self._objects[key]
+            except KeyError:
+                raise exception.BankObjectNotFound(key=key)
+        if not isinstance(value, six.binary_type):
+            if not isinstance(value, six.text_type):
+                value = jsonutils.dumps(value)
+            value = value.encode("utf-8")
+        return {
+            "size": len(value),
+            "etag": hashlib.md5(value).hexdigest(),
+            "last_modified": mtime,
+            "metadata": {},
+        }
+
+    def list_objects(self, prefix=None, limit=None, marker=None):
+        self._delay()
+        prefix = prefix or ""
+        with self._lock:
+            start = bisect.bisect_left(self._keys, prefix)
+            if marker is not None:
+                start = max(start, bisect.bisect_right(self._keys, marker))
+            object_names = []
+            for index in range(start, len(self._keys)):
+                key = self._keys[index]
+                if limit is not None and len(object_names) >= limit:
+                    break
+                if not key.startswith(prefix):
+                    break
+                object_names.append(key)
+        return object_names
+
+    def delete_object(self, key):
+        self._delay()
+        with self._lock:
+            if self._objects.pop(key, None) is None:
+                raise exception.BankDeleteObjectFailed(
+                    reason="object not found", key=key)
+            del self._keys[bisect.bisect_left(self._keys, key)]
+
+    # The objects live and die with this process, so the lease of its
+    # owner can not expire
+    def acquire_lease(self):
+        pass
+
+    def renew_lease(self):
+        pass
+
+    def check_lease_validity(self):
+        return True
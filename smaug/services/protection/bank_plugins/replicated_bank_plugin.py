@@ -0,0 +1,482 @@
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+
+import threading
+import time
+
+import eventlet
+from eventlet import greenpool
+from eventlet import queue
+from oslo_config import cfg
+from oslo_log import log as logging
+from oslo_service import loopingcall
+
+from smaug import exception
+from smaug.i18n import _LE, _LI, _LW
+from smaug.services.protection import bank_plugin
+from smaug.services.protection.bank_plugin import BankPlugin
+
+replicated_bank_plugin_opts = [
+    cfg.ListOpt('replica_banks',
+                default=[],
+                help='Bank plugins holding replicas of the provider bank. '
+                     'An entry is a plugin name, optionally followed by '
+                     '":" and a configuration file for that replica. An '
+                     'empty list disables replication'),
+    cfg.IntOpt('write_quorum',
+               default=0,
+               help='The number of banks which must store a write before it '
+                    'succeeds, 0 means all of them. The remaining banks are '
+                    'written in the background'),
+    cfg.IntOpt('repair_interval',
+               default=60,
+               help='Interval, in seconds, between repairs of the banks '
+                    'which missed writes or deletes. 0 disables repairs'),
+    cfg.IntOpt('replica_retry_interval',
+               default=30,
+               help='Time, in seconds, a bank is only read from as a last '
+                    'resort after it failed'),
+]
+
+LOG = logging.getLogger(__name__)
+
+_WRITE = "write"
+_DELETE = "delete"
+
+# Weight of the latest read in the moving average of a replica's latency
+_LATENCY_WEIGHT = 0.2
+
+# The operations a bank missed are recorded below this prefix of the other
+# banks, as <prefix><bank index><key>, so repairs resume after a restart
+_LAGGING_PREFIX = "/replication/lagging/"
+
+
+def is_enabled(config):
+    config.register_opts(replicated_bank_plugin_opts,
+                         "replicated_bank_plugin")
+    return bool(config.replicated_bank_plugin.replica_banks)
+
+
+def parse_replica(replica):
+    """Split a replica entry into its plugin name and configuration file"""
+    plugin_name, _sep, config_file = replica.partition(":")
+    return plugin_name.strip(), config_file.strip() or None
+
+
+def _lagging_key(index, key):
+    return "%s%d%s" % (_LAGGING_PREFIX, index, key)
+
+
+def _parse_lagging_key(lagging_key):
+    """Split a lagging record key into the bank index and the key"""
+    index, _sep, key = lagging_key[len(_LAGGING_PREFIX):].partition("/")
+    return int(index), "/" + key
+
+
+class _Replica(object):
+    def __init__(self, index, plugin):
+        self.index = index
+        self.plugin = plugin
+        self.latency = None
+        self.failed_until = 0
+
+    def is_healthy(self):
+        return time.time() >= self.failed_until
+
+    def record_latency(self, latency):
+        if self.latency is None:
+            self.latency = latency
+        else:
+            self.latency += _LATENCY_WEIGHT * (latency - self.latency)
+
+    def record_failure(self, retry_interval):
+        self.failed_until = time.time() + retry_interval
+
+
+class ReplicatedBankPlugin(BankPlugin):
+    """Bank plugin replicating objects to several banks
+
+    Writes and deletes are sent to all the banks concurrently and succeed
+    once write_quorum of them did. Banks which fail, or have not finished
+    when the quorum is reached and then fail, are recorded as lagging for
+    the key and are repaired in the background from an up to date bank.
+
+    Operations on the same key are serialized, a write waits until all the
+    banks are done with the previous write or repair of its key, so the
+    banks never apply them out of order.
+
+    Reads go to the bank with the lowest recent latency which is not
+    lagging for the key, and fall back to the others on failure. Listings
+    use a bank without lagging keys.
+
+    The lagging keys are recorded in the other banks as well, and loaded
+    from them on start, so the repairs of operations missed before a
+    restart are not lost. Records refer to banks by their position in
+    replica_banks, which must not be reordered while any is lagging.
+    """
+    def __init__(self, config, plugins):
+        super(ReplicatedBankPlugin, self).__init__(config)
+        is_enabled(config)
+        plugin_config = config.replicated_bank_plugin
+        self._replicas = [_Replica(index, plugin)
+                          for index, plugin in enumerate(plugins)]
+        quorum = plugin_config.write_quorum or len(self._replicas)
+        self._quorum = min(max(quorum, 1), len(self._replicas))
+        self._retry_interval = plugin_config.replica_retry_interval
+        self._lock = threading.Lock()
+        # key -> {replica index: operation the replica missed}
+        self._lagging = {}
+        # key -> pool of the operation in progress on the key
+        self._pending = {}
+        self._load_lagging()
+
+        if plugin_config.repair_interval > 0:
+            repair_loop = loopingcall.FixedIntervalLoopingCall(self.repair)
+            repair_loop.start(interval=plugin_config.repair_interval,
+                              initial_delay=plugin_config.repair_interval)
+
+    @property
+    def plugins(self):
+        return [replica.plugin for replica in self._replicas]
+
+    def get_owner_id(self):
+        return self._replicas[0].plugin.get_owner_id()
+
+    def get_lagging(self):
+        """Returns a dict of the keys some banks missed operations on"""
+        with self._lock:
+            return {key: dict(operations)
+                    for key, operations in self._lagging.items()}
+
+    def _load_lagging(self):
+        """Load the lagging keys recorded in the banks"""
+        for replica in self._replicas:
+            try:
+                for lagging_key in replica.plugin.iter_objects(
+                        prefix=_LAGGING_PREFIX):
+                    index, key = _parse_lagging_key(lagging_key)
+                    if index >= len(self._replicas):
+                        continue
+                    operation = replica.plugin.get_object(lagging_key)
+                    self._lagging.setdefault(key, {})[index] = operation
+            except Exception as err:
+                LOG.warning(_LW("loading the lagging keys from bank "
+                                "%(index)d failed, err: %(err)s."),
+                            {"index": replica.index, "err": err})
+
+    def _mark_lagging(self, keys, index, operation):
+        with self._lock:
+            for key in keys:
+                self._lagging.setdefault(key, {})[index] = operation
+        records = {_lagging_key(index, key): operation for key in keys}
+        for replica in self._replicas:
+            if replica.index == index:
+                continue
+            try:
+                replica.plugin.create_objects(records)
+            except Exception as err:
+                LOG.warning(_LW("recording the lagging keys of bank "
+                                "%(lagging)d in bank %(index)d failed, "
+                                "err: %(err)s."),
+                            {"lagging": index, "index": replica.index,
+                             "err": err})
+
+    def _clear_lagging(self, keys, index, operation=None):
+        cleared = []
+        with self._lock:
+            for key in keys:
+                operations = self._lagging.get(key)
+                if operations is None or index not in operations:
+                    continue
+                if operation is None or operations[index] == operation:
+                    del operations[index]
+                    cleared.append(key)
+                if not operations:
+                    del self._lagging[key]
+        if not cleared:
+            return
+        records = [_lagging_key(index, key) for key in cleared]
+        for replica in self._replicas:
+            if replica.index == index:
+                continue
+            try:
+                self._delete_objects_from(replica.plugin, records)
+            except Exception as err:
+                LOG.warning(_LW("removing the lagging keys of bank "
+                                "%(lagging)d from bank %(index)d failed, "
+                                "err: %(err)s."),
+                            {"lagging": index, "index": replica.index,
+                             "err": err})
+
+    def _claim(self, keys, pool):
+        """Wait for the operations in progress on keys, then claim them"""
+        while True:
+            with self._lock:
+                pending = set(self._pending[key] for key in keys
+                              if key in self._pending)
+                if not pending:
+                    for key in keys:
+                        self._pending[key] = pool
+                    return
+            for other in pending:
+                other.waitall()
+            with self._lock:
+                for key in keys:
+                    if self._pending.get(key) in pending:
+                        del self._pending[key]
+
+    def _release(self, keys, pool):
+        pool.waitall()
+        with self._lock:
+            for key in keys:
+                if self._pending.get(key) is pool:
+                    del self._pending[key]
+
+    def _replicate(self, keys, operation, call, replicas=None,
+                   successes=0):
+        """Run call(plugin) on the banks and wait for the write quorum
+
+        Banks which fail are marked as lagging for keys. Raises the first
+        failure when the quorum can not be reached.
+        """
+        if replicas is None:
+            replicas = self._replicas
+        results = queue.LightQueue()
+        pool = greenpool.GreenPool(max(len(replicas), 1))
+
+        def _run(replica):
+            try:
+                call(replica.plugin)
+            except Exception as err:
+                LOG.warning(_LW("%(operation)s on bank %(index)d failed, "
+                                "err: %(err)s."),
+                            {"operation": operation, "index": replica.index,
+                             "err": err})
+                self._mark_lagging(keys, replica.index, operation)
+                results.put(err)
+            else:
+                # The latest operation supersedes the ones the bank missed
+                self._clear_lagging(keys, replica.index)
+                results.put(None)
+
+        self._claim(keys, pool)
+        try:
+            for replica in replicas:
+                pool.spawn_n(_run, replica)
+        finally:
+            eventlet.spawn_n(self._release, keys, pool)
+
+        failures = []
+        total = successes + len(replicas)
+        while (successes < self._quorum and
+               total - len(failures) >= self._quorum):
+            err = results.get()
+            if err is None:
+                successes += 1
+            else:
+                failures.append(err)
+        if successes < self._quorum:
+            raise failures[0]
+
+    def _candidates(self, key=None):
+        """Replicas to read from, the preferred ones first"""
+        with self._lock:
+            if key is None:
+                lagging = set(index for operations in self._lagging.values()
+                              for index in operations)
+            else:
+                lagging = set(self._lagging.get(key, ()))
+        candidates = [replica for replica in self._replicas
+                      if replica.index not in lagging]
+        # Banks lagging behind are better than none
+        return sorted(candidates or self._replicas,
+                      key=lambda replica: (not replica.is_healthy(),
+                                           replica.latency or 0))
+
+    def _read(self, key, call):
+        not_found = None
+        failure = None
+        for replica in self._candidates(key):
+            start = time.time()
+            try:
+                result = call(replica.plugin)
+            except exception.BankObjectNotFound as err:
+                not_found = err
+                continue
+            except Exception as err:
+                LOG.warning(_LW("reading from bank %(index)d failed, "
+                                "err: %(err)s."),
+                            {"index": replica.index, "err": err})
+                replica.record_failure(self._retry_interval)
+                failure = failure or err
+                continue
+            replica.record_latency(time.time() - start)
+            return result
+        if failure is not None:
+            raise failure
+        if not_found is not None:
+            raise not_found
+        raise exception.BankGetObjectFailed(
+            key=key, reason="no bank replica is available")
+
+    def create_object(self, key, value):
+        self._replicate([key], _WRITE,
+                        lambda plugin: plugin.create_object(key, value))
+
+    def update_object(self, key, value):
+        self._replicate([key], _WRITE,
+                        lambda plugin: plugin.update_object(key, value))
+
+    def delete_object(self, key):
+        self._replicate([key], _DELETE,
+                        lambda plugin: self._delete_from(plugin, key))
+
+    def delete_objects(self, keys):
+        keys = list(keys)
+        if keys:
+            self._replicate(keys, _DELETE,
+                            lambda plugin: self._delete_objects_from(plugin,
+                                                                     keys))
+
+    def get_object(self, key):
+        return self._read(key, lambda plugin: plugin.get_object(key))
+
+    def get_object_range(self, key, offset, length=None):
+        return self._read(key, lambda plugin: plugin.get_object_range(
+            key, offset, length))
+
+    def stat_object(self, key):
+        return self._read(key, lambda plugin: plugin.stat_object(key))
+
+    def list_objects(self, prefix=None, limit=None, marker=None):
+        return self._read(None, lambda plugin: plugin.list_objects(
+            prefix=prefix, limit=limit, marker=marker))
+
+    def iter_objects(self, prefix=None, marker=None,
+                     page_size=bank_plugin.DEFAULT_LIST_PAGE_SIZE):
+        replica = self._candidates()[0]
+        return replica.plugin.iter_objects(prefix=prefix, marker=marker,
+                                           page_size=page_size)
+
+    def put_object_stream(self, key, stream):
+        """Stores the stream in one bank and copies it to the others
+
+        The stream can only be read once, so it is written to the
+        preferred bank first and the other banks read it from there.
+        """
+        source = self._candidates()[0]
+        pool = greenpool.GreenPool(1)
+        self._claim([key], pool)
+        try:
+            source.plugin.put_object_stream(key, stream)
+        except Exception:
+            self._mark_lagging([key], source.index, _WRITE)
+            raise
+        finally:
+            self._release([key], pool)
+        self._clear_lagging([key], source.index)
+
+        others = [replica for replica in self._replicas
+                  if replica is not source]
+        self._replicate(
+            [key], _WRITE,
+            lambda plugin: plugin.put_object_stream(
+                key, source.plugin.get_object_stream(key)),
+            replicas=others, successes=1)
+
+    def get_object_stream(self, key,
+                          chunk_size=bank_plugin.DEFAULT_STREAM_CHUNK_SIZE):
+        def _open(plugin):
+            # Read the first chunk, so a missing object or an unavailable
+            # bank is detected while other banks can still be tried
+            chunks = iter(plugin.get_object_stream(key,
+                                                   chunk_size=chunk_size))
+            return next(chunks, None), chunks
+
+        first, chunks = self._read(key, _open)
+        return self._chain(first, chunks)
+
+    @staticmethod
+    def _chain(first, chunks):
+        if first is not None:
+            yield first
+        for chunk in chunks:
+            yield chunk
+
+    def repair(self):
+        """Replay the operations the lagging banks missed
+
+        Returns the number of repaired keys.
+        """
+        repaired = 0
+        for key, operations in self.get_lagging().items():
+            pool = greenpool.GreenPool(1)
+            self._claim([key], pool)
+            try:
+                if self._repair_key(key, operations):
+                    repaired += 1
+            finally:
+                self._release([key], pool)
+        if repaired:
+            LOG.info(_LI("Repaired %d keys of lagging banks"), repaired)
+        return repaired
+
+    def _repair_key(self, key, operations):
+        value = None
+        if _WRITE in operations.values():
+            try:
+                value = self.get_object(key)
+            except exception.SmaugException as err:
+                LOG.warning(_LW("reading %(key)s for repair failed, "
+                                "err: %(err)s."), {"key": key, "err": err})
+                return False
+
+        repaired = True
+        for index, operation in operations.items():
+            replica = self._replicas[index]
+            try:
+                if operation == _WRITE:
+                    replica.plugin.create_object(key, value)
+                else:
+                    self._delete_from(replica.plugin, key)
+            except Exception as err:
+                LOG.error(_LE("repairing %(key)s on bank %(index)d failed, "
+                              "err: %(err)s."),
+                          {"key": key, "index": index, "err": err})
+                repaired = False
+                continue
+            self._clear_lagging([key], index, operation)
+        return repaired
+
+    @staticmethod
+    def _delete_from(plugin, key):
+        """Delete an object from a bank, ignoring it if it is missing
+
+        A bank which missed the write of an object does not have it, and
+        some banks fail to delete missing objects.
+        """
+        try:
+            plugin.delete_object(key)
+        except exception.BankDeleteObjectFailed:
+            try:
+                plugin.stat_object(key)
+            except exception.BankObjectNotFound:
+                return
+            raise
+
+    @classmethod
+    def _delete_objects_from(cls, plugin, keys):
+        try:
+            plugin.delete_objects(keys)
+        except exception.BankDeleteObjectFailed:
+            for key in keys:
+                cls._delete_from(plugin, key)
@@ -10,16 +10,24 @@
 #    License for the specific language governing permissions and limitations
 #    under the License.
 
+import contextlib
+from email import utils as email_utils
+import hashlib
 import json
 import math
 import time
 import uuid
 
+from eventlet import greenpool
+from eventlet import pools
 from oslo_config import cfg
 from oslo_log import log as logging
 from oslo_service import loopingcall
+import six
+from six.moves.urllib import parse
 from smaug import exception
-from smaug.i18n import _, _LE
+from smaug.i18n import _, _LE, _LW
+from smaug.services.protection import bank_plugin
 from smaug.services.protection.bank_plugin import BankPlugin
 from smaug.services.protection.bank_plugin import LeasePlugin
 from smaug.services.protection import client_factory
@@ -29,15 +37,79 @@ swift_bank_plugin_opts = [
     cfg.StrOpt('bank_swift_object_container',
                default='smaug',
                help='The default swift container to use.'),
+    cfg.IntOpt('bank_swift_connection_pool_size',
+               default=8,
+               help='The maximum number of concurrent swift connections '
+                    'used by the bank'),
+    cfg.IntOpt('bank_swift_connection_max_idle',
+               default=60,
+               help='Swift connections idle for longer than this number of '
+                    'seconds are replaced by new ones on checkout'),
+    cfg.IntOpt('bank_swift_segment_size',
+               default=64 * 1024 * 1024,
+               help='Binary objects larger than this number of bytes are '
+                    'uploaded in segments of this size and stitched by a '
+                    'static large object manifest, 0 disables segmentation'),
+    cfg.IntOpt('bank_swift_segment_concurrency',
+               default=4,
+               help='The number of segments of an object uploaded in '
+                    'parallel'),
 ]
 
 LOG = logging.getLogger(__name__)
 
+_OBJECT_META_PREFIX = "x-object-meta-"
+_SEGMENTS_CONTAINER_SUFFIX = "_segments"
+_SEGMENTS_INFIX = "/slo/"
+# Deleting a static large object manifest with this query deletes its
+# segments as well, other objects are deleted as usual
+_MANIFEST_DELETE_QUERY = "multipart-manifest=delete"
+
 
 class SwiftConnectionFailed(exception.SmaugException):
     message = _("Connection to swift failed: %(reason)s")
 
 
+class _ConnectionPool(pools.Pool):
+    """Bounded pool of swift connections
+
+    A connection which failed with an authentication or transport error, or
+    which was idle for too long, is dropped and a new one is created on the
+    next checkout, refreshing its token and socket.
+    """
+    def __init__(self, create_connection, max_size, max_idle):
+        super(_ConnectionPool, self).__init__(max_size=max_size,
+                                              order_as_stack=True)
+        self._create_connection = create_connection
+        self._max_idle = max_idle
+
+    def create(self):
+        # Slots are filled lazily in connection() so a failed connection
+        # setup does not leak a slot of the pool
+        return None
+
+    @contextlib.contextmanager
+    def connection(self):
+        entry = self.get()
+        try:
+            if entry is None or time.time() - entry[1] > self._max_idle:
+                entry = None
+                entry = (self._create_connection(), time.time())
+            yield entry[0]
+        except ClientException as err:
+            if err.http_status is None or err.http_status == 401:
+                entry = None
+            raise
+        except GeneratorExit:
+            # A streamed response body was abandoned half read
+            entry = None
+            raise
+        finally:
+            if entry is not None:
+                entry = (entry[0], time.time())
+            self.put(entry)
+
+
 class SwiftBankPlugin(BankPlugin, LeasePlugin):
     def __init__(self, config, context):
         super(SwiftBankPlugin, self).__init__(config)
@@ -57,7 +129,17 @@ class SwiftBankPlugin(BankPlugin, LeasePlugin):
         self.owner_id = str(uuid.uuid4())
         self.lease_expire_time = 0
         self.bank_leases_container = "leases"
-        self.connection = self._setup_connection()
+        plugin_config = self._config.swift_bank_plugin
+        self._connection_pool = _ConnectionPool(
+            self._setup_connection,
+            max_size=plugin_config.bank_swift_connection_pool_size,
+            max_idle=plugin_config.bank_swift_connection_max_idle)
+        self._capabilities = None
+        self.bank_segments_container = (
+            self.bank_object_container + _SEGMENTS_CONTAINER_SUFFIX)
+        self._segments_container_created = False
+        self.segment_size = plugin_config.bank_swift_segment_size
+        self.segment_concurrency = plugin_config.bank_swift_segment_concurrency
 
         # create container
         try:
@@ -89,9 +171,11 @@ class SwiftBankPlugin(BankPlugin, LeasePlugin):
         return self.owner_id
 
     def create_object(self, key, value):
+        if self._is_large(value):
+            return self._put_large_object(key, value)
         serialized = False
         try:
-            if not isinstance(value, str):
+            if not isinstance(value, (str, six.binary_type)):
                 value = json.dumps(value)
                 serialized = True
             self._put_object(container=self.bank_object_container,
@@ -102,11 +186,14 @@ class SwiftBankPlugin(BankPlugin, LeasePlugin):
             LOG.error(_LE("create object failed, err: %s."), err)
             raise exception.BankCreateObjectFailed(reason=err,
                                                    key=key)
+        self._delete_old_segments(key)
 
     def update_object(self, key, value):
+        if self._is_large(value):
+            return self._put_large_object(key, value)
         serialized = False
         try:
-            if not isinstance(value, str):
+            if not isinstance(value, (str, six.binary_type)):
                 value = json.dumps(value)
                 serialized = True
             self._put_object(container=self.bank_object_container,
@@ -117,15 +204,270 @@ class SwiftBankPlugin(BankPlugin, LeasePlugin):
             LOG.error(_LE("update object failed, err: %s."), err)
             raise exception.BankUpdateObjectFailed(reason=err,
                                                    key=key)
+        self._delete_old_segments(key)
 
     def delete_object(self, key):
+        """Deletes the object, and the segments of a manifest
+
+        Swift answers a manifest delete with a bulk-style body which lists
+        the failures, so manifests are deleted through the bulk-delete
+        middleware whose response is checked, or by deleting the manifest
+        and then its segments when the cluster lacks bulk deletes.
+        """
         try:
+            headers = self._head_object(container=self.bank_object_container,
+                                        obj=key)
+            is_manifest = headers.get("x-static-large-object",
+                                      "").lower() == "true"
+            max_deletes = self._get_max_bulk_deletes()
+            if is_manifest and max_deletes:
+                result = self._bulk_delete(self.bank_object_container, [key],
+                                           delete_segments=True)
+                errors = result.get("Errors")
+                if errors:
+                    LOG.error(_LE("delete object failed, errors: %s."),
+                              errors)
+                    raise exception.BankDeleteObjectFailed(
+                        reason=errors[0][1], key=key)
+                if not result.get("Number Deleted"):
+                    raise exception.BankObjectNotFound(key=key)
+                return
             self._delete_object(container=self.bank_object_container,
                                 obj=key)
+        except exception.BankObjectNotFound:
+            raise exception.BankDeleteObjectFailed(reason="object not found",
+                                                   key=key)
         except SwiftConnectionFailed as err:
             LOG.error(_LE("delete object failed, err: %s."), err)
             raise exception.BankDeleteObjectFailed(reason=err,
                                                    key=key)
+        if is_manifest:
+            self._delete_segments(key + _SEGMENTS_INFIX)
+
+    def delete_objects(self, keys):
+        """Deletes the objects through the bulk-delete middleware
+
+        Objects which do not exist are ignored. Falls back to concurrent
+        single deletes when the cluster does not provide bulk deletes.
+        """
+        keys = list(keys)
+        max_deletes = self._get_max_bulk_deletes()
+        if not max_deletes:
+            return super(SwiftBankPlugin, self).delete_objects(keys)
+
+        self._bulk_delete_objects(self.bank_object_container, keys,
+                                  max_deletes, delete_segments=True)
+
+    def _bulk_delete_objects(self, container, keys, max_deletes,
+                             delete_segments=False):
+        for start in range(0, len(keys), max_deletes):
+            batch = keys[start:start + max_deletes]
+            try:
+                result = self._bulk_delete(container, batch,
+                                           delete_segments)
+            except SwiftConnectionFailed as err:
+                LOG.error(_LE("delete objects failed, err: %s."), err)
+                raise exception.BankDeleteObjectFailed(reason=err,
+                                                       key=batch[0])
+            errors = result.get("Errors")
+            if errors:
+                LOG.error(_LE("delete objects failed, errors: %s."), errors)
+                raise exception.BankDeleteObjectFailed(reason=errors[0][1],
+                                                       key=errors[0][0])
+
+    def _get_capabilities(self):
+        """Returns the capabilities of the cluster
+
+        They are cached once read, a failed read is retried by the next
+        call and meanwhile no optional middleware is assumed.
+        """
+        if self._capabilities is None:
+            try:
+                with self._connection_pool.connection() as connection:
+                    self._capabilities = connection.get_capabilities()
+            except ClientException as err:
+                LOG.warning(_LW("get swift capabilities failed, err: %s."),
+                            err)
+                return {}
+        return self._capabilities
+
+    def _get_max_bulk_deletes(self):
+        bulk_delete = self._get_capabilities().get("bulk_delete") or {}
+        return bulk_delete.get("max_deletes_per_request", 0)
+
+    def _get_segment_size(self, size=None):
+        """Returns the segment size to use, or 0 not to segment
+
+        The configured segment size is raised when the object would need
+        more segments than a manifest can hold.
+        """
+        slo = self._get_capabilities().get("slo")
+        if not self.segment_size or slo is None:
+            return 0
+        segment_size = max(self.segment_size,
+                           slo.get("min_segment_size", 0))
+        max_segments = slo.get("max_manifest_segments")
+        if size is not None and max_segments:
+            segment_size = max(segment_size,
+                               int(math.ceil(float(size) / max_segments)))
+        return segment_size
+
+    def _is_large(self, value):
+        if not isinstance(value, six.binary_type):
+            return False
+        segment_size = self._get_segment_size(len(value))
+        return bool(segment_size) and len(value) > segment_size
+
+    def _put_large_object(self, key, value):
+        segment_size = self._get_segment_size(len(value))
+        self._put_segmented(key, (value[start:start + segment_size]
+                                  for start in range(0, len(value),
+                                                     segment_size)))
+
+    def _put_segmented(self, key, segments):
+        """Upload segments in parallel and stitch them with a manifest
+
+        Segments are uploaded to the segments container under a name unique
+        to this upload, at most segment_concurrency at a time, so at most
+        that many segments are held in memory. The segments of the previous
+        version of the object are deleted once the manifest replaced it,
+        which lists the segments of the object.
+        """
+        upload_prefix = "%s%s%s/" % (key, _SEGMENTS_INFIX, uuid.uuid4().hex)
+        manifest = []
+        failures = []
+        pool = greenpool.GreenPool(self.segment_concurrency)
+
+        def _upload(index, data):
+            name = "%s%08d" % (upload_prefix, index)
+            try:
+                self._put_object(container=self.bank_segments_container,
+                                 obj=name,
+                                 contents=data)
+            except SwiftConnectionFailed as err:
+                failures.append(err)
+                return
+            manifest[index] = {
+                "path": "/%s/%s" % (self.bank_segments_container, name),
+                "etag": hashlib.md5(data).hexdigest(),
+                "size_bytes": len(data),
+            }
+
+        try:
+            self._create_segments_container()
+            for index, data in enumerate(segments):
+                if failures:
+                    break
+                manifest.append(None)
+                pool.spawn_n(_upload, index, data)
+            pool.waitall()
+            if failures:
+                raise failures[0]
+            self._put_object(container=self.bank_object_container,
+                             obj=key,
+                             contents=json.dumps(manifest),
+                             headers={'x-object-meta-serialized': False},
+                             query_string="multipart-manifest=put")
+        except SwiftConnectionFailed as err:
+            pool.waitall()
+            LOG.error(_LE("put segmented object failed, err: %s."), err)
+            self._delete_segments(upload_prefix)
+            raise exception.BankCreateObjectFailed(reason=err, key=key)
+        self._delete_segments(key + _SEGMENTS_INFIX, exclude=upload_prefix)
+
+    def _delete_old_segments(self, key):
+        """Delete the segments of a manifest replaced by a whole object"""
+        if self._get_segment_size():
+            self._delete_segments(key + _SEGMENTS_INFIX)
+
+    def _create_segments_container(self):
+        if not self._segments_container_created:
+            self._put_container(self.bank_segments_container)
+            self._segments_container_created = True
+
+    def _delete_segments(self, prefix, exclude=None):
+        """Delete the segments below prefix, except those below exclude
+
+        Errors are logged, leftover segments only waste space.
+        """
+        try:
+            names = [name for name in self._iter_segment_names(prefix)
+                     if exclude is None or not name.startswith(exclude)]
+            if not names:
+                return
+            max_deletes = self._get_max_bulk_deletes()
+            if max_deletes:
+                self._bulk_delete_objects(self.bank_segments_container,
+                                          names, max_deletes)
+            else:
+                for name in names:
+                    self._delete_object(self.bank_segments_container, name)
+        except (SwiftConnectionFailed,
+                exception.BankDeleteObjectFailed) as err:
+            LOG.warning(_LW("delete segments failed, err: %s."), err)
+
+    def _iter_segment_names(self, prefix):
+        marker = None
+        while True:
+            try:
+                body = self._get_container(self.bank_segments_container,
+                                           prefix=prefix, marker=marker)
+            except SwiftConnectionFailed as err:
+                reason = err.kwargs.get("reason")
+                if getattr(reason, "http_status", None) == 404:
+                    return
+                raise
+            names = [obj["name"] for obj in body if obj.get("name")]
+            if not names:
+                return
+            for name in names:
+                yield name
+            marker = names[-1]
+
+    def put_object_stream(self, key, stream):
+        """Uploads the stream with chunked transfer encoding
+
+        Streams longer than the segment size are uploaded in parallel
+        segments instead.
+        """
+        chunks = bank_plugin.iter_stream(stream)
+        segment_size = self._get_segment_size()
+        if segment_size:
+            segments = _iter_segments(chunks, segment_size)
+            first = next(segments, b"")
+            second = next(segments, None)
+            if second is not None:
+                return self._put_segmented(
+                    key, _prepend([first, second], segments))
+            chunks = [first]
+        try:
+            self._put_object(container=self.bank_object_container,
+                             obj=key,
+                             contents=chunks,
+                             headers={'x-object-meta-serialized': False})
+        except SwiftConnectionFailed as err:
+            LOG.error(_LE("put object stream failed, err: %s."), err)
+            raise exception.BankCreateObjectFailed(reason=err,
+                                                   key=key)
+        self._delete_old_segments(key)
+
+    def get_object_stream(self, key,
+                          chunk_size=bank_plugin.DEFAULT_STREAM_CHUNK_SIZE):
+        try:
+            # The connection stays checked out until the body is consumed
+            with self._connection_pool.connection() as connection:
+                (_resp, body) = connection.get_object(
+                    container=self.bank_object_container,
+                    obj=key,
+                    resp_chunk_size=chunk_size)
+                for chunk in body:
+                    yield chunk
+        except ClientException as err:
+            if err.http_status == 404:
+                raise exception.BankObjectNotFound(key=key)
+            LOG.error(_LE("get object stream failed, err: %s."), err)
+            raise exception.BankGetObjectFailed(reason=err,
+                                                key=key)
 
     def get_object(self, key):
         try:
@@ -136,6 +478,59 @@ class SwiftBankPlugin(BankPlugin, LeasePlugin):
             raise exception.BankGetObjectFailed(reason=err,
                                                 key=key)
 
+    def get_object_range(self, key, offset, length=None):
+        """Reads a part of the object with a Range request"""
+        if length is not None and length <= 0:
+            return b""
+        if length is None:
+            byte_range = "bytes=%d-" % offset
+        else:
+            byte_range = "bytes=%d-%d" % (offset, offset + length - 1)
+        try:
+            with self._connection_pool.connection() as connection:
+                (_resp, body) = connection.get_object(
+                    container=self.bank_object_container,
+                    obj=key,
+                    headers={"Range": byte_range})
+            return body
+        except ClientException as err:
+            if err.http_status == 404:
+                raise exception.BankObjectNotFound(key=key)
+            if err.http_status == 416:
+                # The range starts past the end of the object
+                return b""
+            LOG.error(_LE("get object range failed, err: %s."), err)
+            raise exception.BankGetObjectFailed(reason=err, key=key)
+
+    def stat_object(self, key):
+        """Returns the object attributes with a HEAD request"""
+        try:
+            headers = self._head_object(container=self.bank_object_container,
+                                        obj=key)
+        except SwiftConnectionFailed as err:
+            LOG.error(_LE("stat object failed, err: %s."), err)
+            raise exception.BankGetObjectFailed(reason=err,
+                                                key=key)
+        return {
+            "size": int(headers.get("content-length", 0)),
+            "etag": headers.get("etag"),
+            "last_modified": self._last_modified(headers),
+            "metadata": {
+                name[len(_OBJECT_META_PREFIX):]: value
+                for name, value in headers.items()
+                if name.startswith(_OBJECT_META_PREFIX)},
+        }
+
+    @staticmethod
+    def _last_modified(headers):
+        if headers.get("x-timestamp"):
+            return float(headers["x-timestamp"])
+        if headers.get("last-modified"):
+            parsed = email_utils.parsedate_tz(headers["last-modified"])
+            if parsed is not None:
+                return float(email_utils.mktime_tz(parsed))
+        return None
+
     def list_objects(self, prefix=None, limit=None, marker=None):
         object_names = []
         try:
@@ -187,53 +582,107 @@ class SwiftBankPlugin(BankPlugin, LeasePlugin):
         else:
             return False
 
-    def _put_object(self, container, obj, contents, headers=None):
+    def _put_object(self, container, obj, contents, headers=None,
+                    query_string=None):
         try:
-            self.connection.put_object(container=container,
-                                       obj=obj,
-                                       contents=contents,
-                                       headers=headers)
+            with self._connection_pool.connection() as connection:
+                connection.put_object(container=container,
+                                      obj=obj,
+                                      contents=contents,
+                                      headers=headers,
+                                      query_string=query_string)
         except ClientException as err:
             raise SwiftConnectionFailed(reason=err)
 
     def _get_object(self, container, obj):
         try:
-            (_resp, body) = self.connection.get_object(container=container,
-                                                       obj=obj)
+            with self._connection_pool.connection() as connection:
+                (_resp, body) = connection.get_object(container=container,
+                                                      obj=obj)
             if _resp.get("x-object-meta-serialized").lower() == "true":
                 body = json.loads(body)
             return body
+        except ClientException as err:
+            if err.http_status == 404:
+                raise exception.BankObjectNotFound(key=obj)
+            raise SwiftConnectionFailed(reason=err)
+
+    def _head_object(self, container, obj):
+        try:
+            with self._connection_pool.connection() as connection:
+                return connection.head_object(container=container, obj=obj)
+        except ClientException as err:
+            if err.http_status == 404:
+                raise exception.BankObjectNotFound(key=obj)
+            raise SwiftConnectionFailed(reason=err)
+
+    def _bulk_delete(self, container, objs, delete_segments=False):
+        data = "\n".join(parse.quote("%s/%s" % (container, obj))
+                         for obj in objs)
+        query_string = "bulk-delete"
+        if delete_segments:
+            query_string += "&" + _MANIFEST_DELETE_QUERY
+        try:
+            with self._connection_pool.connection() as connection:
+                (_resp, body) = connection.post_account(
+                    headers={"Content-Type": "text/plain",
+                             "Accept": "application/json"},
+                    query_string=query_string,
+                    data=data)
+            return json.loads(body)
         except ClientException as err:
             raise SwiftConnectionFailed(reason=err)
 
     def _post_object(self, container, obj, headers):
         try:
-            self.connection.post_object(container=container,
-                                        obj=obj,
-                                        headers=headers)
+            with self._connection_pool.connection() as connection:
+                connection.post_object(container=container,
+                                       obj=obj,
+                                       headers=headers)
         except ClientException as err:
             raise SwiftConnectionFailed(reason=err)
 
     def _delete_object(self, container, obj):
         try:
-            self.connection.delete_object(container=container,
-                                          obj=obj)
+            with self._connection_pool.connection() as connection:
+                connection.delete_object(container=container,
+                                         obj=obj)
         except ClientException as err:
             raise SwiftConnectionFailed(reason=err)
 
     def _put_container(self, container):
         try:
-            self.connection.put_container(container=container)
+            with self._connection_pool.connection() as connection:
+                connection.put_container(container=container)
         except ClientException as err:
             raise SwiftConnectionFailed(reason=err)
 
     def _get_container(self, container, prefix=None, limit=None, marker=None):
         try:
-            (_resp, body) = self.connection.get_container(
-                container=container,
-                prefix=prefix,
-                limit=limit,
-                marker=marker)
+            with self._connection_pool.connection() as connection:
+                (_resp, body) = connection.get_container(
+                    container=container,
+                    prefix=prefix,
+                    limit=limit,
+                    marker=marker)
             return body
         except ClientException as err:
             raise SwiftConnectionFailed(reason=err)
+
+
+def _iter_segments(chunks, segment_size):
+    buf = bytearray()
+    for chunk in chunks:
+        buf.extend(chunk)
+        while len(buf) >= segment_size:
+            yield bytes(buf[:segment_size])
+            del buf[:segment_size]
+    if buf:
+        yield bytes(buf)
+
+
+def _prepend(first, rest):
+    for item in first:
+        yield item
+    for item in rest:
+        yield item
@@ -0,0 +1,346 @@
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+
+import collections
+import re
+import threading
+
+from oslo_config import cfg
+from oslo_log import log as logging
+from oslo_serialization import jsonutils
+import six
+
+from smaug import exception
+from smaug.i18n import _LI, _LW
+from smaug.services.protection import bank_plugin
+from smaug.services.protection.bank_plugin import BankPlugin
+
+tiered_bank_plugin_opts = [
+    cfg.StrOpt('local_bank_plugin',
+               default='',
+               help='The bank plugin holding local copies of the most '
+                    'recently used checkpoints, an empty value disables '
+                    'tiering'),
+    cfg.IntOpt('local_max_checkpoints',
+               default=2,
+               help='The maximum number of checkpoints kept in the local '
+                    'bank, 0 means no limit'),
+    cfg.IntOpt('local_max_size',
+               default=0,
+               help='The maximum total size in bytes of the checkpoints '
+                    'kept in the local bank, 0 means no limit'),
+]
+
+LOG = logging.getLogger(__name__)
+
+# Keys of the resource data of a checkpoint, the first group is its id.
+# Checkpoint metadata, such as the index with the status, is updated by
+# other nodes as well, so it is not kept locally
+_RESOURCE_DATA_KEY_PATTERN = re.compile(r"^/resource-data/([^/]+)/")
+
+
+def is_enabled(config):
+    config.register_opts(tiered_bank_plugin_opts, "tiered_bank_plugin")
+    return bool(config.tiered_bank_plugin.local_bank_plugin)
+
+
+def checkpoint_of_key(key):
+    """Returns the id of the checkpoint a resource data key belongs to
+
+    Returns None for any other key.
+    """
+    match = _RESOURCE_DATA_KEY_PATTERN.match(key)
+    if match:
+        return match.group(1)
+    return None
+
+
+def _value_size(value):
+    if isinstance(value, six.binary_type):
+        return len(value)
+    if not isinstance(value, six.text_type):
+        value = jsonutils.dumps(value)
+    return len(value.encode("utf-8"))
+
+
+class TieredBankPlugin(BankPlugin):
+    """Bank plugin keeping recent checkpoints in a local bank
+
+    Every write goes through to the remote bank, which stays the
+    authoritative copy of all the objects. The resource data of the most
+    recently used checkpoints is also kept in the local bank, and reads of
+    it are served locally. Checkpoints are evicted from the local bank in least
+    recently used order when there are more than local_max_checkpoints of
+    them or they take more than local_max_size bytes. The checkpoint used
+    last is never evicted, even if it alone exceeds the size budget.
+
+    Other objects, including the checkpoint metadata and indices, as well
+    as listings, are always served by the remote bank, so reading them
+    neither evicts resource data nor returns copies which went stale when
+    another node updated them.
+    """
+    def __init__(self, config, remote_plugin, local_plugin):
+        super(TieredBankPlugin, self).__init__(config)
+        is_enabled(config)
+        plugin_config = config.tiered_bank_plugin
+        self._remote = remote_plugin
+        self._local = local_plugin
+        self._max_checkpoints = plugin_config.local_max_checkpoints
+        self._max_size = plugin_config.local_max_size
+        self._lock = threading.Lock()
+        # checkpoint id -> {key: size}, in least recently used order
+        self._checkpoints = collections.OrderedDict()
+        self._size = 0
+        self._load_local_index()
+
+    @property
+    def plugin(self):
+        return self._remote
+
+    @property
+    def local_plugin(self):
+        return self._local
+
+    def _load_local_index(self):
+        """Index the objects left in the local bank by a previous run
+
+        Checkpoints are ordered by the time they were last written.
+        """
+        last_modified = {}
+        try:
+            for key in self._local.iter_objects():
+                checkpoint_id = checkpoint_of_key(key)
+                if checkpoint_id is None:
+                    continue
+                stat = self._local.stat_object(key)
+                self._add_key(checkpoint_id, key, stat["size"])
+                last_modified[checkpoint_id] = max(
+                    last_modified.get(checkpoint_id, 0),
+                    stat["last_modified"] or 0)
+        except exception.SmaugException as err:
+            LOG.warning(_LW("indexing the local bank failed, err: %s."), err)
+        self._checkpoints = collections.OrderedDict(
+            sorted(self._checkpoints.items(),
+                   key=lambda item: last_modified.get(item[0], 0)))
+        LOG.info(_LI("Found %(count)d checkpoints (%(size)d bytes) in the "
+                     "local bank"),
+                 {"count": len(self._checkpoints), "size": self._size})
+        self._evict()
+
+    def _add_key(self, checkpoint_id, key, size):
+        keys = self._checkpoints.pop(checkpoint_id, {})
+        self._size += size - keys.get(key, 0)
+        keys[key] = size
+        self._checkpoints[checkpoint_id] = keys
+
+    def _touch(self, checkpoint_id):
+        """Mark a checkpoint as used, returns whether it is local"""
+        with self._lock:
+            keys = self._checkpoints.pop(checkpoint_id, None)
+            if keys is None:
+                return False
+            self._checkpoints[checkpoint_id] = keys
+            return True
+
+    def _is_local(self, key):
+        with self._lock:
+            keys = self._checkpoints.get(checkpoint_of_key(key))
+            return keys is not None and key in keys
+
+    def _forget(self, key):
+        with self._lock:
+            keys = self._checkpoints.get(checkpoint_of_key(key))
+            if keys is not None and key in keys:
+                self._size -= keys.pop(key)
+
+    def _over_budget(self):
+        return ((self._max_checkpoints and
+                 len(self._checkpoints) > self._max_checkpoints) or
+                (self._max_size and self._size > self._max_size))
+
+    def _evict(self):
+        evicted = []
+        with self._lock:
+            while len(self._checkpoints) > 1 and self._over_budget():
+                checkpoint_id, keys = self._checkpoints.popitem(last=False)
+                self._size -= sum(keys.values())
+                evicted.append((checkpoint_id, list(keys)))
+        for checkpoint_id, keys in evicted:
+            LOG.debug("Evicting checkpoint %s from the local bank",
+                      checkpoint_id)
+            try:
+                self._local.delete_objects(keys)
+            except exception.SmaugException as err:
+                LOG.warning(_LW("evicting checkpoint %(id)s from the local "
+                                "bank failed, err: %(err)s."),
+                            {"id": checkpoint_id, "err": err})
+
+    def _store_local(self, key, value):
+        checkpoint_id = checkpoint_of_key(key)
+        if checkpoint_id is None:
+            return
+        try:
+            self._local.create_object(key, value)
+        except exception.SmaugException as err:
+            LOG.warning(_LW("writing %(key)s to the local bank failed, "
+                            "err: %(err)s."), {"key": key, "err": err})
+            self._drop_local(key)
+            return
+        with self._lock:
+            self._add_key(checkpoint_id, key, _value_size(value))
+        self._evict()
+
+    def _drop_local(self, key):
+        self._forget(key)
+        try:
+            self._local.delete_object(key)
+        except exception.SmaugException:
+            pass
+
+    def get_owner_id(self):
+        return self._remote.get_owner_id()
+
+    def create_object(self, key, value):
+        try:
+            self._remote.create_object(key, value)
+        except Exception:
+            self._drop_local(key)
+            raise
+        self._store_local(key, value)
+
+    def update_object(self, key, value):
+        try:
+            self._remote.update_object(key, value)
+        except Exception:
+            self._drop_local(key)
+            raise
+        self._store_local(key, value)
+
+    def get_object(self, key):
+        checkpoint_id = checkpoint_of_key(key)
+        if checkpoint_id is None:
+            return self._remote.get_object(key)
+        if self._is_local(key):
+            self._touch(checkpoint_id)
+            try:
+                return self._local.get_object(key)
+            except exception.SmaugException as err:
+                LOG.warning(_LW("reading %(key)s from the local bank "
+                                "failed, err: %(err)s."),
+                            {"key": key, "err": err})
+                self._forget(key)
+        value = self._remote.get_object(key)
+        self._store_local(key, value)
+        return value
+
+    def get_object_range(self, key, offset, length=None):
+        """Reads a range locally, or from the remote bank
+
+        A range read does not copy the object to the local bank, the point
+        of reading a range is not to transfer the whole object.
+        """
+        if self._is_local(key):
+            self._touch(checkpoint_of_key(key))
+            try:
+                return self._local.get_object_range(key, offset, length)
+            except exception.SmaugException as err:
+                LOG.warning(_LW("reading %(key)s from the local bank "
+                                "failed, err: %(err)s."),
+                            {"key": key, "err": err})
+                self._forget(key)
+        return self._remote.get_object_range(key, offset, length)
+
+    def stat_object(self, key):
+        if self._is_local(key):
+            try:
+                return self._local.stat_object(key)
+            except exception.SmaugException:
+                self._forget(key)
+        return self._remote.stat_object(key)
+
+    def list_objects(self, prefix=None, limit=None, marker=None):
+        return self._remote.list_objects(prefix=prefix, limit=limit,
+                                         marker=marker)
+
+    def iter_objects(self, prefix=None, marker=None,
+                     page_size=bank_plugin.DEFAULT_LIST_PAGE_SIZE):
+        return self._remote.iter_objects(prefix=prefix, marker=marker,
+                                         page_size=page_size)
+
+    def delete_object(self, key):
+        self._remote.delete_object(key)
+        if self._is_local(key):
+            self._drop_local(key)
+
+    def delete_objects(self, keys):
+        keys = list(keys)
+        self._remote.delete_objects(keys)
+        local_keys = [key for key in keys if self._is_local(key)]
+        for key in local_keys:
+            self._forget(key)
+        if local_keys:
+            try:
+                self._local.delete_objects(local_keys)
+            except exception.SmaugException as err:
+                LOG.warning(_LW("deleting objects from the local bank "
+                                "failed, err: %s."), err)
+
+    def put_object_stream(self, key, stream):
+        """Stores the stream in both banks
+
+        The data is written to the local bank first and streamed from there
+        to the remote bank, so it is never held in memory.
+        """
+        checkpoint_id = checkpoint_of_key(key)
+        if checkpoint_id is None:
+            return self._remote.put_object_stream(key, stream)
+        try:
+            self._local.put_object_stream(key, stream)
+        except exception.SmaugException as err:
+            # The stream may be partly consumed, the remote write can not
+            # be retried from it
+            self._drop_local(key)
+            raise exception.BankCreateObjectFailed(reason=err, key=key)
+        try:
+            self._remote.put_object_stream(
+                key, self._local.get_object_stream(key))
+        except Exception:
+            self._drop_local(key)
+            raise
+        size = self._local.stat_object(key)["size"]
+        with self._lock:
+            self._add_key(checkpoint_id, key, size)
+        self._evict()
+
+    def get_object_stream(self, key,
+                          chunk_size=bank_plugin.DEFAULT_STREAM_CHUNK_SIZE):
+        checkpoint_id = checkpoint_of_key(key)
+        if checkpoint_id is None:
+            return self._remote.get_object_stream(key, chunk_size=chunk_size)
+        if not self._is_local(key):
+            try:
+                self._local.put_object_stream(
+                    key, self._remote.get_object_stream(key))
+                size = self._local.stat_object(key)["size"]
+            except exception.BankObjectNotFound:
+                raise
+            except exception.SmaugException as err:
+                LOG.warning(_LW("copying %(key)s to the local bank failed, "
+                                "err: %(err)s."), {"key": key, "err": err})
+                self._drop_local(key)
+                return self._remote.get_object_stream(key,
+                                                      chunk_size=chunk_size)
+            with self._lock:
+                self._add_key(checkpoint_id, key, size)
+            self._evict()
+        self._touch(checkpoint_id)
+        return self._local.get_object_stream(key, chunk_size=chunk_size)
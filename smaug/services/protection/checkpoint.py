@@ -9,12 +9,19 @@
 #    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
 #    License for the specific language governing permissions and limitations
 #    under the License.
+import calendar
+import itertools
 from uuid import uuid4 as uuid
 
 from oslo_config import cfg
 from oslo_log import log as logging
+from oslo_utils import timeutils
 
+from smaug.common import constants
+from smaug import exception
+from smaug.i18n import _, _LW
 from smaug import resource
+from smaug.services.protection import bank_plugin
 from smaug.services.protection.bank_plugin import BankSection
 from smaug.services.protection import graph
 
@@ -25,10 +32,133 @@ LOG = logging.getLogger(__name__)
 _INDEX_FILE_SUFFIX = ".index.json"
 
 
+_INDICES_PREFIX = "/indices"
+_BY_PLAN_PREFIX = _INDICES_PREFIX + "/by-plan"
+_BY_STATUS_PREFIX = _INDICES_PREFIX + "/by-status"
+_BY_TIME_PREFIX = _INDICES_PREFIX + "/by-time"
+# Milliseconds since the epoch stay below this until the year 2286
+_MAX_TIMESTAMP = 10 ** 13
+# The first 48 bits of time ordered checkpoint ids, then the version nibble
+_ID_TIMESTAMP_BITS = 48
+_ID_VERSION = "0"
+
+
 def _checkpoint_id_to_index_file(checkpoint_id):
     return "/%s%s" % (checkpoint_id, _INDEX_FILE_SUFFIX)
 
 
+def _milliseconds(created_at):
+    if not created_at:
+        return 0
+    if not hasattr(created_at, "utctimetuple"):
+        created_at = timeutils.parse_isotime(created_at)
+    return (calendar.timegm(created_at.utctimetuple()) * 1000 +
+            created_at.microsecond // 1000)
+
+
+def _inverted_timestamp(created_at):
+    """Returns a fixed width key part which sorts newer times first
+
+    Checkpoints without a creation time sort last.
+    """
+    return _inverted_milliseconds(_milliseconds(created_at))
+
+
+def _inverted_milliseconds(milliseconds):
+    return "%013d" % (_MAX_TIMESTAMP - 1 - milliseconds)
+
+
+def _time_ordered_id(created_at):
+    """Returns a UUID shaped id which sorts newer times first
+
+    The first 12 hex digits are the inverted milliseconds since the epoch,
+    followed by the version nibble "0", which random uuid4 ids never have
+    there, and 76 random bits.
+    """
+    inverted = (1 << _ID_TIMESTAMP_BITS) - 1 - _milliseconds(created_at)
+    digits = "%012x%s%s" % (inverted, _ID_VERSION, uuid().hex[13:])
+    return "-".join((digits[:8], digits[8:12], digits[12:16],
+                     digits[16:20], digits[20:]))
+
+
+def _time_ordered_id_prefix(created_at):
+    """Returns the leading part of the time ordered ids of a time"""
+    inverted = (1 << _ID_TIMESTAMP_BITS) - 1 - _milliseconds(created_at)
+    digits = "%012x" % inverted
+    return "%s-%s" % (digits[:8], digits[8:])
+
+
+def parse_date(value, name):
+    """Parse an ISO 8601 date filter, raises InvalidInput if malformed"""
+    if value is None or hasattr(value, "utctimetuple"):
+        return value
+    try:
+        return timeutils.parse_isotime(value)
+    except (ValueError, TypeError):
+        raise exception.InvalidInput(
+            reason=_("%(name)s is not an ISO 8601 date: %(value)s") %
+            {"name": name, "value": value})
+
+
+def _is_time_ordered_id(checkpoint_id):
+    """Whether the id sorts by creation time rather than being random"""
+    return len(checkpoint_id) == 36 and checkpoint_id[14] == _ID_VERSION
+
+
+def _id_milliseconds(checkpoint_id):
+    """Returns the creation time held by a time ordered id"""
+    inverted = int(checkpoint_id.replace("-", "")[:12], 16)
+    return (1 << _ID_TIMESTAMP_BITS) - 1 - inverted
+
+
+def _index_entry_name(created_at, checkpoint_id):
+    return "%s-%s" % (_inverted_timestamp(created_at), checkpoint_id)
+
+
+def _index_entry_keys(md):
+    """Returns the by-plan and by-status index keys of a checkpoint"""
+    name = _index_entry_name(md.get("created_at"), md["id"])
+    plan_id = md.get("protection_plan", {}).get("id")
+    return ("%s/%s/%s" % (_BY_PLAN_PREFIX, plan_id, name),
+            "%s/%s/%s" % (_BY_STATUS_PREFIX, md["status"], name))
+
+
+def _index_entry_value(md):
+    return {
+        "id": md["id"],
+        "plan_id": md.get("protection_plan", {}).get("id"),
+        "status": md["status"],
+        "created_at": md.get("created_at"),
+    }
+
+
+def _time_entry_key(checkpoint_id):
+    return "%s/%s" % (_BY_TIME_PREFIX, checkpoint_id)
+
+
+def checkpoint_of_index_entry(key):
+    """Returns the id of the checkpoint an index entry key belongs to"""
+    name = key.rsplit("/", 1)[-1]
+    if key.startswith(_BY_TIME_PREFIX + "/"):
+        return name
+    # By-plan and by-status entries start with the inverted timestamp
+    return name.split("-", 1)[-1]
+
+
+def _index_entries(md):
+    """Returns all the index entries of a checkpoint
+
+    Only checkpoints with a time ordered id have a by-time entry, which is
+    named after the id alone and never changes.
+    """
+    value = _index_entry_value(md)
+    entries = {key: value for key in _index_entry_keys(md)}
+    if _is_time_ordered_id(md["id"]):
+        entries[_time_entry_key(md["id"])] = {
+            "id": md["id"], "created_at": md.get("created_at")}
+    return entries
+
+
 class Checkpoint(object):
     VERSION = "0.9"
     SUPPORTED_VERSIONS = ["0.9"]
@@ -75,6 +205,29 @@ class Checkpoint(object):
     def protection_plan(self):
         return self._md_cache["protection_plan"]
 
+    @property
+    def project_id(self):
+        # Checkpoints created before this field was introduced have no
+        # project
+        return self._md_cache.get("project_id")
+
+    @property
+    def usage(self):
+        """The size in bytes and number of objects of the resource data
+
+        None when the bank does not track usage.
+        """
+        bank = self._bank_section.bank
+        if not bank.tracks_usage:
+            return None
+        return bank.get_usage([self._id])[self._id]
+
+    @property
+    def created_at(self):
+        # Checkpoints created before this field was introduced have no
+        # creation time
+        return self._md_cache.get("created_at")
+
     @status.setter
     def status(self, value):
         self._md_cache["status"] = value
@@ -98,10 +251,11 @@ class Checkpoint(object):
         new_md = self._bank_section.get_object(self._index_file_path)
         self._assert_supported_version(new_md)
         self._md_cache = new_md
+        self._indexed_status = new_md["status"]
 
     @classmethod
-    def _generate_id(self):
-        return str(uuid())
+    def _generate_id(cls, created_at=None):
+        return _time_ordered_id(created_at or timeutils.utcnow())
 
     @classmethod
     def get_by_section(cls, bank_section, bank_lease, checkpoint_id):
@@ -110,40 +264,71 @@ class Checkpoint(object):
     @classmethod
     def create_in_section(cls, bank_section, bank_lease, owner_id,
                           plan, checkpoint_id=None):
-        checkpoint_id = checkpoint_id or cls._generate_id()
+        created_at = timeutils.utcnow()
+        checkpoint_id = checkpoint_id or cls._generate_id(created_at)
+        md = {
+            "version": cls.VERSION,
+            "id": checkpoint_id,
+            "status": "protecting",
+            "owner_id": owner_id,
+            "project_id": plan.get("project_id"),
+            "created_at": created_at.isoformat(),
+            "protection_plan": {
+                "id": plan.get("id"),
+                "name": plan.get("name"),
+                "resources": plan.get("resources")
+            }
+        }
+        # The index entries are written first, an interrupted create leaves
+        # entries without a checkpoint, which listings skip, rather than a
+        # checkpoint missing from the listings
+        bank_section.bank.create_objects(_index_entries(md))
         bank_section.create_object(
             key=_checkpoint_id_to_index_file(checkpoint_id),
-            value={
-                "version": cls.VERSION,
-                "id": checkpoint_id,
-                "status": "protecting",
-                "owner_id": owner_id,
-                "protection_plan": {
-                    "id": plan.get("id"),
-                    "name": plan.get("name"),
-                    "resources": plan.get("resources")
-                }
-            }
+            value=md,
         )
         return Checkpoint(bank_section,
                           bank_lease,
                           checkpoint_id)
 
-    def commit(self):
+    def commit(self, deferred=False):
+        """Write the index of the checkpoint
+
+        A deferred commit may be queued by the write-behind queue of the
+        bank. Other commits first write out all queued writes, so the index
+        never claims more than what reached the bank.
+        """
         if self._bank_lease is not None:
-            if self._bank_lease.check_lease_validity():
-                self._bank_section.create_object(
-                    key=self._index_file_path,
-                    value=self._md_cache,
-                )
-            else:
+            if not self._bank_lease.check_lease_validity():
                 raise RuntimeError("Could not commit: lease isn't valid "
                                    "for enough commit time")
-        else:
-            self._bank_section.create_object(
-                key=self._index_file_path,
-                value=self._md_cache,
-            )
+        if not deferred:
+            self._bank_section.bank.flush()
+        status_changed = self._md_cache["status"] != self._indexed_status
+        if status_changed:
+            # Both entries of the new status exist before the index is
+            # written, the stale status entry is dropped after it
+            value = _index_entry_value(self._md_cache)
+            self._bank_section.bank.create_objects(
+                {key: value for key in _index_entry_keys(self._md_cache)})
+        self._bank_section.create_object(
+            key=self._index_file_path,
+            value=self._md_cache,
+            deferred=deferred,
+        )
+        if status_changed:
+            stale_md = dict(self._md_cache, status=self._indexed_status)
+            self._delete_index_entries(_index_entry_keys(stale_md)[1:])
+            self._indexed_status = self._md_cache["status"]
+
+    def _delete_index_entries(self, keys):
+        for key in keys:
+            try:
+                self._bank_section.bank.delete_object(key)
+            except exception.SmaugException as err:
+                LOG.warning(_LW("deleting checkpoint index entry %(key)s "
+                                "failed, err: %(err)s"),
+                            {"key": key, "err": err})
 
     def purge(self):
         """Purge the index file of the checkpoint.
@@ -151,15 +336,53 @@ class Checkpoint(object):
         Can only be done if the checkpoint has no other files apart from the
         index.
         """
-        all_objects = self._bank_section.list_objects(prefix=self.id)
+        # Two keys are enough to tell whether anything but the index is left
+        all_objects = list(itertools.islice(
+            self._bank_section.iter_objects(prefix=self.id, page_size=2), 2))
         if (
             len(all_objects) == 1
             and all_objects[0] == self._index_file_path
         ) or len(all_objects) == 0:
             self._bank_section.delete_object(self._index_file_path)
+            self._delete_index_entries(sorted(_index_entries(self._md_cache)))
         else:
             raise RuntimeError("Could not delete: Checkpoint is not empty")
 
+    def get_previous(self, status=constants.CHECKPOINT_STATUS_AVAILABLE):
+        """Return the latest older checkpoint of the same protection plan
+
+        Only checkpoints in the given status are considered. The by-plan
+        index is walked newest first from the entry of this checkpoint, so
+        checkpoints written before the index existed are only found once
+        the indices are rebuilt. Returns None if there is no such
+        checkpoint.
+        """
+        bank = self._bank_section.bank
+        prefix = "%s/%s" % (_BY_PLAN_PREFIX, self.protection_plan.get("id"))
+        marker = "%s/%s" % (prefix,
+                            _index_entry_name(self.created_at, self._id))
+        for key in bank.iter_objects(prefix=prefix, marker=marker):
+            try:
+                entry = bank.get_object(key)
+            except exception.BankObjectNotFound:
+                continue
+            if not isinstance(entry, dict) or entry.get("status") != status:
+                continue
+            checkpoint_id = key.rsplit("/", 1)[-1].split("-", 1)[1]
+            try:
+                previous = Checkpoint(self._bank_section, self._bank_lease,
+                                      checkpoint_id)
+            except exception.BankObjectNotFound:
+                # An entry left by an interrupted create or delete
+                continue
+            except RuntimeError:
+                LOG.warning(_LW("skipping checkpoint %(id)s: unsupported "
+                                "index"), {"id": checkpoint_id})
+                continue
+            if previous.status == status:
+                return previous
+        return None
+
     def get_resource_bank_section(self, resource_id):
         prefix = "/resource-data/%s/%s/" % (self._id, resource_id)
         return BankSection(self._bank_section.bank, prefix)
@@ -173,15 +396,223 @@ class CheckpointCollection(object):
         self._bank_lease = bank_lease
         self._checkpoints_section = BankSection(bank, "/checkpoints")
 
-    def list_ids(self, limit=None, marker=None):
+    def list_ids(self, limit=None, marker=None, plan_id=None, status=None,
+                 start_date=None, end_date=None):
+        """List checkpoint ids, optionally filtered
+
+        Without filters the newest checkpoints are returned first, followed
+        by the checkpoints with random ids, see iter_ids. Filtering by plan
+        or status lists the secondary index of the checkpoints and returns
+        the newest checkpoints first. Dates are datetimes or ISO 8601
+        strings and bound the creation time. Raises InvalidInput when a
+        date is malformed.
+        """
+        start_date = parse_date(start_date, "start_date")
+        end_date = parse_date(end_date, "end_date")
+        page_size = bank_plugin.DEFAULT_LIST_PAGE_SIZE
+        if limit is not None:
+            page_size = max(min(limit, page_size), 1)
+        if plan_id is None and status is None:
+            ids = self.iter_ids(marker=marker, start_date=start_date,
+                                end_date=end_date, page_size=page_size)
+        else:
+            ids = self.iter_indexed_ids(plan_id=plan_id, status=status,
+                                        marker=marker, start_date=start_date,
+                                        end_date=end_date,
+                                        page_size=page_size)
+        return list(itertools.islice(ids, limit))
+
+    def iter_ids(self, marker=None, start_date=None, end_date=None,
+                 page_size=bank_plugin.DEFAULT_LIST_PAGE_SIZE):
+        """Lazily iterate over the ids of all the checkpoints, newest first
+
+        Time ordered ids are listed from the by-time index, where they sort
+        newest first apart from the checkpoints with random ids, so the
+        newest checkpoints only need the first pages of it. Checkpoints with
+        random ids, created before ids were time ordered, follow in listing
+        order. Reaching them lists all the index files of the bank, time
+        ordered ones included, once, and with a date range their index is
+        read to check their creation time.
+        """
+        if marker is None or _is_time_ordered_id(marker):
+            time_marker = None
+            if marker is not None:
+                time_marker = _time_entry_key(marker)
+            if end_date is not None:
+                # The ids created at end_date sort right after their prefix
+                end_marker = _time_entry_key(
+                    _time_ordered_id_prefix(end_date))
+                time_marker = max(time_marker or "", end_marker)
+            for key in self._bank.iter_objects(prefix=_BY_TIME_PREFIX,
+                                               marker=time_marker,
+                                               page_size=page_size):
+                checkpoint_id = key.rsplit("/", 1)[-1]
+                if (start_date is not None and _id_milliseconds(
+                        checkpoint_id) < _milliseconds(start_date)):
+                    break
+                yield checkpoint_id
+            marker = None
+
+        random_ids = (checkpoint_id for checkpoint_id
+                      in self._iter_index_file_ids(marker, page_size)
+                      if not _is_time_ordered_id(checkpoint_id))
+        if start_date is None and end_date is None:
+            for checkpoint_id in random_ids:
+                yield checkpoint_id
+            return
+        while True:
+            batch = list(itertools.islice(random_ids, page_size))
+            if not batch:
+                return
+            indices = self._checkpoints_section.get_objects(
+                [_checkpoint_id_to_index_file(checkpoint_id)
+                 for checkpoint_id in batch])
+            for checkpoint_id in batch:
+                md = indices.get(_checkpoint_id_to_index_file(checkpoint_id))
+                if not isinstance(md, dict):
+                    continue
+                created_at = _milliseconds(md.get("created_at"))
+                if ((start_date is not None and
+                     created_at < _milliseconds(start_date)) or
+                        (end_date is not None and
+                         created_at > _milliseconds(end_date))):
+                    continue
+                yield checkpoint_id
+
+    def _iter_index_file_ids(self, marker=None,
+                             page_size=bank_plugin.DEFAULT_LIST_PAGE_SIZE):
+        """Lazily iterate over the ids of all the index files in the bank"""
         if marker is not None:
             marker = _checkpoint_id_to_index_file(marker)
+        for key in self._checkpoints_section.iter_objects(
+                marker=marker, page_size=page_size):
+            yield key[:-len(_INDEX_FILE_SUFFIX)]
+
+    def iter_indexed_ids(self, plan_id=None, status=None, marker=None,
+                         start_date=None, end_date=None,
+                         page_size=bank_plugin.DEFAULT_LIST_PAGE_SIZE):
+        """Lazily iterate over the ids of a plan or status, newest first
+
+        A single prefix listing is needed when filtering on either the plan
+        or the status. With both, the plan entries are read in batches of
+        one page to check their status.
+        """
+        if plan_id is not None:
+            prefix = "%s/%s" % (_BY_PLAN_PREFIX, plan_id)
+        else:
+            prefix = "%s/%s" % (_BY_STATUS_PREFIX, status)
+        filter_status = plan_id is not None and status is not None
 
-        return [key[:-len(_INDEX_FILE_SUFFIX)]
-                for key in self._checkpoints_section.list_objects(
-                    limit=limit,
-                    marker=marker)
-                ]
+        list_marker = None
+        if marker is not None:
+            list_marker = self._seek_indexed_marker(prefix, marker)
+        if end_date is not None:
+            # Entry names start with the inverted timestamp, the entries
+            # created at end_date sort right after it
+            end_marker = "%s/%s" % (prefix, _inverted_timestamp(end_date))
+            list_marker = max(list_marker or "", end_marker)
+        last_name = None
+        if start_date is not None:
+            last_name = _inverted_timestamp(start_date) + "."
+
+        keys = self._bank.iter_objects(prefix=prefix, marker=list_marker,
+                                       page_size=page_size)
+        while True:
+            batch = list(itertools.islice(keys, page_size))
+            if not batch:
+                return
+            if filter_status:
+                entries = self._bank.get_objects(batch)
+            for key in batch:
+                name = key.rsplit("/", 1)[-1]
+                if last_name is not None and name > last_name:
+                    return
+                if (filter_status and
+                        entries.get(key, {}).get("status") != status):
+                    continue
+                yield name.split("-", 1)[1]
+
+    def _seek_indexed_marker(self, prefix, marker):
+        """Returns the listing marker of the index entry of a checkpoint
+
+        Time ordered ids hold the creation time, so their entry is named
+        without a read. Otherwise the index of the checkpoint is read, and
+        when the checkpoint is gone the entry it left is searched for.
+        """
+        if _is_time_ordered_id(marker):
+            name = "%s-%s" % (
+                _inverted_milliseconds(_id_milliseconds(marker)), marker)
+            return "%s/%s" % (prefix, name)
+        try:
+            md = self._checkpoints_section.get_object(
+                _checkpoint_id_to_index_file(marker))
+            return "%s/%s" % (
+                prefix, _index_entry_name(md.get("created_at"), marker))
+        except exception.BankObjectNotFound:
+            pass
+        suffix = "-%s" % marker
+        for key in self._bank.iter_objects(prefix=prefix):
+            if key.endswith(suffix):
+                return key
+        raise exception.InvalidInput(
+            reason=_("marker %s not found") % marker)
+
+    def rebuild_indices(self):
+        """Write the index entries of all the checkpoints
+
+        Checkpoints written before the index existed are only listed by
+        plan or status once this ran. Returns the number of checkpoints.
+        """
+        count = 0
+        checkpoint_ids = self._iter_index_file_ids()
+        while True:
+            batch = list(itertools.islice(
+                checkpoint_ids, bank_plugin.DEFAULT_LIST_PAGE_SIZE))
+            if not batch:
+                return count
+            entries = {}
+            for md in self._checkpoints_section.get_objects(
+                    [_checkpoint_id_to_index_file(checkpoint_id)
+                     for checkpoint_id in batch]).values():
+                if not isinstance(md, dict) or "id" not in md:
+                    continue
+                entries.update(_index_entries(md))
+                count += 1
+            self._bank.create_objects(entries)
+
+    @property
+    def tracks_usage(self):
+        return self._bank.tracks_usage
+
+    def get_plan_usage(self):
+        """Returns the usage of the resource data of every plan
+
+        The result maps plan ids to a dict with the number of checkpoints,
+        and the size in bytes and number of objects of their resource data.
+        Only the index and usage summaries of every checkpoint are read.
+        """
+        usage = {}
+        checkpoint_ids = self._iter_index_file_ids()
+        while True:
+            batch = list(itertools.islice(
+                checkpoint_ids, bank_plugin.DEFAULT_LIST_PAGE_SIZE))
+            if not batch:
+                return usage
+            indices = self._checkpoints_section.get_objects(
+                [_checkpoint_id_to_index_file(checkpoint_id)
+                 for checkpoint_id in batch])
+            checkpoint_usage = self._bank.get_usage(batch)
+            for checkpoint_id in batch:
+                md = indices.get(_checkpoint_id_to_index_file(checkpoint_id))
+                if not isinstance(md, dict):
+                    continue
+                plan_id = md.get("protection_plan", {}).get("id")
+                plan_usage = usage.setdefault(
+                    plan_id, {"checkpoints": 0, "size": 0, "objects": 0})
+                plan_usage["checkpoints"] += 1
+                plan_usage["size"] += checkpoint_usage[checkpoint_id]["size"]
+                plan_usage["objects"] += \
+                    checkpoint_usage[checkpoint_id]["objects"]
 
     def get(self, checkpoint_id):
         # TODO(saggi): handle multiple instances of the same checkpoint
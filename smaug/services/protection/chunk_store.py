@@ -0,0 +1,350 @@
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+
+"""Content addressed chunk store on top of a bank
+
+Data written through the store is split into chunks which are stored once
+per content hash below '/chunks/<hash>/'. Every user of a chunk owns a
+reference marker '/chunk-refs/<hash>/<owner>', so the reference count of a
+chunk is the number of its markers and no object is ever updated in place.
+
+Releasing data only removes the owner's markers. Chunks left without
+references are reclaimed by sweep(): it first marks them with a tombstone
+and deletes them only when they are still unreferenced after a grace
+period, which gives concurrent writers of the same content time to add
+their reference. Before the last reference check the tombstone is marked
+as deleting, and writers which find such a tombstone wait for the deletion
+to finish and upload the chunk again.
+
+The image protection plugin writes through the store when
+backup_image_chunk_store is set, deleting a backup then releases it.
+"""
+
+import hashlib
+import time
+
+from eventlet import greenpool
+from oslo_config import cfg
+from oslo_log import log as logging
+import six
+
+from smaug import exception
+from smaug.i18n import _LE, _LI
+from smaug.services.protection import bank_plugin
+
+chunk_store_opts = [
+    cfg.IntOpt('chunk_store_chunk_size',
+               default=4 * 1024 * 1024,
+               help='The chunk size in bytes. With content defined '
+                    'chunking it is the average chunk size.'),
+    cfg.StrOpt('chunk_store_chunking',
+               default='fixed',
+               choices=['fixed', 'content'],
+               help='Split data into fixed size chunks, or into content '
+                    'defined chunks which survive insertions and '
+                    'deletions'),
+    cfg.IntOpt('chunk_store_sweep_interval',
+               default=0,
+               help='Interval, in seconds, between sweeps of unreferenced '
+                    'chunks. 0 disables sweeping, enable it together with '
+                    'backup_image_chunk_store'),
+    cfg.IntOpt('chunk_store_grace_period',
+               default=86400,
+               help='Time, in seconds, an unreferenced chunk is kept '
+                    'before it is deleted'),
+]
+
+CONF = cfg.CONF
+CONF.register_opts(chunk_store_opts)
+
+LOG = logging.getLogger(__name__)
+
+CHUNKS_PREFIX = "/chunks"
+REFERENCES_PREFIX = "/chunk-refs"
+
+_DATA_KEY = "data"
+_TOMBSTONE_KEY = "tombstone"
+
+# A deletion marked longer ago than this is left by a failed sweep
+_DELETION_TIMEOUT = 60
+_DELETION_POLL_INTERVAL = 0.5
+
+MANIFEST_VERSION = 1
+
+# Gear hash table for content defined chunking, derived from md5 so it is
+# stable across processes and versions
+_GEAR = [int(hashlib.md5(six.int2byte(i)).hexdigest()[:8], 16)
+         for i in range(256)]
+
+
+def _mask_bits(average_size):
+    bits = 0
+    while (1 << (bits + 1)) <= average_size:
+        bits += 1
+    return (1 << bits) - 1
+
+
+def iter_fixed_chunks(chunks, chunk_size):
+    """Regroup a stream of byte strings into chunks of chunk_size"""
+    buf = bytearray()
+    for data in chunks:
+        buf.extend(data)
+        while len(buf) >= chunk_size:
+            yield bytes(buf[:chunk_size])
+            del buf[:chunk_size]
+    if buf:
+        yield bytes(buf)
+
+
+def iter_content_defined_chunks(chunks, average_size):
+    """Split a stream of byte strings at content defined boundaries
+
+    Boundaries are found with a gear rolling hash, so an insertion or
+    deletion only changes the chunks around it. Chunk sizes are kept
+    between a quarter and four times the average size.
+    """
+    min_size = max(average_size // 4, 1)
+    max_size = average_size * 4
+    mask = _mask_bits(average_size)
+    buf = bytearray()
+    for data in chunks:
+        buf.extend(data)
+        while len(buf) >= max_size:
+            cut = _find_boundary(buf, min_size, max_size, mask)
+            yield bytes(buf[:cut])
+            del buf[:cut]
+    while buf:
+        cut = _find_boundary(buf, min_size, max_size, mask)
+        yield bytes(buf[:cut])
+        del buf[:cut]
+
+
+def _find_boundary(buf, min_size, max_size, mask):
+    end = min(len(buf), max_size)
+    if end <= min_size:
+        return end
+    h = 0
+    gear = _GEAR
+    for i in range(min_size, end):
+        h = ((h << 1) + gear[buf[i]]) & 0xffffffff
+        if not h & mask:
+            return i + 1
+    return end
+
+
+def owner_of_prefix(prefix):
+    """The owner of the chunk references of the data below a bank prefix"""
+    return prefix.strip("/").replace("/", ".")
+
+
+class ChunkStore(object):
+    def __init__(self, bank, chunk_size=None, chunking=None):
+        self._bank = bank
+        self._chunk_size = chunk_size or CONF.chunk_store_chunk_size
+        self._chunking = chunking or CONF.chunk_store_chunking
+
+    @staticmethod
+    def _chunk_prefix(digest):
+        return "%s/%s" % (CHUNKS_PREFIX, digest)
+
+    @classmethod
+    def _chunk_key(cls, digest):
+        return "%s/%s" % (cls._chunk_prefix(digest), _DATA_KEY)
+
+    @classmethod
+    def _tombstone_key(cls, digest):
+        return "%s/%s" % (cls._chunk_prefix(digest), _TOMBSTONE_KEY)
+
+    @staticmethod
+    def _reference_key(digest, owner):
+        return "%s/%s/%s" % (REFERENCES_PREFIX, digest, owner)
+
+    def _iter_chunks(self, stream):
+        chunks = bank_plugin.iter_stream(stream)
+        if self._chunking == "content":
+            return iter_content_defined_chunks(chunks, self._chunk_size)
+        return iter_fixed_chunks(chunks, self._chunk_size)
+
+    def write(self, owner, stream, concurrency=1, progress=None):
+        """Store the data of a stream on behalf of owner
+
+        The stream is either a file-like object or an iterable of bytes.
+        At most concurrency chunks are written at a time. When given,
+        progress is asked with is_landed() whether a chunk is already
+        stored for owner, and told with record() about each chunk stored,
+        both with a {"name": <hash>, "size": <size>} descriptor.
+        Returns the manifest needed to read or release the data, which the
+        caller keeps, typically in its resource bank section.
+        """
+        manifest = {
+            "version": MANIFEST_VERSION,
+            "hash": "sha256",
+            "size": 0,
+            "chunks": [],
+            "stored_size": 0,
+        }
+        failures = []
+        queued = set()
+        pool = greenpool.GreenPool(concurrency)
+        try:
+            for data in self._iter_chunks(stream):
+                if failures:
+                    break
+                digest = hashlib.sha256(data).hexdigest()
+                manifest["chunks"].append([digest, len(data)])
+                manifest["size"] += len(data)
+                chunk = {"name": digest, "size": len(data)}
+                if digest in queued or (progress is not None and
+                                        progress.is_landed(chunk)):
+                    continue
+                queued.add(digest)
+                pool.spawn_n(self._write_chunk, owner, chunk, data, manifest,
+                             progress, failures)
+        finally:
+            # Chunks in flight when the stream fails are still recorded
+            pool.waitall()
+        if failures:
+            raise failures[0]
+        return manifest
+
+    def _write_chunk(self, owner, chunk, data, manifest, progress,
+                     failures):
+        try:
+            if self._put_chunk(chunk["name"], data, owner):
+                manifest["stored_size"] += len(data)
+            if progress is not None:
+                progress.record(chunk)
+        except Exception as err:
+            LOG.error(_LE("write chunk %(digest)s failed: %(err)s"),
+                      {"digest": chunk["name"], "err": err})
+            failures.append(err)
+
+    def _put_chunk(self, digest, data, owner):
+        """Reference a chunk, uploading it if it is not stored yet
+
+        The reference is created first, so a sweep running concurrently
+        sees it before the existence check below, unless that sweep already
+        marked the chunk as deleting. Returns True when the chunk data was
+        uploaded.
+        """
+        self._bank.create_object(self._reference_key(digest, owner),
+                                 {"created_at": time.time()})
+        existing = self._list_chunk_objects(digest)
+        if _TOMBSTONE_KEY in existing:
+            self._wait_for_deletion(digest)
+            existing = self._list_chunk_objects(digest)
+        if _DATA_KEY in existing:
+            return False
+        self._bank.create_object(self._chunk_key(digest), data)
+        return True
+
+    def _list_chunk_objects(self, digest):
+        keys = self._bank.list_objects(prefix=self._chunk_prefix(digest))
+        return [key.rsplit("/", 1)[-1] for key in keys]
+
+    def _wait_for_deletion(self, digest):
+        """Wait until a sweep deleting the chunk is done
+
+        The tombstone is kept by the next sweep when the chunk is
+        referenced, only a tombstone marked as deleting is waited for.
+        """
+        tombstone_key = self._tombstone_key(digest)
+        while True:
+            try:
+                tombstone = self._bank.get_object(tombstone_key)
+            except exception.BankObjectNotFound:
+                return
+            deleting = tombstone.get("deleting")
+            if (deleting is None or
+                    time.time() - deleting >= _DELETION_TIMEOUT):
+                return
+            time.sleep(_DELETION_POLL_INTERVAL)
+
+    def read(self, manifest):
+        """Yield the data described by a manifest, verifying every chunk"""
+        for digest, size in manifest["chunks"]:
+            data = self._bank.get_object(self._chunk_key(digest))
+            if (len(data) != size or
+                    hashlib.sha256(data).hexdigest() != digest):
+                raise exception.BankGetObjectFailed(
+                    key=self._chunk_key(digest),
+                    reason="chunk content does not match its hash")
+            yield data
+
+    def verify(self, manifest):
+        """Check that all the chunks of a manifest are stored
+
+        Only the chunk attributes are looked up, no chunk data is read.
+        Returns the digests of the missing chunks.
+        """
+        missing = []
+        for digest in sorted(set(digest for digest, _size
+                                 in manifest["chunks"])):
+            try:
+                self._bank.stat_object(self._chunk_key(digest))
+            except exception.BankObjectNotFound:
+                missing.append(digest)
+        return missing
+
+    def release(self, owner, manifest):
+        """Drop the references of owner to the chunks of a manifest"""
+        digests = set(digest for digest, _size in manifest["chunks"])
+        self._bank.delete_objects(
+            [self._reference_key(digest, owner) for digest in digests])
+
+    def _iter_stored_digests(self):
+        for key in self._bank.iter_objects(prefix=CHUNKS_PREFIX):
+            digest, name = key.split("/")[-2:]
+            if name == _DATA_KEY:
+                yield digest
+
+    def _is_referenced(self, digest):
+        references = self._bank.list_objects(
+            prefix="%s/%s" % (REFERENCES_PREFIX, digest), limit=1)
+        return len(list(references)) > 0
+
+    def sweep(self, grace_period=None):
+        """Reclaim chunks without references
+
+        Returns the number of deleted chunks.
+        """
+        if grace_period is None:
+            grace_period = CONF.chunk_store_grace_period
+        now = time.time()
+        deleted = 0
+        for digest in self._iter_stored_digests():
+            tombstone_key = self._tombstone_key(digest)
+            try:
+                tombstone = self._bank.get_object(tombstone_key)
+            except exception.BankObjectNotFound:
+                tombstone = None
+
+            if self._is_referenced(digest):
+                if tombstone is not None:
+                    self._bank.delete_object(tombstone_key)
+                continue
+            if tombstone is None:
+                self._bank.create_object(tombstone_key, {"since": now})
+            elif now - tombstone["since"] >= grace_period:
+                # A writer may have referenced the chunk since the check,
+                # writers referencing it after the mark wait for the delete
+                tombstone["deleting"] = time.time()
+                self._bank.update_object(tombstone_key, tombstone)
+                if self._is_referenced(digest):
+                    self._bank.delete_object(tombstone_key)
+                    continue
+                self._bank.delete_object(self._chunk_key(digest))
+                self._bank.delete_object(tombstone_key)
+                deleted += 1
+        if deleted:
+            LOG.info(_LI("Deleted %d unreferenced chunks"), deleted)
+        return deleted
@@ -76,10 +76,10 @@ class SyncCheckpointStatusTask(task.Task):
             checkpoint.commit()
         elif constants.RESOURCE_STATUS_PROTECTING in status.values():
             checkpoint.status = constants.CHECKPOINT_STATUS_PROTECTING
-            checkpoint.commit()
+            checkpoint.commit(deferred=True)
         elif constants.RESOURCE_STATUS_UNDEFINED in status.values():
             checkpoint.status = constants.CHECKPOINT_STATUS_PROTECTING
-            checkpoint.commit()
+            checkpoint.commit(deferred=True)
         else:
             checkpoint.status = constants.CHECKPOINT_STATUS_AVAILABLE
             checkpoint.commit()
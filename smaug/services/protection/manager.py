@@ -15,16 +15,20 @@ Protection Service
 """
 
 import six
+import time
 
 from oslo_config import cfg
 from oslo_log import log as logging
 import oslo_messaging as messaging
+from oslo_service import periodic_task
 
 from smaug.common import constants
 from smaug import exception
 from smaug.i18n import _, _LI, _LE
 from smaug import manager
 from smaug.resource import Resource
+from smaug.services.protection import bank_gc
+from smaug.services.protection import chunk_store
 from smaug.services.protection.flows import worker as flow_manager
 from smaug.services.protection.protectable_registry import ProtectableRegistry
 from smaug.services.protection.provider import PluggableProtectionProvider
@@ -60,12 +64,46 @@ class ProtectionManager(manager.Manager):
         self.protectable_registry = ProtectableRegistry()
         self.protectable_registry.load_plugins()
         self.worker = flow_manager.Worker()
+        self._last_chunk_sweep = 0
+        self._last_bank_gc = 0
 
     def init_host(self, **kwargs):
         """Handle initialization if this is a standalone service"""
         # TODO(wangliuan)
         LOG.info(_LI("Starting protection service"))
 
+    @periodic_task.periodic_task
+    def sweep_chunk_stores(self, context):
+        """Reclaim unreferenced chunks in the banks of all providers"""
+        interval = CONF.chunk_store_sweep_interval
+        if interval <= 0 or time.time() - self._last_chunk_sweep < interval:
+            return
+        self._last_chunk_sweep = time.time()
+        for provider_info in self.provider_registry.list_providers():
+            provider = self.provider_registry.show_provider(
+                provider_info["id"])
+            try:
+                chunk_store.ChunkStore(provider.bank).sweep()
+            except Exception:
+                LOG.exception(_LE("Failed to sweep the chunk store of "
+                                  "provider %s"), provider_info["id"])
+
+    @periodic_task.periodic_task
+    def collect_bank_garbage(self, context):
+        """Delete orphaned checkpoint data in the banks of all providers"""
+        interval = CONF.bank_gc_interval
+        if interval <= 0 or time.time() - self._last_bank_gc < interval:
+            return
+        self._last_bank_gc = time.time()
+        for provider_info in self.provider_registry.list_providers():
+            provider = self.provider_registry.show_provider(
+                provider_info["id"])
+            try:
+                bank_gc.BankGarbageCollector(provider.bank).collect()
+            except Exception:
+                LOG.exception(_LE("Failed to collect the bank garbage of "
+                                  "provider %s"), provider_info["id"])
+
     # TODO(wangliuan) use flow_engine to implement protect function
     def protect(self, context, plan):
         """create protection for the given plan
@@ -168,62 +206,85 @@ class ProtectionManager(manager.Manager):
         LOG.info(_LI("Starting list checkpoints. "
                      "provider_id:%s"), provider_id)
 
-        return_stub = [
-            {
-                "id": "2220f8b1-975d-4621-a872-fa9afb43cb6c",
-                "project_id": "446a04d8-6ff5-4e0e-99a4-827a6389e9ff",
-                "status": "comitted",
-                "provider_id": "efc6a88b-9096-4bb6-8634-cda182a6e12a",
-                "protection_plan": {
-                    "id": "2a9ce1f3-cc1a-4516-9435-0ebb13caa398",
-                    "name": "My 3 tier application",
-                    "resources": [
-                        {
-                            "id": "64e51e85-4f31-441f-9a5d-6e93e3196628",
-                            "type": "OS::Nova::Server"
-                        },
-                        {
-                            "id": "61e51e85-4f31-441f-9a5d-6e93e3196628",
-                            "type": "OS::Cinder::Volume"
-                        },
-                        {
-                            "id": "62e51e85-4f31-441f-9a5d-6e93e3196628",
-                            "type": "OS::Cinder::Volume"
-                        }
-                    ],
-                }
-            }
-        ]
-        return return_stub
+        provider = self._get_provider(provider_id)
+        filters = filters or {}
+        plan_id = filters.get("plan_id")
+        status = filters.get("status")
+        project_id = filters.get("project_id")
+        if not self._is_admin(context):
+            # Tenants only see the checkpoints of their own project
+            project_id = context.project_id
+        checkpoint_collection = provider.get_checkpoint_collection()
+        checkpoints = []
+        while limit is None or len(checkpoints) < limit:
+            checkpoint_ids = checkpoint_collection.list_ids(
+                limit=None if limit is None else limit - len(checkpoints),
+                marker=marker,
+                plan_id=plan_id,
+                status=status,
+                start_date=filters.get("start_date"),
+                end_date=filters.get("end_date"))
+            for checkpoint_id in checkpoint_ids:
+                try:
+                    checkpoint = checkpoint_collection.get(checkpoint_id)
+                except exception.BankObjectNotFound:
+                    # An index entry left by an interrupted create or delete
+                    continue
+                if ((plan_id is not None and
+                     checkpoint.protection_plan.get("id") != plan_id) or
+                        (status is not None and checkpoint.status != status)):
+                    # A stale entry, whose removal after a change failed
+                    continue
+                if (project_id is not None and
+                        checkpoint.project_id != project_id):
+                    continue
+                checkpoints.append(self._checkpoint_to_dict(provider_id,
+                                                            checkpoint))
+            if limit is None or not checkpoint_ids:
+                break
+            # Skipped entries left the page short, continue after them
+            marker = checkpoint_ids[-1]
+        return checkpoints
 
     def show_checkpoint(self, context, provider_id, checkpoint_id):
-        # TODO(wangliuan)
         LOG.info(_LI("Starting show checkpoints. "
                      "provider_id:%s"), provider_id)
         LOG.info(_LI("checkpoint_id:%s"), checkpoint_id)
 
-        return_stub = {
-            "id": "2220f8b1-975d-4621-a872-fa9afb43cb6c",
-            "project_id": "446a04d8-6ff5-4e0e-99a4-827a6389e9ff",
-            "status": "committed",
-            "protection_plan": {
-                "id": "2a9ce1f3-cc1a-4516-9435-0ebb13caa398",
-                "name": "My 3 tier application",
-                "resources": [
-                    {
-                        "id": "64e51e85-4f31-441f-9a5d-6e93e3196628",
-                        "type": "OS::Nova::Server",
-                        "extended_info": {
-                            "name": "VM1",
-                            "backup status": "done",
-                            "available_memory": 512
-                        }
-                    }
-                ]
-            },
-            "provider_id": "efc6a88b-9096-4bb6-8634-cda182a6e12a"
+        provider = self._get_provider(provider_id)
+        checkpoint_collection = provider.get_checkpoint_collection()
+        try:
+            checkpoint = checkpoint_collection.get(checkpoint_id)
+        except exception.BankObjectNotFound:
+            raise exception.CheckpointNotFound(checkpoint_id=checkpoint_id)
+        if (not self._is_admin(context) and
+                checkpoint.project_id != context.project_id):
+            raise exception.CheckpointNotFound(checkpoint_id=checkpoint_id)
+        result = self._checkpoint_to_dict(provider_id, checkpoint)
+        result["usage"] = checkpoint.usage
+        return result
+
+    def _get_provider(self, provider_id):
+        provider = self.provider_registry.show_provider(provider_id)
+        if provider is None:
+            raise exception.ProviderNotFound(provider_id=provider_id)
+        return provider
+
+    @staticmethod
+    def _is_admin(context):
+        # Internal callers pass no request context
+        return context is None or context.is_admin
+
+    @staticmethod
+    def _checkpoint_to_dict(provider_id, checkpoint):
+        return {
+            "id": checkpoint.id,
+            "project_id": checkpoint.project_id,
+            "status": checkpoint.status,
+            "protection_plan": checkpoint.protection_plan,
+            "provider_id": provider_id,
+            "created_at": checkpoint.created_at,
         }
-        return return_stub
 
     def delete_checkpoint(self, checkpoint_id):
         # TODO(wangliuan)
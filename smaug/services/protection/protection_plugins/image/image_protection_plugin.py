@@ -10,15 +10,19 @@
 #    License for the specific language governing permissions and limitations
 #    under the License.
 
+import collections
 import eventlet
-import os
+from eventlet import semaphore
+import hashlib
+import itertools
 
-from io import StringIO
 from oslo_config import cfg
 from oslo_log import log as logging
 from smaug.common import constants
 from smaug import exception
-from smaug.i18n import _, _LE
+from smaug.i18n import _, _LE, _LW
+from smaug.services.protection.bank_plugin import BankSection
+from smaug.services.protection import chunk_store
 from smaug.services.protection.client_factory import ClientFactory
 from smaug.services.protection.protection_plugins.base_protection_plugin \
     import BaseProtectionPlugin
@@ -29,13 +33,109 @@ from time import sleep
 protection_opts = [
     cfg.IntOpt('backup_image_object_size',
                default=52428800,
-               help='The size in bytes of instance image objects')
+               help='The size in bytes of instance image objects'),
+    cfg.IntOpt('backup_image_upload_concurrency',
+               default=4,
+               help='The maximum number of image data objects written to '
+                    'the bank concurrently during an image backup'),
+    cfg.IntOpt('backup_image_progress_interval',
+               default=16,
+               help='The number of image data objects written to the bank '
+                    'between writes of the manifest recording the progress '
+                    'of an image backup. Objects written since the last '
+                    'record are sent again when the backup is resumed'),
+    cfg.IntOpt('restore_image_download_concurrency',
+               default=4,
+               help='The maximum number of image data objects read ahead '
+                    'from the bank concurrently during an image restore'),
+    cfg.IntOpt('restore_image_range_size',
+               default=0,
+               help='Image data objects larger than this number of bytes '
+                    'are read from the bank in ranges of this size, which '
+                    'are fetched concurrently. 0 reads whole objects. Only '
+                    'useful with bank plugins supporting ranged reads'),
+    cfg.BoolOpt('backup_image_chunk_store',
+                default=False,
+                help='Store image data in the content addressed chunk '
+                     'store of the bank, so data shared by images or '
+                     'checkpoints is stored once. Unreferenced chunks are '
+                     'reclaimed by the chunk_store_sweep_interval sweep')
 ]
 
 CONF = cfg.CONF
 CONF.register_opts(protection_opts)
 LOG = logging.getLogger(__name__)
 
+MANIFEST_KEY = "manifest"
+REFERENCES_PREFIX = "refs"
+
+
+class _BackupProgress(object):
+    """Tracks the data objects of an image backup that reached the bank
+
+    Landed chunks are recorded in the resource's manifest every interval
+    chunks, so a backup that is interrupted can later be resumed by only
+    sending the chunks that are missing, while the manifest is written a
+    bounded number of times per backup.
+    """
+
+    def __init__(self, bank_section, manifest, interval=1):
+        self._bank_section = bank_section
+        self._manifest = manifest
+        self._landed = {chunk["name"]: chunk
+                        for chunk in self._get_recorded()}
+        self._interval = max(interval, 1)
+        self._unrecorded = 0
+        self._lock = semaphore.Semaphore()
+
+    def is_landed(self, chunk):
+        return self._landed.get(chunk["name"]) == chunk
+
+    def record(self, chunk):
+        with self._lock:
+            self._landed[chunk["name"]] = chunk
+            self._unrecorded += 1
+            if self._unrecorded < self._interval:
+                return
+            self._unrecorded = 0
+            self._set_recorded(list(self._landed.values()))
+            self._bank_section.update_object(MANIFEST_KEY, self._manifest,
+                                             deferred=True)
+
+    def _get_recorded(self):
+        return self._manifest["chunks"]
+
+    def _set_recorded(self, chunks):
+        self._manifest["chunks"] = chunks
+
+    def complete(self, chunks):
+        self._manifest["chunks"] = chunks
+        self._manifest["size"] = sum(chunk["size"] for chunk in chunks)
+        self._manifest["complete"] = True
+        self._bank_section.update_object(MANIFEST_KEY, self._manifest)
+
+
+class _ChunkStoreProgress(_BackupProgress):
+    """Tracks the chunks of an image backup written to the chunk store
+
+    Landed chunks are recorded as the chunk store manifest of the resource,
+    so deleting an interrupted backup releases their references as well.
+    """
+
+    def _get_recorded(self):
+        return [{"name": digest, "size": size}
+                for digest, size in self._manifest["chunk_store"]["chunks"]]
+
+    def _set_recorded(self, chunks):
+        self._manifest["chunk_store"]["chunks"] = [
+            [chunk["name"], chunk["size"]] for chunk in chunks]
+
+    def complete(self, stored):
+        self._manifest["chunk_store"] = stored
+        self._manifest["size"] = stored["size"]
+        self._manifest["complete"] = True
+        self._bank_section.update_object(MANIFEST_KEY, self._manifest)
+
 
 class GlanceProtectionPlugin(BaseProtectionPlugin):
     _SUPPORT_RESOURCE_TYPES = [constants.IMAGE_RESOURCE_TYPE]
@@ -44,6 +144,11 @@ class GlanceProtectionPlugin(BaseProtectionPlugin):
         super(GlanceProtectionPlugin, self).__init__()
         self._tp = eventlet.GreenPool()
         self.data_block_size_bytes = CONF.backup_image_object_size
+        self.upload_concurrency = CONF.backup_image_upload_concurrency
+        self.progress_interval = CONF.backup_image_progress_interval
+        self.download_concurrency = CONF.restore_image_download_concurrency
+        self.range_size = CONF.restore_image_range_size
+        self.use_chunk_store = CONF.backup_image_chunk_store
 
     def _add_to_threadpool(self, func, *args, **kwargs):
         self._tp.spawn_n(func, *args, **kwargs)
@@ -83,7 +188,8 @@ class GlanceProtectionPlugin(BaseProtectionPlugin):
         LOG.info(_("creating image backup, image_id: %s."), image_id)
         try:
             bank_section.create_object("status",
-                                       constants.RESOURCE_STATUS_PROTECTING)
+                                       constants.RESOURCE_STATUS_PROTECTING,
+                                       deferred=True)
             image_info = glance_client.images.get(image_id)
             image_metadata = {
                 "disk_format": image_info.disk_format,
@@ -104,9 +210,10 @@ class GlanceProtectionPlugin(BaseProtectionPlugin):
                 resource_type=constants.IMAGE_RESOURCE_TYPE)
 
         self._add_to_threadpool(self._create_backup, glance_client,
-                                bank_section, image_id)
+                                bank_section, image_id, checkpoint)
 
-    def _create_backup(self, glance_client, bank_section, image_id):
+    def _create_backup(self, glance_client, bank_section, image_id,
+                       checkpoint=None):
         try:
             image_info = glance_client.images.get(image_id)
 
@@ -120,19 +227,26 @@ class GlanceProtectionPlugin(BaseProtectionPlugin):
             if retry_attempts == 0:
                 raise Exception
 
-            image_response = glance_client.images.data(image_id)
-            image_response_data = StringIO.StringIO()
-            for chunk in image_response:
-                image_response_data.write(chunk)
-            image_response_data.seek(0, os.SEEK_SET)
-
-            chunks = 0
-            while True:
-                data = image_response_data.read(self.data_block_size_bytes)
-                if data == '':
-                    break
-                bank_section.create_object("data_" + str(chunks), data)
-                chunks += 1
+            if self.use_chunk_store:
+                self._backup_to_chunk_store(
+                    bank_section, image_info,
+                    glance_client.images.data(image_id))
+            elif self._reuse_previous_backup(checkpoint, bank_section,
+                                             image_id, image_info):
+                bank_section.update_object("status",
+                                           constants.RESOURCE_STATUS_AVAILABLE)
+                LOG.info(_("image unchanged since the previous checkpoint, "
+                           "image_id: %s."), image_id)
+                return
+            else:
+                progress = _BackupProgress(
+                    bank_section,
+                    self._get_resumable_manifest(bank_section, image_info),
+                    self.progress_interval)
+                image_response = glance_client.images.data(image_id)
+                chunks = self._upload_data_blocks(bank_section,
+                                                  image_response, progress)
+                progress.complete(chunks)
 
             # update resource_definition backup_status
             bank_section.update_object("status",
@@ -149,9 +263,308 @@ class GlanceProtectionPlugin(BaseProtectionPlugin):
                 resource_id=image_id,
                 resource_type=constants.IMAGE_RESOURCE_TYPE)
 
+    def _reuse_previous_backup(self, checkpoint, bank_section, image_id,
+                               image_info):
+        """Reference the data of the previous checkpoint of the same plan
+
+        If the image checksum and size match the backup taken in the latest
+        available checkpoint of the plan, the new manifest points at the
+        existing data objects instead of copying them again. A reference
+        marker is left in the section owning the data, so it is only deleted
+        once no checkpoint uses it anymore.
+        """
+        checksum = getattr(image_info, "checksum", None)
+        if checkpoint is None or not checksum:
+            return False
+
+        previous = checkpoint.get_previous()
+        if previous is None:
+            return False
+        previous_section = previous.get_resource_bank_section(image_id)
+        manifest = self._get_manifest(previous_section)
+        if (manifest is None or not manifest.get("complete") or
+                manifest.get("image_checksum") != checksum or
+                manifest.get("size") != getattr(image_info, "size", None)):
+            return False
+
+        manifest = dict(manifest)
+        manifest.pop("released", None)
+        manifest.setdefault("data_section", previous_section.prefix)
+        data_section = BankSection(bank_section.bank,
+                                   manifest["data_section"])
+        data_section.create_object(
+            "%s/%s" % (REFERENCES_PREFIX, checkpoint.id), bank_section.prefix)
+        bank_section.update_object(MANIFEST_KEY, manifest)
+        return True
+
+    def _backup_to_chunk_store(self, bank_section, image_info,
+                               image_response):
+        """Write the image data through the chunk store of the bank
+
+        Chunks stored by any checkpoint only gain a reference of this
+        resource, so unchanged images are not uploaded again. Chunks are
+        written upload_concurrency at a time and recorded like data objects,
+        so a retried backup skips the chunks of the interrupted attempt.
+        """
+        store = chunk_store.ChunkStore(bank_section.bank)
+        owner = self._get_chunk_owner(bank_section)
+        manifest, recorded = self._get_resumable_chunk_store_manifest(
+            bank_section, image_info, store)
+        progress = _ChunkStoreProgress(bank_section, manifest,
+                                       self.progress_interval)
+        stored = store.write(owner, image_response,
+                             concurrency=self.upload_concurrency,
+                             progress=progress)
+        progress.complete(stored)
+        # Chunks of the interrupted attempt which the image no longer has
+        stale = recorded - set(digest for digest, _size in stored["chunks"])
+        if stale:
+            store.release(owner, {"chunks": [[digest, 0]
+                                             for digest in stale]})
+
+    def _get_resumable_chunk_store_manifest(self, bank_section, image_info,
+                                            store):
+        """Return the manifest to continue a chunk store backup from
+
+        Chunks are addressed by their content, so the chunks recorded by an
+        interrupted attempt are kept whatever the image became, as long as
+        they are still stored. The chunks recorded last are looked up like
+        data objects. Also returns the digests referenced by the previous
+        attempt.
+        """
+        manifest = {
+            "image_checksum": getattr(image_info, "checksum", None),
+            "complete": False,
+            "size": 0,
+            "chunks": [],
+            "chunk_store": {"chunks": []},
+        }
+        previous = self._get_manifest(bank_section)
+        if (previous is None or previous.get("complete") or
+                "chunk_store" not in previous):
+            return manifest, set()
+
+        chunks = previous["chunk_store"]["chunks"]
+        count = max(self.progress_interval, self.upload_concurrency)
+        missing = set(store.verify({"chunks": chunks[-count:]}))
+        for digest in sorted(missing):
+            LOG.warning(_LW("image data chunk %s is missing, it is sent "
+                            "again."), digest)
+        manifest["chunk_store"]["chunks"] = [
+            chunk for index, chunk in enumerate(chunks)
+            if index < len(chunks) - count or chunk[0] not in missing]
+        LOG.info(_("resuming image backup, %d chunks already in the bank."),
+                 len(manifest["chunk_store"]["chunks"]))
+        return manifest, set(digest for digest, _size in chunks)
+
+    def _get_resumable_manifest(self, bank_section, image_info):
+        """Return the manifest to continue the image backup from
+
+        Chunks recorded by a previous, interrupted attempt are kept as long as
+        they were cut from the same image with the same block size. The
+        chunks recorded last are looked up first, any of them missing from
+        the bank is sent again.
+        """
+        manifest = {
+            "image_checksum": getattr(image_info, "checksum", None),
+            "block_size": self.data_block_size_bytes,
+            "complete": False,
+            "size": 0,
+            "chunks": [],
+        }
+        previous = self._get_manifest(bank_section)
+        if (previous is not None and not previous.get("complete") and
+                previous.get("image_checksum") ==
+                manifest["image_checksum"] and
+                previous.get("block_size") == manifest["block_size"]):
+            manifest["chunks"] = self._verify_last_chunks(bank_section,
+                                                          previous["chunks"])
+            LOG.info(_("resuming image backup, %d data objects already "
+                       "in the bank."), len(manifest["chunks"]))
+        return manifest
+
+    def _verify_last_chunks(self, bank_section, chunks):
+        """Drop the chunks recorded last which are missing from the bank
+
+        Chunks are recorded in the order they landed, the ones still in
+        flight around an interruption are the last ones.
+        """
+        count = max(self.progress_interval, self.upload_concurrency)
+        verified = list(chunks[:-count])
+        for chunk in chunks[-count:]:
+            try:
+                bank_section.stat_object(chunk["name"])
+            except exception.BankObjectNotFound:
+                LOG.warning(_LW("image data object %s is missing, it is "
+                                "sent again."), chunk["name"])
+                continue
+            verified.append(chunk)
+        return verified
+
+    def _upload_data_blocks(self, bank_section, image_response, progress):
+        """Write the image data blocks to the bank concurrently
+
+        At most upload_concurrency blocks are in flight at any time; reading
+        from glance blocks while the pool is full. Blocks whose checksum
+        matches a chunk that already landed are not sent again. Returns the
+        ordered list of chunk descriptors to be stored in the manifest.
+        """
+        chunks = []
+        failures = []
+        pool = eventlet.GreenPool(self.upload_concurrency)
+        for index, data in enumerate(self._iter_data_blocks(image_response)):
+            if failures:
+                break
+            chunk = {
+                "name": "data_%d" % index,
+                "size": len(data),
+                "checksum": hashlib.md5(data).hexdigest(),
+            }
+            chunks.append(chunk)
+            if progress.is_landed(chunk):
+                continue
+            pool.spawn_n(self._upload_data_block, bank_section, chunk, data,
+                         progress, failures)
+        pool.waitall()
+        if failures:
+            raise failures[0]
+        return chunks
+
+    @staticmethod
+    def _upload_data_block(bank_section, chunk, data, progress, failures):
+        try:
+            bank_section.create_object(chunk["name"], data)
+            progress.record(chunk)
+        except Exception as err:
+            LOG.error(_LE("write image data object %(name)s failed: %(err)s"),
+                      {"name": chunk["name"], "err": err})
+            failures.append(err)
+
+    def _iter_data_blocks(self, image_response):
+        """Regroup the image data stream into data_block_size_bytes blocks
+
+        Only one block is buffered at a time, so memory usage does not depend
+        on the size of the image.
+        """
+        block_size = self.data_block_size_bytes
+        buf = bytearray()
+        for chunk in image_response:
+            buf.extend(chunk)
+            while len(buf) >= block_size:
+                yield bytes(buf[:block_size])
+                del buf[:block_size]
+        if buf:
+            yield bytes(buf)
+
     def restore_backup(self, cntxt, checkpoint, **kwargs):
-        # TODO(hurong):
-        pass
+        resource_node = kwargs.get("node")
+        original_image_id = resource_node.value.id
+        heat_template = kwargs.get("heat_template")
+        name = kwargs.get("restore_name",
+                          "%s@%s" % (checkpoint.id, original_image_id))
+
+        bank_section = checkpoint.get_resource_bank_section(original_image_id)
+        glance_client = self._glance_client(cntxt)
+
+        LOG.info(_("restoring image backup, image_id: %s."),
+                 original_image_id)
+        image = None
+        try:
+            resource_definition = bank_section.get_object("metadata")
+            image_metadata = resource_definition["image_metadata"]
+            manifest = self._get_manifest(bank_section)
+            if manifest is not None and "chunk_store" in manifest:
+                data = chunk_store.ChunkStore(bank_section.bank).read(
+                    manifest["chunk_store"])
+            else:
+                if manifest is not None:
+                    chunks = manifest["chunks"]
+                else:
+                    chunks = [{"name": chunk_name} for chunk_name in
+                              self._get_chunk_names(bank_section, manifest)]
+                data = self._iter_chunk_data(
+                    self._get_data_section(bank_section, manifest), chunks)
+
+            image = glance_client.images.create(
+                name=name,
+                disk_format=image_metadata["disk_format"],
+                container_format=image_metadata["container_format"])
+            glance_client.images.upload(image.id, data)
+
+            heat_template.put_parameter(original_image_id, image.id)
+            LOG.info(_("finish restore image, image_id: %(image_id)s, "
+                       "new image_id: %(new_image_id)s."),
+                     {"image_id": original_image_id,
+                      "new_image_id": image.id})
+        except Exception as err:
+            LOG.error(_LE("restore image backup failed, image_id: %s."),
+                      original_image_id)
+            if image is not None:
+                try:
+                    glance_client.images.delete(image.id)
+                except Exception:
+                    LOG.exception(_LE("delete incomplete image %s failed."),
+                                  image.id)
+            raise exception.RestoreBackupFailed(
+                reason=err,
+                resource_id=original_image_id,
+                resource_type=constants.IMAGE_RESOURCE_TYPE)
+
+    def _iter_chunk_data(self, bank_section, chunks):
+        """Yield the image data objects in order
+
+        Up to download_concurrency reads are issued ahead of the consumer,
+        so the bank reads overlap with the glance upload while memory stays
+        bounded to a few objects. Objects larger than range_size are read as
+        several ranges, so the reads of a single big object run in parallel
+        too.
+        """
+        pool = eventlet.GreenPool(self.download_concurrency)
+        reads = self._iter_chunk_reads(chunks)
+        pending = collections.deque()
+
+        def read_ahead(count):
+            for chunk, offset, length in itertools.islice(reads, count):
+                if length is None:
+                    reader = pool.spawn(bank_section.get_object,
+                                        chunk["name"])
+                else:
+                    reader = pool.spawn(bank_section.get_object_range,
+                                        chunk["name"], offset, length)
+                pending.append((chunk, offset, length, reader))
+
+        read_ahead(self.download_concurrency)
+        md5 = None
+        while pending:
+            chunk, offset, length, reader = pending.popleft()
+            data = reader.wait()
+            read_ahead(1)
+            if offset == 0:
+                md5 = hashlib.md5()
+            md5.update(data)
+            if length is not None and len(data) != length:
+                raise exception.SmaugException(
+                    _("short read in image data object %s") % chunk["name"])
+            if length is None or offset + length == chunk["size"]:
+                checksum = chunk.get("checksum")
+                if checksum and md5.hexdigest() != checksum:
+                    raise exception.SmaugException(
+                        _("checksum mismatch in image data object %s") %
+                        chunk["name"])
+            yield data
+
+    def _iter_chunk_reads(self, chunks):
+        """Yield the (chunk, offset, length) reads restoring the chunks
+
+        The length is None when the whole object is read at once.
+        """
+        for chunk in chunks:
+            size = chunk.get("size")
+            if not self.range_size or not size or size <= self.range_size:
+                yield chunk, 0, None
+                continue
+            for offset in range(0, size, self.range_size):
+                yield chunk, offset, min(self.range_size, size - offset)
 
     def delete_backup(self, cntxt, checkpoint, **kwargs):
         resource_node = kwargs.get("node")
@@ -163,9 +576,18 @@ class GlanceProtectionPlugin(BaseProtectionPlugin):
         try:
             bank_section.update_object("status",
                                        constants.RESOURCE_STATUS_DELETING)
-            chunk_names = bank_section.list_objects(prefix="data_")
-            for chunk_name in chunk_names:
-                bank_section.delete_object("data_" + chunk_name)
+            manifest = self._get_manifest(bank_section)
+            if manifest is not None and "data_section" in manifest:
+                data_section = self._get_data_section(bank_section, manifest)
+                data_section.delete_object(
+                    "%s/%s" % (REFERENCES_PREFIX, checkpoint.id))
+                bank_section.delete_object(MANIFEST_KEY)
+                owner_manifest = self._get_manifest(data_section)
+                if owner_manifest is not None and owner_manifest.get(
+                        "released"):
+                    self._delete_data(data_section, owner_manifest)
+            else:
+                self._delete_data(bank_section, manifest)
             bank_section.delete_object("metadata")
         except Exception as err:
             LOG.error(_LE("delete image backup failed, image_id: %s."),
@@ -177,5 +599,63 @@ class GlanceProtectionPlugin(BaseProtectionPlugin):
                 resource_id=image_id,
                 resource_type=constants.IMAGE_RESOURCE_TYPE)
 
+    def _delete_data(self, bank_section, manifest):
+        """Delete the data objects and manifest of an image backup
+
+        Data still referenced by later checkpoints is kept and its manifest
+        is marked as released instead; the last referencing checkpoint to be
+        deleted removes it.
+        """
+        if manifest is not None and self._is_referenced(bank_section):
+            if not manifest.get("released"):
+                manifest["released"] = True
+                bank_section.update_object(MANIFEST_KEY, manifest)
+            return
+
+        if manifest is not None and "chunk_store" in manifest:
+            # The chunks are reclaimed by the sweep of the chunk store once
+            # no resource references them
+            chunk_store.ChunkStore(bank_section.bank).release(
+                self._get_chunk_owner(bank_section), manifest["chunk_store"])
+        else:
+            bank_section.delete_objects(
+                self._get_chunk_names(bank_section, manifest))
+        if manifest is not None:
+            bank_section.delete_object(MANIFEST_KEY)
+
+    @staticmethod
+    def _is_referenced(bank_section):
+        references = bank_section.list_objects(prefix=REFERENCES_PREFIX,
+                                               limit=1)
+        return len(list(references)) > 0
+
+    @staticmethod
+    def _get_chunk_owner(bank_section):
+        """The owner of the chunk references of a resource section"""
+        return chunk_store.owner_of_prefix(bank_section.prefix)
+
+    @staticmethod
+    def _get_data_section(bank_section, manifest):
+        if manifest is not None and "data_section" in manifest:
+            return BankSection(bank_section.bank, manifest["data_section"])
+        return bank_section
+
+    @staticmethod
+    def _get_manifest(bank_section):
+        try:
+            return bank_section.get_object(MANIFEST_KEY) or None
+        except Exception:
+            return None
+
+    @staticmethod
+    def _get_chunk_names(bank_section, manifest):
+        if manifest is not None:
+            return [chunk["name"] for chunk in manifest["chunks"]]
+
+        # Backups taken before manifests were introduced
+        return sorted((name for name in bank_section.list_objects()
+                       if name.startswith("data_")),
+                      key=lambda name: int(name[len("data_"):]))
+
     def get_supported_resources_types(self):
         return self._SUPPORT_RESOURCE_TYPES
@@ -14,11 +14,16 @@ import os
 
 from oslo_config import cfg
 from oslo_log import log as logging
+from smaug.common import config as smaug_config
 from smaug.common import constants
 from smaug.i18n import _LE
 from smaug.resource import Resource
 from smaug.services.protection import bank_plugin
+from smaug.services.protection.bank_plugins import compressed_bank_plugin
+from smaug.services.protection.bank_plugins import replicated_bank_plugin
+from smaug.services.protection.bank_plugins import tiered_bank_plugin
 from smaug.services.protection.checkpoint import CheckpointCollection
+from smaug.services.protection.clients import swift
 from smaug.services.protection.graph import GraphWalker
 from smaug.services.protection.protectable_registry import ProtectableRegistry
 from smaug.services.protection.resource_graph import ResourceGraphContext
@@ -41,7 +46,31 @@ provider_opts = [
                help='the name of provider'),
     cfg.StrOpt('id',
                default='',
-               help='the provider id')
+               help='the provider id'),
+    cfg.IntOpt('bank_cache_size',
+               default=0,
+               help='the number of bank objects to keep in the read cache, '
+                    '0 disables the cache'),
+    cfg.IntOpt('bank_cache_ttl',
+               default=30,
+               help='the time in seconds a bank object is kept in the read '
+                    'cache'),
+    cfg.FloatOpt('bank_write_behind_delay',
+                 default=0,
+                 help='the time in seconds deferred bank writes, such as '
+                      'intermediate status updates, may be queued before '
+                      'they are written, 0 writes them immediately'),
+    cfg.StrOpt('bank_codec',
+               default='json',
+               choices=['json', 'msgpack', 'json+zlib'],
+               help='the codec used to encode bank object values, objects '
+                    'written with any codec remain readable'),
+    cfg.BoolOpt('bank_track_usage',
+                default=False,
+                help='keep byte and object counters of the resource data '
+                     'of every checkpoint, which costs a lookup of the size '
+                     'of every resource data object before it is written '
+                     'or deleted and after it is written'),
 ]
 CONF = cfg.CONF
 
@@ -75,7 +104,13 @@ class PluggableProtectionProvider(object):
             raise ImportError("Empty bank")
 
         self._load_bank(self._config.provider.bank)
-        self._bank = bank_plugin.Bank(self._bank_plugin)
+        self._bank = bank_plugin.Bank(
+            self._bank_plugin,
+            cache_size=self._config.provider.bank_cache_size,
+            cache_ttl=self._config.provider.bank_cache_ttl,
+            codec=self._config.provider.bank_codec,
+            write_behind_delay=self._config.provider.bank_write_behind_delay,
+            track_usage=self._config.provider.bank_track_usage)
         self.checkpoint_collection = CheckpointCollection(
             self._bank)
 
@@ -117,8 +152,57 @@ class PluggableProtectionProvider(object):
             LOG.error(_LE("Load bank plugin: '%s' failed."), bank_name)
             raise
         else:
+            if replicated_bank_plugin.is_enabled(self._config):
+                plugin = replicated_bank_plugin.ReplicatedBankPlugin(
+                    self._config, [plugin] + self._load_replica_banks())
+            if tiered_bank_plugin.is_enabled(self._config):
+                plugin = tiered_bank_plugin.TieredBankPlugin(
+                    self._config, plugin, self._load_local_bank())
+            if compressed_bank_plugin.is_enabled(self._config):
+                plugin = compressed_bank_plugin.CompressedBankPlugin(
+                    self._config, plugin)
             self._bank_plugin = plugin
 
+    def _load_replica_banks(self):
+        replicas = []
+        for replica in self._config.replicated_bank_plugin.replica_banks:
+            bank_name, config_file = replicated_bank_plugin.parse_replica(
+                replica)
+            config = self._config
+            if config_file is not None:
+                config = self._load_replica_config(config_file)
+            try:
+                replicas.append(utils.load_plugin(PROTECTION_NAMESPACE,
+                                                  bank_name, config))
+            except Exception:
+                LOG.error(_LE("Load replica bank plugin: '%s' failed."),
+                          replica)
+                raise
+        return replicas
+
+    @staticmethod
+    def _load_replica_config(config_file):
+        """Load the configuration file of a replica bank
+
+        Bank plugins read the global options, such as the lease windows,
+        and the client options from the configuration they are given, so
+        those are registered on the replica configuration as well.
+        """
+        config = cfg.ConfigOpts()
+        config.register_opts(smaug_config.global_opts)
+        swift.register_opts(config)
+        config(args=['--config-file=' + utils.find_config(config_file)])
+        return config
+
+    def _load_local_bank(self):
+        bank_name = self._config.tiered_bank_plugin.local_bank_plugin
+        try:
+            return utils.load_plugin(PROTECTION_NAMESPACE, bank_name,
+                                     self._config)
+        except Exception:
+            LOG.error(_LE("Load local bank plugin: '%s' failed."), bank_name)
+            raise
+
     def _load_plugin(self, plugin_name):
         try:
             plugin = utils.load_plugin(PROTECTION_NAMESPACE, plugin_name,
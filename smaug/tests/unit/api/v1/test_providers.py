@@ -18,6 +18,7 @@ from webob import exc
 
 from smaug.api.v1 import providers
 from smaug import context
+from smaug import exception
 from smaug.tests import base
 from smaug.tests.unit.api import fakes
 
@@ -99,6 +100,18 @@ class ProvidersApiTest(base.TestCase):
             '2220f8b1-975d-4621-a872-fa9afb43cb6c')
         self.assertTrue(moak_list_checkpoints.called)
 
+    @mock.patch(
+        'smaug.services.protection.api.API.'
+        'list_checkpoints')
+    def test_checkpoint_index_invalid_date(self, moak_list_checkpoints):
+        req = fakes.HTTPRequest.blank('/v1/providers/'
+                                      '{provider_id}/checkpoints/'
+                                      '?start_date=yesterday')
+        self.assertRaises(exception.InvalidInput,
+                          self.controller.checkpoints_index,
+                          req, '2220f8b1-975d-4621-a872-fa9afb43cb6c')
+        self.assertFalse(moak_list_checkpoints.called)
+
     @mock.patch(
         'smaug.services.protection.api.API.'
         'delete')
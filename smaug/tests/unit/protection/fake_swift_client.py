@@ -10,7 +10,11 @@
 #    License for the specific language governing permissions and limitations
 #    under the License.
 
+import hashlib
+import json
 import os
+import six
+from six.moves.urllib import parse
 import tempfile
 
 from swiftclient import ClientException
@@ -29,6 +33,8 @@ class FakeSwiftConnection(object):
     def __init__(self, *args, **kwargs):
         self.swiftdir = tempfile.mkdtemp()
         self.object_headers = {}
+        self.manifests = {}
+        self.bulk_delete_requests = 0
 
     def put_container(self, container):
         container_dir = self.swiftdir + "/" + container
@@ -39,27 +45,44 @@ class FakeSwiftConnection(object):
 
     def get_container(self, container, prefix, limit, marker):
         container_dir = self.swiftdir + "/" + container
-        body = []
-        if prefix:
-            objects_dir = container_dir + "/" + prefix
-        else:
-            objects_dir = container_dir
-        for f in os.listdir(objects_dir):
-            if os.path.isfile(objects_dir + "/" + f):
-                body.append({"name": f})
-            else:
-                body.append({"subdir": f})
-        return None, body
+        if not os.path.exists(container_dir):
+            raise ClientException("error_container", http_status=404)
+        names = []
+        for root, _dirs, files in os.walk(container_dir):
+            for f in files:
+                name = os.path.relpath(os.path.join(root, f), container_dir)
+                if prefix and not name.startswith(prefix):
+                    continue
+                if marker and name <= marker:
+                    continue
+                names.append(name)
+        names.sort()
+        if limit:
+            names = names[:limit]
+        return None, [{"name": name} for name in names]
 
-    def put_object(self, container, obj, contents, headers=None):
+    def put_object(self, container, obj, contents, headers=None,
+                   query_string=None):
         container_dir = self.swiftdir + "/" + container
         obj_file = container_dir + "/" + obj
         obj_dir = obj_file[0:obj_file.rfind("/")]
         if os.path.exists(container_dir) is True:
             if os.path.exists(obj_dir) is False:
                 os.makedirs(obj_dir)
-            with open(obj_file, "w") as f:
-                f.write(contents)
+            headers = dict(headers or {})
+            self.manifests.pop(obj_file, None)
+            if query_string == "multipart-manifest=put":
+                manifest = json.loads(contents)
+                contents = self._read_segments(manifest)
+                self.manifests[obj_file] = manifest
+                headers["x-static-large-object"] = True
+            if isinstance(contents, six.text_type):
+                contents = contents.encode("utf-8")
+            if isinstance(contents, six.binary_type):
+                contents = [contents]
+            with open(obj_file, "wb") as f:
+                for chunk in contents:
+                    f.write(chunk)
 
             self.object_headers[obj_file] = {}
             for key, value in headers.items():
@@ -68,26 +91,102 @@ class FakeSwiftConnection(object):
         else:
             raise ClientException("error_container")
 
-    def get_object(self, container, obj):
+    def _read_segments(self, manifest):
+        """Concatenate the segments of a static large object manifest"""
+        segments = []
+        for segment in manifest:
+            with open(self.swiftdir + segment["path"], "rb") as f:
+                data = f.read()
+            if (len(data) != segment["size_bytes"] or
+                    hashlib.md5(data).hexdigest() != segment["etag"]):
+                raise ClientException("error_manifest", http_status=400)
+            segments.append(data)
+        return b"".join(segments)
+
+    def get_object(self, container, obj, resp_chunk_size=None,
+                   headers=None):
         container_dir = self.swiftdir + "/" + container
         obj_file = container_dir + "/" + obj
         if os.path.exists(container_dir) is True:
             if os.path.exists(obj_file) is True:
+                if headers and "Range" in headers:
+                    return (self.object_headers[obj_file],
+                            self._read_range(obj_file, headers["Range"]))
+                if resp_chunk_size is not None:
+                    with open(obj_file, "rb") as f:
+                        body = list(iter(lambda: f.read(resp_chunk_size),
+                                         b""))
+                    return self.object_headers[obj_file], iter(body)
                 with open(obj_file, "r") as f:
                     return self.object_headers[obj_file], f.read()
             else:
-                raise ClientException("error_obj")
+                raise ClientException("error_obj", http_status=404)
         else:
             raise ClientException("error_container")
 
+    @staticmethod
+    def _read_range(obj_file, byte_range):
+        start, end = byte_range[len("bytes="):].split("-")
+        start = int(start)
+        if start >= os.path.getsize(obj_file):
+            raise ClientException("error_range", http_status=416)
+        with open(obj_file, "rb") as f:
+            f.seek(start)
+            if end:
+                return f.read(int(end) - start + 1)
+            return f.read()
+
+    def head_object(self, container, obj):
+        obj_file = self.swiftdir + "/" + container + "/" + obj
+        if not os.path.exists(obj_file):
+            raise ClientException("error_obj", http_status=404)
+        with open(obj_file, "rb") as f:
+            etag = hashlib.md5(f.read()).hexdigest()
+        headers = {
+            "content-length": str(os.path.getsize(obj_file)),
+            "etag": etag,
+            "x-timestamp": "%.5f" % os.path.getmtime(obj_file),
+        }
+        for key, value in self.object_headers[obj_file].items():
+            headers[key.lower()] = value
+        return headers
+
     def delete_object(self, container, obj):
         container_dir = self.swiftdir + "/" + container
         obj_file = container_dir + "/" + obj
         if os.path.exists(container_dir) is True:
             if os.path.exists(obj_file) is True:
-                os.remove(obj_file)
-                self.object_headers.pop(obj_file)
+                self._remove(obj_file, None)
             else:
-                raise ClientException("error_obj")
+                raise ClientException("error_obj", http_status=404)
         else:
             raise ClientException("error_container")
+
+    def _remove(self, obj_file, query_string):
+        os.remove(obj_file)
+        self.object_headers.pop(obj_file)
+        manifest = self.manifests.pop(obj_file, None)
+        if manifest and "multipart-manifest=delete" in (query_string or ""):
+            for segment in manifest:
+                self._remove(self.swiftdir + segment["path"], None)
+
+    def get_capabilities(self):
+        return {"bulk_delete": {"max_deletes_per_request": 2},
+                "slo": {"max_manifest_segments": 1000,
+                        "min_segment_size": 1}}
+
+    def post_account(self, headers, response_dict=None, query_string=None,
+                     data=None):
+        if query_string.split("&")[0] != "bulk-delete":
+            raise ClientException("error_query")
+        result = {"Number Deleted": 0, "Number Not Found": 0, "Errors": []}
+        for line in data.splitlines():
+            container, obj = parse.unquote(line).split("/", 1)
+            obj_file = self.swiftdir + "/" + container + "/" + obj
+            if os.path.exists(obj_file):
+                self._remove(obj_file, query_string)
+                result["Number Deleted"] += 1
+            else:
+                result["Number Not Found"] += 1
+        self.bulk_delete_requests += 1
+        return {}, json.dumps(result)
@@ -167,7 +167,7 @@ class FakeCheckpoint(object):
     def purge(self):
         pass
 
-    def commit(self):
+    def commit(self, deferred=False):
         pass
 
     def get_resource_bank_section(self, resource_id):
@@ -12,6 +12,8 @@
 
 from collections import OrderedDict
 from copy import deepcopy
+import eventlet
+import mock
 import six
 from uuid import uuid4 as uuid
 
@@ -20,6 +22,7 @@ from smaug.services.protection.bank_plugin import Bank
 from smaug.services.protection.bank_plugin import BankPlugin
 from smaug.services.protection.bank_plugin import BankSection
 from smaug.services.protection.bank_plugin import LeasePlugin
+from smaug.services.protection.bank_plugins import memory_bank_plugin
 from smaug.tests import base
 
 
@@ -120,6 +123,27 @@ class BankSectionTest(base.TestCase):
             expected_result[2:4],
         )
 
+    def test_iter_objects(self):
+        bank = self._create_test_bank()
+        section = BankSection(bank, "/prefix", is_writable=True)
+        names = ["obj%02d" % i for i in range(25)]
+        for name in names:
+            section.create_object(name, "value")
+        bank.create_object("/prefixd", "value")  # Should not appear
+
+        with mock.patch.object(bank._plugin, "list_objects",
+                               wraps=bank._plugin.list_objects) as listing:
+            self.assertEqual(list(section.iter_objects(page_size=10)), names)
+            self.assertEqual(listing.call_count, 3)
+            listing.reset_mock()
+
+            keys = section.iter_objects(page_size=10)
+            self.assertEqual([next(keys) for _i in range(5)], names[:5])
+            self.assertEqual(listing.call_count, 1)
+
+        self.assertEqual(list(section.iter_objects(marker="obj19")),
+                         names[20:])
+
     def test_read_only(self):
         bank = self._create_test_bank()
         section = BankSection(bank, "/prefix", is_writable=False)
@@ -178,3 +202,261 @@ class BankSectionTest(base.TestCase):
             "/mid",
             is_writable=True,
         )
+
+
+class _CountingBankPlugin(_InMemoryBankPlugin):
+    def __init__(self, config=None):
+        super(_CountingBankPlugin, self).__init__(config)
+        self.get_count = 0
+
+    def get_object(self, key):
+        self.get_count += 1
+        if key not in self._data:
+            raise exception.BankObjectNotFound(key=key)
+        return super(_CountingBankPlugin, self).get_object(key)
+
+
+class BankCacheTest(base.TestCase):
+    def test_cached_get(self):
+        plugin = _CountingBankPlugin()
+        bank = Bank(plugin, cache_size=10)
+        bank.create_object("/a", {"status": "protecting"})
+        self.assertEqual({"status": "protecting"}, bank.get_object("/a"))
+        value = bank.get_object("a")
+        self.assertEqual({"status": "protecting"}, value)
+        self.assertEqual(1, plugin.get_count)
+        value["status"] = "modified"
+        self.assertEqual({"status": "protecting"}, bank.get_object("/a"))
+        self.assertEqual({"hits": 2, "misses": 1, "size": 1},
+                         bank.get_cache_stats())
+
+    def test_write_invalidates(self):
+        plugin = _CountingBankPlugin()
+        bank = Bank(plugin, cache_size=10)
+        bank.create_object("/a", "value-1")
+        self.assertEqual("value-1", bank.get_object("/a"))
+        bank.update_object("/a", "value-2")
+        self.assertEqual("value-2", bank.get_object("/a"))
+        bank.delete_object("/a")
+        self.assertRaises(exception.BankObjectNotFound,
+                          bank.get_object, "/a")
+        self.assertEqual(3, plugin.get_count)
+
+    def test_negative_cache(self):
+        plugin = _CountingBankPlugin()
+        bank = Bank(plugin, cache_size=10)
+        self.assertRaises(exception.BankObjectNotFound,
+                          bank.get_object, "/missing")
+        self.assertRaises(exception.BankObjectNotFound,
+                          bank.get_object, "/missing")
+        self.assertEqual(1, plugin.get_count)
+        bank.create_object("/missing", "value")
+        self.assertEqual("value", bank.get_object("/missing"))
+
+    def test_lru_eviction_and_ttl(self):
+        plugin = _CountingBankPlugin()
+        bank = Bank(plugin, cache_size=2, cache_ttl=0)
+        bank.create_object("/a", "value")
+        bank.get_object("/a")
+        bank.get_object("/a")
+        self.assertEqual(2, plugin.get_count)
+
+        bank = Bank(plugin, cache_size=2)
+        for key in ("/a", "/b", "/c"):
+            bank.create_object(key, "value")
+            bank.get_object(key)
+        bank.get_object("/c")
+        bank.get_object("/a")
+        self.assertEqual(2 + 4, plugin.get_count)
+        self.assertEqual(2, bank.get_cache_stats()["size"])
+
+
+class BankBulkOperationsTest(base.TestCase):
+    def test_bulk_operations(self):
+        bank = Bank(_CountingBankPlugin())
+        section = BankSection(bank, "/prefix")
+        section.create_objects({"a": "value-a", "/b": "value-b"})
+        self.assertEqual("value-a", bank.get_object("/prefix/a"))
+        self.assertEqual({"a": "value-a", "/b": "value-b"},
+                         section.get_objects(["a", "/b", "missing"]))
+        section.delete_objects(["a", "/b"])
+        self.assertEqual({}, section.get_objects(["a", "/b"]))
+
+    def test_bulk_get_cached(self):
+        plugin = _CountingBankPlugin()
+        bank = Bank(plugin, cache_size=10)
+        bank.create_object("/a", "value")
+        bank.get_object("/a")
+        self.assertEqual({"/a": "value"},
+                         bank.get_objects(["/a", "/missing"]))
+        self.assertEqual({"/a": "value"},
+                         bank.get_objects(["/a", "/missing"]))
+        self.assertEqual(2, plugin.get_count)
+
+    def test_bulk_failure(self):
+        bank = Bank(_CountingBankPlugin())
+        bank.create_object("/a", "value")
+        self.assertRaises(KeyError, bank.delete_objects, ["/a", "/missing"])
+        self.assertEqual({}, bank.get_objects(["/a"]))
+
+
+class BankStreamTest(base.TestCase):
+    def test_default_object_stream(self):
+        bank = Bank(_InMemoryBankPlugin(), cache_size=10)
+        section = BankSection(bank, "/prefix")
+        section.create_object("data", b"old")
+        self.assertEqual(b"old", bank.get_object("/prefix/data"))
+        section.put_object_stream("data", [b"abc", b"", b"defg"])
+        self.assertEqual(b"abcdefg", bank.get_object("/prefix/data"))
+        self.assertEqual([b"abc", b"def", b"g"],
+                         list(section.get_object_stream("data",
+                                                        chunk_size=3)))
+
+    def test_default_object_range(self):
+        bank = Bank(_InMemoryBankPlugin())
+        section = BankSection(bank, "/prefix")
+        section.create_object("data", b"0123456789")
+        self.assertEqual(b"234", section.get_object_range("data", 2, 3))
+        self.assertEqual(b"789", section.get_object_range("data", 7))
+        self.assertEqual(b"89", section.get_object_range("data", 8, 5))
+        self.assertEqual(b"", section.get_object_range("data", 12, 5))
+
+
+class WriteBehindTest(base.TestCase):
+    def _create_test_bank(self, delay=60):
+        self.plugin = _CountingBankPlugin()
+        self.plugin.create_objects = mock.MagicMock(
+            side_effect=self.plugin._data.update)
+        return Bank(self.plugin, write_behind_delay=delay)
+
+    def test_coalesce_and_flush(self):
+        bank = self._create_test_bank()
+        section = BankSection(bank, "/prefix")
+        section.update_object("status", "protecting", deferred=True)
+        section.update_object("status", "available", deferred=True)
+        bank.update_object("/other", {"a": 1}, deferred=True)
+        self.assertEqual({}, self.plugin._data)
+        self.assertEqual("available", section.get_object("status"))
+        self.assertEqual({"/other": {"a": 1}},
+                         bank.get_objects(["/other"]))
+        self.assertEqual(0, self.plugin.get_count)
+
+        bank.flush()
+        self.plugin.create_objects.assert_called_once_with(
+            {"/prefix/status": "available", "/other": {"a": 1}})
+        self.assertEqual("available", self.plugin.get_object(
+            "/prefix/status"))
+
+    def test_direct_write_supersedes(self):
+        bank = self._create_test_bank()
+        bank.update_object("/status", "protecting", deferred=True)
+        bank.update_object("/status", "error")
+        bank.flush()
+        self.assertFalse(self.plugin.create_objects.called)
+        self.assertEqual("error", bank.get_object("/status"))
+
+    def test_list_flushes(self):
+        bank = self._create_test_bank()
+        bank.create_object("/prefix/a", "value", deferred=True)
+        bank.create_object("/other/b", "value", deferred=True)
+        self.assertEqual(["/prefix/a"],
+                         list(bank.list_objects("/prefix")))
+        self.assertEqual(["/prefix/a", "/other/b"],
+                         list(self.plugin._data))
+
+    def test_flush_on_deadline(self):
+        bank = self._create_test_bank(delay=0.01)
+        bank.create_object("/status", "available", deferred=True)
+        eventlet.sleep(0.1)
+        self.assertEqual({"/status": "available"}, self.plugin._data)
+
+    def test_failed_flush_is_retried(self):
+        bank = self._create_test_bank()
+        bank.create_object("/status", "available", deferred=True)
+        self.plugin.create_objects.side_effect = [
+            exception.BankCreateObjectFailed(key="/status", reason=""),
+            None,
+        ]
+        self.assertRaises(exception.BankCreateObjectFailed, bank.flush)
+        self.assertEqual("available", bank.get_object("/status"))
+        bank.flush()
+        self.assertEqual(2, self.plugin.create_objects.call_count)
+
+    def test_disabled(self):
+        plugin = _InMemoryBankPlugin()
+        bank = Bank(plugin)
+        bank.create_object("/status", "available", deferred=True)
+        self.assertEqual("available", plugin.get_object("/status"))
+
+
+class BankUsageTest(base.TestCase):
+    def setUp(self):
+        super(BankUsageTest, self).setUp()
+        self.plugin = memory_bank_plugin.MemoryBankPlugin()
+        self.bank = Bank(self.plugin, track_usage=True)
+
+    def test_usage(self):
+        section = BankSection(self.bank, "/resource-data/cp1/volume")
+        section.create_object("data_0", b"0123456789")
+        section.create_object("status", "done")
+        section.put_object_stream("data_1", [b"abc", b"de"])
+        self.bank.create_object("/resource-data/cp2/image/data_0", b"01")
+        self.bank.create_object("/checkpoints/cp1.index.json", {})
+        self.assertEqual({"cp1": {"size": 19, "objects": 3},
+                          "cp2": {"size": 2, "objects": 1},
+                          "cp3": {"size": 0, "objects": 0}},
+                         self.bank.get_usage(["cp1", "cp2", "cp3"]))
+
+        section.update_object("data_0", b"01234")
+        section.delete_objects(["data_1"])
+        self.bank.flush()
+        writer_id = self.bank._usage.writer_id
+        self.assertEqual({"size": 9, "objects": 2}, self.bank.get_object(
+            "/usage/checkpoints/cp1/%s" % writer_id))
+
+        section.delete_object("data_0")
+        section.delete_object("status")
+        self.assertEqual({"cp1": {"size": 0, "objects": 0}},
+                         self.bank.get_usage(["cp1"]))
+        self.assertEqual(["/usage/checkpoints/cp2/%s" % writer_id],
+                         list(self.bank.iter_objects(prefix="/usage")))
+
+    def test_usage_of_several_writers(self):
+        other_bank = Bank(self.plugin, track_usage=True)
+        self.bank.create_object("/resource-data/cp1/image/data_0", b"01")
+        other_bank.create_object("/resource-data/cp1/image/data_1", b"234")
+        self.bank.flush()
+        other_bank.flush()
+        self.assertEqual({"size": 5, "objects": 2},
+                         self.bank.get_usage(["cp1"])["cp1"])
+
+        other_bank.delete_object("/resource-data/cp1/image/data_0")
+        other_bank.flush()
+        self.assertEqual({"size": 3, "objects": 1},
+                         self.bank.get_usage(["cp1"])["cp1"])
+        self.bank.delete_usage(["cp1"])
+        self.assertEqual([], list(self.bank.iter_objects(prefix="/usage")))
+
+    def test_usage_of_stored_size(self):
+        # Plugins such as the compressing one store fewer bytes than given
+        stat_object = self.plugin.stat_object
+        self.plugin.stat_object = mock.Mock(
+            side_effect=lambda key: dict(stat_object(key), size=3))
+        section = BankSection(self.bank, "/resource-data/cp1/image")
+        section.create_objects({"data_0": b"0" * 100, "data_1": b"1" * 100})
+        section.delete_object("data_0")
+        self.assertEqual({"size": 3, "objects": 1},
+                         self.bank.get_usage(["cp1"])["cp1"])
+
+    def test_usage_deferred(self):
+        bank = Bank(self.plugin, track_usage=True, write_behind_delay=60)
+        bank.create_object("/resource-data/cp1/volume/status", "doing",
+                           deferred=True)
+        bank.update_object("/resource-data/cp1/volume/status", "done",
+                           deferred=True)
+        # Deferred writes count once they are written
+        self.assertEqual({"size": 0, "objects": 0},
+                         bank.get_usage(["cp1"])["cp1"])
+        bank.flush()
+        self.assertEqual({"size": 4, "objects": 1},
+                         bank.get_usage(["cp1"])["cp1"])
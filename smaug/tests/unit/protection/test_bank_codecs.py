@@ -0,0 +1,58 @@
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+
+from smaug import exception
+from smaug.services.protection import bank_codecs
+from smaug.services.protection.bank_plugin import Bank
+from smaug.tests import base
+from smaug.tests.unit.protection.test_bank import _InMemoryBankPlugin
+
+SAMPLE_VALUE = {
+    "status": "available",
+    "resources": [{"id": "id-%d" % i, "type": "OS::Nova::Server"}
+                  for i in range(20)],
+}
+
+
+class BankCodecsTest(base.TestCase):
+    def test_round_trip(self):
+        for codec_name in bank_codecs.list_codecs():
+            data = bank_codecs.encode(codec_name, SAMPLE_VALUE)
+            self.assertIsInstance(data, bytes)
+            self.assertEqual(SAMPLE_VALUE, bank_codecs.decode(data))
+
+    def test_decode_plain_values(self):
+        self.assertEqual(b"raw data", bank_codecs.decode(b"raw data"))
+        self.assertEqual(SAMPLE_VALUE, bank_codecs.decode(SAMPLE_VALUE))
+
+    def test_unknown_codec(self):
+        self.assertRaises(exception.InvalidInput, Bank,
+                          _InMemoryBankPlugin(), codec="unknown")
+
+    def test_bank_codec(self):
+        plugin = _InMemoryBankPlugin()
+        bank = Bank(plugin, codec="json+zlib")
+        bank.create_object("/index", SAMPLE_VALUE)
+        bank.create_object("/data", b"raw data")
+        self.assertIsInstance(plugin.get_object("/index"), bytes)
+        self.assertEqual(b"raw data", plugin.get_object("/data"))
+        self.assertEqual(SAMPLE_VALUE, bank.get_object("/index"))
+        self.assertEqual({"/index": SAMPLE_VALUE},
+                         bank.get_objects(["/index"]))
+
+        reader = Bank(plugin, codec="msgpack")
+        self.assertEqual(SAMPLE_VALUE, reader.get_object("/index"))
+
+    def test_benchmark(self):
+        results = bank_codecs.benchmark(SAMPLE_VALUE, iterations=2)
+        self.assertEqual(bank_codecs.list_codecs(),
+                         [result["codec"] for result in results])
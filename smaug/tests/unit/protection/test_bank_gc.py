@@ -0,0 +1,118 @@
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+
+import mock
+
+from smaug.services.protection import bank_gc
+from smaug.services.protection import chunk_store
+from smaug.services.protection.bank_plugin import Bank
+from smaug.services.protection.bank_plugins import memory_bank_plugin
+from smaug.tests import base
+
+
+class BankGarbageCollectorTest(base.TestCase):
+    def setUp(self):
+        super(BankGarbageCollectorTest, self).setUp()
+        self.plugin = memory_bank_plugin.MemoryBankPlugin()
+        self.bank = Bank(self.plugin)
+        for checkpoint_id in ("live", "reusing"):
+            self.bank.create_object(
+                "/checkpoints/%s.index.json" % checkpoint_id,
+                {"id": checkpoint_id})
+        self.live_keys = [
+            "/resource-data/live/image/data_0",
+            "/resource-data/live/image/manifest",
+        ]
+        self.referenced_keys = [
+            "/resource-data/orphan/image/data_0",
+            "/resource-data/orphan/image/refs/reusing",
+        ]
+        self.orphaned_keys = [
+            "/resource-data/orphan/volume/metadata",
+            "/resource-data/orphan/volume/status",
+            "/resource-data/reverted/image/data_0",
+            "/resource-data/reverted/image/data_1",
+            "/resource-data/reverted/image/refs/deleted",
+        ]
+        for key in self.live_keys + self.referenced_keys + self.orphaned_keys:
+            self.bank.create_object(key, b"data")
+
+    def test_collect(self):
+        collector = bank_gc.BankGarbageCollector(self.bank, batch_size=2,
+                                                 delete_rate=0)
+        with mock.patch.object(self.plugin, "delete_objects",
+                               wraps=self.plugin.delete_objects) as deletes:
+            result = collector.collect()
+        self.assertEqual({"checkpoints": 2, "orphans": 2, "deleted": 5,
+                          "kept": 2}, result)
+        self.assertEqual(3, deletes.call_count)
+        self.assertEqual(
+            sorted(self.live_keys + self.referenced_keys),
+            list(self.bank.iter_objects(prefix="/resource-data")))
+
+    def test_collect_dry_run(self):
+        result = bank_gc.BankGarbageCollector(self.bank,
+                                              dry_run=True).collect()
+        self.assertEqual(5, result["deleted"])
+        self.assertEqual(9, len(list(self.bank.iter_objects(
+            prefix="/resource-data"))))
+
+    def test_collect_new_checkpoint(self):
+        collector = bank_gc.BankGarbageCollector(self.bank, delete_rate=0)
+        live_ids = list(collector._iter_live_ids())
+
+        def _iter_live_ids():
+            # The index of "reverted" is written after the listing
+            self.bank.create_object("/checkpoints/reverted.index.json", {})
+            return iter(live_ids)
+
+        collector._iter_live_ids = _iter_live_ids
+        self.assertEqual(2, collector.collect()["deleted"])
+
+    @mock.patch("eventlet.sleep")
+    def test_collect_throttled(self, sleep):
+        collector = bank_gc.BankGarbageCollector(self.bank, batch_size=1,
+                                                 delete_rate=1)
+        collector.collect()
+        self.assertEqual(4, sleep.call_count)
+
+    def test_collect_chunks_indices_and_usage(self):
+        store = chunk_store.ChunkStore(self.bank, chunk_size=4)
+        manifest = store.write("resource-data.lost.image", [b"chunkdata"])
+        self.bank.create_object("/resource-data/lost/image/manifest",
+                                {"chunks": [], "chunk_store": manifest})
+        index_keys = {
+            "live": ["/indices/by-plan/plan/8-live",
+                     "/indices/by-status/available/8-live",
+                     "/indices/by-time/live"],
+            "lost": ["/indices/by-plan/plan/9-lost",
+                     "/indices/by-status/available/9-lost",
+                     "/indices/by-time/lost"],
+        }
+        for checkpoint_id, keys in index_keys.items():
+            for key in keys:
+                self.bank.create_object(key, {"id": checkpoint_id})
+            self.bank.create_object(
+                "/usage/checkpoints/%s/writer" % checkpoint_id,
+                {"size": 1, "objects": 1})
+
+        bank_gc.BankGarbageCollector(self.bank, delete_rate=0).collect()
+        self.assertEqual([], list(self.bank.iter_objects(
+            prefix="/resource-data/lost")))
+        self.assertEqual([], list(self.bank.iter_objects(
+            prefix="/chunk-refs")))
+        self.assertEqual(3, store.sweep(grace_period=0) +
+                         store.sweep(grace_period=0))
+        self.assertEqual(sorted(index_keys["live"]),
+                         list(self.bank.iter_objects(prefix="/indices")))
+        self.assertEqual(["/usage/checkpoints/live/writer"],
+                         list(self.bank.iter_objects(prefix="/usage")))
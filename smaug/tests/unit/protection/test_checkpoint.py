@@ -54,6 +54,8 @@ class CheckpointTest(base.TestCase):
             "id": checkpoint.id,
             "status": "protecting",
             "owner_id": owner_id,
+            "project_id": plan.get("project_id"),
+            "created_at": checkpoint.created_at,
             "protection_plan": {
                 "id": plan.get("id"),
                 "name": plan.get("name"),
@@ -89,6 +91,8 @@ class CheckpointTest(base.TestCase):
             "id": checkpoint.id,
             "status": "protecting",
             "owner_id": owner_id,
+            "project_id": plan.get("project_id"),
+            "created_at": checkpoint.created_at,
             "protection_plan": {
                 "id": plan.get("id"),
                 "name": plan.get("name"),
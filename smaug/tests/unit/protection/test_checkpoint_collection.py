@@ -10,9 +10,16 @@
 #    License for the specific language governing permissions and limitations
 #    under the License.
 
+import uuid
+
 import mock
+from oslo_utils import timeutils
+from smaug import exception
 
 from smaug.services.protection.bank_plugin import Bank
+from smaug.services.protection.bank_plugin import BankSection
+from smaug.services.protection.bank_plugins import memory_bank_plugin
+from smaug.services.protection.checkpoint import Checkpoint
 from smaug.services.protection.checkpoint import CheckpointCollection
 from smaug.tests import base
 from smaug.tests.unit.protection.fakes import fake_protection_plan
@@ -41,6 +48,145 @@ class CheckpointCollectionTest(base.TestCase):
             collection.create(fake_protection_plan()).id for i in range(10)}
         self.assertEqual(set(collection.list_ids()), result)
 
+    def _create_checkpoints(self, collection, count):
+        ids = []
+        for second in range(count):
+            with mock.patch("oslo_utils.timeutils.utcnow") as utcnow:
+                utcnow.return_value = timeutils.parse_isotime(
+                    "2016-01-01T00:00:0%d" % second)
+                ids.append(collection.create(fake_protection_plan()).id)
+        return ids
+
+    def test_list_checkpoints_paged(self):
+        collection = CheckpointCollection(
+            Bank(memory_bank_plugin.MemoryBankPlugin()),
+            _InMemoryLeasePlugin())
+        ids = self._create_checkpoints(collection, 5)[::-1]
+        self.assertEqual(collection.list_ids(limit=2), ids[:2])
+        self.assertEqual(collection.list_ids(limit=2, marker=ids[1]),
+                         ids[2:4])
+        self.assertEqual(list(collection.iter_ids(page_size=2)), ids)
+
+    def test_list_checkpoints_with_random_ids(self):
+        bank = Bank(memory_bank_plugin.MemoryBankPlugin())
+        collection = CheckpointCollection(bank, _InMemoryLeasePlugin())
+        random_ids = sorted(str(uuid.uuid4()) for i in range(3))
+        for checkpoint_id in random_ids:
+            Checkpoint.create_in_section(
+                BankSection(bank, "/checkpoints"), None, "owner",
+                fake_protection_plan(), checkpoint_id=checkpoint_id)
+        ids = self._create_checkpoints(collection, 3)[::-1]
+        with mock.patch.object(bank, "iter_objects",
+                               wraps=bank.iter_objects) as listings:
+            self.assertEqual(ids[:2], collection.list_ids(limit=2))
+        # The newest checkpoints come from the by-time index alone
+        self.assertEqual([mock.call(prefix="/indices/by-time", marker=None,
+                                    page_size=2)], listings.call_args_list)
+        self.assertEqual(ids + random_ids, collection.list_ids())
+        self.assertEqual(ids[2:] + random_ids[:1],
+                         collection.list_ids(limit=2, marker=ids[1]))
+        self.assertEqual(random_ids[2:],
+                         collection.list_ids(marker=random_ids[1]))
+        self.assertEqual([ids[1]], collection.list_ids(
+            start_date="2016-01-01T00:00:01",
+            end_date="2016-01-01T00:00:01"))
+        self.assertEqual(random_ids,
+                         collection.list_ids(start_date="2016-01-02"))
+        self.assertEqual(random_ids[0],
+                         collection.get(checkpoint_id=random_ids[0]).id)
+
+    def test_plan_usage(self):
+        collection = CheckpointCollection(
+            Bank(memory_bank_plugin.MemoryBankPlugin(), track_usage=True),
+            _InMemoryLeasePlugin())
+        other_plan = fake_protection_plan()
+        other_plan["id"] = "other_plan_id"
+        checkpoints = [collection.create(fake_protection_plan()),
+                       collection.create(fake_protection_plan()),
+                       collection.create(other_plan)]
+        for size, checkpoint in zip((10, 20, 5), checkpoints):
+            section = checkpoint.get_resource_bank_section("volume")
+            section.create_object("data_0", b"x" * size)
+        checkpoints[0].commit()
+        self.assertEqual({"size": 10, "objects": 1}, checkpoints[0].usage)
+        self.assertEqual(
+            {fake_protection_plan()["id"]: {"checkpoints": 2, "size": 30,
+                                            "objects": 2},
+             "other_plan_id": {"checkpoints": 1, "size": 5, "objects": 1}},
+            collection.get_plan_usage())
+
+        untracked = self._create_test_collection()
+        self.assertFalse(untracked.tracks_usage)
+        self.assertIsNone(untracked.create(fake_protection_plan()).usage)
+
+    def test_list_checkpoints_by_plan_and_status(self):
+        collection = CheckpointCollection(
+            Bank(memory_bank_plugin.MemoryBankPlugin()),
+            _InMemoryLeasePlugin())
+        other_plan = fake_protection_plan()
+        other_plan["id"] = "other_plan_id"
+        plan_id = fake_protection_plan()["id"]
+        created_at = ["2016-01-0%dT00:00:00" % day for day in range(1, 6)]
+        checkpoints = []
+        for day, plan in zip(created_at, [fake_protection_plan()] * 4 +
+                             [other_plan]):
+            with mock.patch("oslo_utils.timeutils.utcnow") as utcnow:
+                utcnow.return_value = timeutils.parse_isotime(day)
+                checkpoints.append(collection.create(plan))
+        for checkpoint in checkpoints[:2]:
+            checkpoint.status = "available"
+            checkpoint.commit()
+        ids = [checkpoint.id for checkpoint in checkpoints]
+
+        self.assertEqual(ids[3::-1], collection.list_ids(plan_id=plan_id))
+        self.assertEqual([ids[3], ids[2]],
+                         collection.list_ids(plan_id=plan_id, limit=2))
+        self.assertEqual([ids[1], ids[0]],
+                         collection.list_ids(plan_id=plan_id, limit=2,
+                                             marker=ids[2]))
+        self.assertEqual([ids[1], ids[0]],
+                         collection.list_ids(status="available"))
+        self.assertEqual([ids[4], ids[3], ids[2]],
+                         collection.list_ids(status="protecting"))
+        self.assertEqual([ids[1]],
+                         collection.list_ids(plan_id=plan_id,
+                                             status="available",
+                                             limit=1))
+        self.assertEqual([ids[2], ids[1]],
+                         collection.list_ids(plan_id=plan_id,
+                                             start_date=created_at[1],
+                                             end_date=created_at[2]))
+
+        self.assertEqual([ids[3], ids[2]],
+                         collection.list_ids(start_date=created_at[2],
+                                             end_date=created_at[3]))
+        self.assertEqual([ids[1]],
+                         collection.list_ids(end_date=created_at[1],
+                                             limit=1))
+        self.assertRaises(exception.InvalidInput, collection.list_ids,
+                          start_date="yesterday")
+
+        checkpoints[4].purge()
+        self.assertEqual([], collection.list_ids(plan_id="other_plan_id"))
+        self.assertEqual([ids[3], ids[2]],
+                         collection.list_ids(status="protecting"))
+
+        # Paging continues after a marker whose checkpoint is gone
+        checkpoints[2].purge()
+        self.assertEqual([ids[1], ids[0]],
+                         collection.list_ids(plan_id=plan_id, marker=ids[2]))
+
+    def test_rebuild_indices(self):
+        bank = Bank(memory_bank_plugin.MemoryBankPlugin())
+        collection = CheckpointCollection(bank, _InMemoryLeasePlugin())
+        checkpoint = collection.create(fake_protection_plan())
+        bank.delete_objects(list(bank.iter_objects(prefix="/indices")))
+        self.assertEqual([], collection.list_ids(status="protecting"))
+        self.assertEqual(1, collection.rebuild_indices())
+        self.assertEqual([checkpoint.id],
+                         collection.list_ids(status="protecting"))
+        self.assertEqual([checkpoint.id], collection.list_ids())
+
     def test_delete_checkpoint(self):
         collection = self._create_test_collection()
         result = {
@@ -49,6 +195,35 @@ class CheckpointCollectionTest(base.TestCase):
         checkpoint.purge()
         self.assertEqual(set(collection.list_ids()), result)
 
+    def test_get_previous_checkpoint(self):
+        bank = Bank(memory_bank_plugin.MemoryBankPlugin())
+        collection = CheckpointCollection(bank, _InMemoryLeasePlugin())
+        other_plan = fake_protection_plan()
+        other_plan["id"] = "other_plan_id"
+        checkpoints = []
+        for second, (plan, status) in enumerate([
+                (fake_protection_plan(), "available"),
+                (fake_protection_plan(), "available"),
+                (fake_protection_plan(), "protecting"),
+                (other_plan, "available"),
+                (fake_protection_plan(), "protecting")]):
+            with mock.patch("oslo_utils.timeutils.utcnow") as utcnow:
+                utcnow.return_value = timeutils.parse_isotime(
+                    "2016-01-01T00:00:0%d" % second)
+                checkpoint = collection.create(plan)
+            checkpoint.status = status
+            checkpoint.commit()
+            checkpoints.append(checkpoint)
+        oldest, previous, checkpoint = (checkpoints[0], checkpoints[1],
+                                        checkpoints[4])
+
+        with mock.patch.object(bank, "get_object",
+                               wraps=bank.get_object) as reads:
+            self.assertEqual(previous.id, checkpoint.get_previous().id)
+        # Only the entries up to the previous checkpoint are read
+        self.assertEqual(3, reads.call_count)
+        self.assertIsNone(oldest.get_previous())
+
     def test_write_checkpoint_with_invalid_lease(self):
         collection = self._create_test_collection()
         checkpoint = collection.create(fake_protection_plan())
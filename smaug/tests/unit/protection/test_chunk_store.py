@@ -0,0 +1,125 @@
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+
+import eventlet
+import mock
+import os
+import time
+
+from smaug import exception
+from smaug.services.protection.bank_plugin import Bank
+from smaug.services.protection import chunk_store
+from smaug.tests import base
+from smaug.tests.unit.protection.test_bank import _InMemoryBankPlugin
+
+
+class _SortedInMemoryBankPlugin(_InMemoryBankPlugin):
+    def list_objects(self, prefix=None, limit=None, marker=None):
+        keys = sorted(key for key in self._data
+                      if prefix is None or key.startswith(prefix))
+        if marker is not None:
+            keys = [key for key in keys if key > marker]
+        return keys[:limit]
+
+    def get_object(self, key):
+        if key not in self._data:
+            raise exception.BankObjectNotFound(key=key)
+        return super(_SortedInMemoryBankPlugin, self).get_object(key)
+
+
+class ChunkStoreTest(base.TestCase):
+    def setUp(self):
+        super(ChunkStoreTest, self).setUp()
+        self.plugin = _SortedInMemoryBankPlugin()
+        self.store = chunk_store.ChunkStore(Bank(self.plugin), chunk_size=16)
+
+    def _chunk_keys(self):
+        return [key for key in self.plugin.list_objects(prefix="/chunks/")
+                if key.endswith("/data")]
+
+    def test_write_deduplicates(self):
+        data = b"a" * 16 + b"b" * 16 + b"a" * 16 + b"c" * 5
+        manifest = self.store.write("checkpoint-1/resource", [data])
+        self.assertEqual(len(data), manifest["size"])
+        self.assertEqual(4, len(manifest["chunks"]))
+        self.assertEqual(37, manifest["stored_size"])
+        self.assertEqual(3, len(self._chunk_keys()))
+
+        second = self.store.write("checkpoint-2/resource", [data])
+        self.assertEqual(0, second["stored_size"])
+        self.assertEqual(3, len(self._chunk_keys()))
+        self.assertEqual(data, b"".join(self.store.read(second)))
+
+    def test_release_and_sweep(self):
+        first = self.store.write("checkpoint-1/resource", [b"a" * 32])
+        self.store.write("checkpoint-2/resource", [b"b" * 16])
+        self.store.release("checkpoint-1/resource", first)
+
+        self.assertEqual(0, self.store.sweep(grace_period=0))
+        self.assertEqual(2, len(self._chunk_keys()))
+        self.assertEqual(1, self.store.sweep(grace_period=0))
+        self.assertEqual(1, len(self._chunk_keys()))
+
+    def test_reference_during_grace_period(self):
+        manifest = self.store.write("checkpoint-1/resource", [b"a" * 16])
+        self.store.release("checkpoint-1/resource", manifest)
+        self.store.sweep(grace_period=0)
+        self.store.write("checkpoint-2/resource", [b"a" * 16])
+        self.assertEqual(0, self.store.sweep(grace_period=0))
+        self.assertEqual(0, self.store.sweep(grace_period=0))
+        self.assertEqual(1, len(self._chunk_keys()))
+
+    def test_reference_during_deletion(self):
+        manifest = self.store.write("checkpoint-1/resource", [b"a" * 16])
+        self.store.release("checkpoint-1/resource", manifest)
+        self.store.sweep(grace_period=0)
+        # A sweep marked the chunk as deleting and checked its references
+        tombstone_key = self.plugin.list_objects(prefix="/chunks/")[-1]
+        self.plugin.update_object(tombstone_key, {"since": 0,
+                                                  "deleting": time.time()})
+        with mock.patch.object(chunk_store, "_DELETION_POLL_INTERVAL", 0):
+            writer = eventlet.spawn(self.store.write,
+                                    "checkpoint-2/resource", [b"a" * 16])
+            eventlet.sleep(0)
+            self.assertFalse(writer.dead)
+            self.plugin.delete_object(self._chunk_keys()[0])
+            self.plugin.delete_object(tombstone_key)
+            self.assertEqual(16, writer.wait()["stored_size"])
+        self.assertEqual(1, len(self._chunk_keys()))
+        self.assertEqual(0, self.store.sweep(grace_period=0))
+
+    def test_corrupted_chunk(self):
+        manifest = self.store.write("checkpoint-1/resource", [b"a" * 16])
+        self.plugin.update_object(self._chunk_keys()[0], b"b" * 16)
+        self.assertRaises(exception.BankGetObjectFailed, list,
+                          self.store.read(manifest))
+
+    def test_verify(self):
+        manifest = self.store.write("checkpoint-1/resource",
+                                    [b"a" * 16 + b"b" * 16])
+        self.assertEqual([], self.store.verify(manifest))
+        missing = self._chunk_keys()[0]
+        self.plugin.delete_object(missing)
+        self.assertEqual([missing.split("/")[-2]],
+                         self.store.verify(manifest))
+
+    def test_content_defined_chunks(self):
+        data = os.urandom(64 * 1024)
+        chunks = list(chunk_store.iter_content_defined_chunks([data], 1024))
+        self.assertEqual(data, b"".join(chunks))
+        self.assertTrue(all(256 <= len(chunk) <= 4096
+                            for chunk in chunks[:-1]))
+
+        shifted = list(chunk_store.iter_content_defined_chunks(
+            [b"inserted" + data], 1024))
+        self.assertGreater(len(set(chunks) & set(shifted)),
+                           len(chunks) // 2)
@@ -0,0 +1,80 @@
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+
+import os
+
+from oslo_config import cfg
+from smaug import exception
+from smaug.services.protection.bank_plugins import compressed_bank_plugin
+from smaug.tests import base
+from smaug.tests.unit.protection.test_bank import _InMemoryBankPlugin
+
+CONF = cfg.CONF
+
+COMPRESSIBLE_DATA = b"0123456789abcdef" * 4096
+
+
+class CompressedBankPluginTest(base.TestCase):
+    def setUp(self):
+        super(CompressedBankPluginTest, self).setUp()
+        self.assertFalse(compressed_bank_plugin.is_enabled(CONF))
+        self.override_config("compression_algorithm", "zlib",
+                             "compressed_bank_plugin")
+        self.inner_plugin = _InMemoryBankPlugin()
+        self.plugin = compressed_bank_plugin.CompressedBankPlugin(
+            CONF, self.inner_plugin)
+
+    def test_compress_object(self):
+        self.plugin.create_object("/data", COMPRESSIBLE_DATA)
+        self.plugin.create_object("/metadata", {"size": 1})
+        stored = self.inner_plugin.get_object("/data")
+        self.assertLess(len(stored), len(COMPRESSIBLE_DATA) // 10)
+        self.assertEqual(COMPRESSIBLE_DATA, self.plugin.get_object("/data"))
+        self.assertEqual({"size": 1}, self.plugin.get_object("/metadata"))
+        stats = self.plugin.get_compression_stats()
+        self.assertEqual(1, stats["objects"])
+        self.assertEqual(len(COMPRESSIBLE_DATA), stats["original_size"])
+        self.assertLess(stats["ratio"], 0.1)
+
+    def test_skip_incompressible(self):
+        data = os.urandom(4096)
+        self.plugin.create_object("/random", data)
+        stored = self.inner_plugin.get_object("/random")
+        self.assertIn(data, stored)
+        self.assertEqual(data, self.plugin.get_object("/random"))
+        self.assertEqual(1, self.plugin.get_compression_stats()["skipped"])
+
+    def test_uncompressed_objects(self):
+        self.inner_plugin.create_object("/legacy", b"legacy data")
+        self.assertEqual(b"legacy data", self.plugin.get_object("/legacy"))
+        self.assertEqual([b"legacy data"],
+                         list(self.plugin.get_object_stream("/legacy")))
+
+    def test_stream(self):
+        chunks = [COMPRESSIBLE_DATA[i:i + 1000]
+                  for i in range(0, len(COMPRESSIBLE_DATA), 1000)]
+        self.plugin.put_object_stream("/stream", iter(chunks))
+        self.assertLess(len(self.inner_plugin.get_object("/stream")),
+                        len(COMPRESSIBLE_DATA) // 10)
+        self.assertEqual(
+            COMPRESSIBLE_DATA,
+            b"".join(self.plugin.get_object_stream("/stream",
+                                                   chunk_size=100)))
+        self.assertEqual(COMPRESSIBLE_DATA,
+                         self.plugin.get_object("/stream"))
+
+    def test_truncated_object(self):
+        self.plugin.create_object("/data", COMPRESSIBLE_DATA)
+        stored = self.inner_plugin.get_object("/data")
+        self.inner_plugin.update_object("/data", stored[:-4])
+        self.assertRaises(exception.BankGetObjectFailed,
+                          self.plugin.get_object, "/data")
@@ -0,0 +1,129 @@
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+
+import hashlib
+import math
+import os
+from oslo_config import cfg
+from smaug import exception
+from smaug.services.protection.bank_plugins import file_system_bank_plugin
+from smaug.tests import base
+import shutil
+import six
+import tempfile
+import time
+
+CONF = cfg.CONF
+
+
+class FileSystemBankPluginTest(base.TestCase):
+    def setUp(self):
+        super(FileSystemBankPluginTest, self).setUp()
+        self.bank_path = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.bank_path)
+        CONF.register_opts(
+            file_system_bank_plugin.file_system_bank_plugin_opts,
+            "file_system_bank_plugin")
+        self.override_config("file_system_bank_path", self.bank_path,
+                             "file_system_bank_plugin")
+        self.override_config("file_system_bank_mmap_threshold", 16,
+                             "file_system_bank_plugin")
+        self.plugin = file_system_bank_plugin.FileSystemBankPlugin(CONF)
+
+    def test_acquire_lease(self):
+        self.plugin.acquire_lease()
+        expire_time = math.floor(time.time()) + CONF.lease_expire_window
+        self.assertEqual(expire_time, self.plugin.lease_expire_time)
+        self.assertTrue(self.plugin.check_lease_validity())
+        lease_file = os.path.join(self.bank_path, "leases",
+                                  self.plugin.get_owner_id())
+        with open(lease_file, "r") as f:
+            self.assertEqual("%d" % expire_time, f.read())
+
+    def test_create_get_object(self):
+        self.plugin.create_object("/key", "value")
+        self.plugin.create_object("/dict_object", {"key": "value"})
+        self.plugin.create_object("/data/raw", b"\x00\x01" * 64)
+        self.assertEqual("value", self.plugin.get_object("/key"))
+        self.assertEqual({"key": "value"},
+                         self.plugin.get_object("/dict_object"))
+        self.assertEqual(b"\x00\x01" * 64,
+                         self.plugin.get_object("/data/raw"))
+        # The metadata is a header of the data file, both change at once
+        with open(os.path.join(self.bank_path, "objects", "data",
+                               "raw"), "rb") as f:
+            self.assertTrue(f.read().endswith(b"\x00\x01" * 64))
+
+    def test_update_object(self):
+        self.plugin.create_object("/key", "value-1")
+        self.plugin.update_object("/key", "value-2")
+        self.assertEqual("value-2", self.plugin.get_object("/key"))
+        self.assertEqual(["key"],
+                         os.listdir(os.path.join(self.bank_path, "objects")))
+
+    def test_delete_object(self):
+        self.plugin.create_object("/key", "value")
+        self.plugin.delete_object("/key")
+        self.assertRaises(exception.BankGetObjectFailed,
+                          self.plugin.get_object, "/key")
+        self.assertRaises(exception.BankDeleteObjectFailed,
+                          self.plugin.delete_object, "/key")
+
+    def test_list_objects(self):
+        keys = ["/a/b", "/a/c/d", "/a-b", "/a/c-e", "/b"]
+        for key in keys:
+            self.plugin.create_object(key, "value")
+        self.assertEqual(sorted(keys), self.plugin.list_objects())
+        self.assertEqual(["/a/b", "/a/c-e", "/a/c/d"],
+                         self.plugin.list_objects(prefix="/a/"))
+        self.assertEqual(["/a/c-e", "/a/c/d"],
+                         self.plugin.list_objects(prefix="/a/c"))
+        self.assertEqual(["/a/c/d", "/b"],
+                         self.plugin.list_objects(marker="/a/c-e"))
+        self.assertEqual(["/a-b", "/a/b"],
+                         self.plugin.list_objects(limit=2))
+
+    def test_object_stream(self):
+        self.plugin.put_object_stream("/stream",
+                                      six.BytesIO(b"0123456789" * 10))
+        chunks = list(self.plugin.get_object_stream("/stream",
+                                                    chunk_size=40))
+        self.assertEqual([40, 40, 20], [len(chunk) for chunk in chunks])
+        self.assertEqual(b"0123456789" * 10, self.plugin.get_object("/stream"))
+        self.assertRaises(exception.BankObjectNotFound, list,
+                          self.plugin.get_object_stream("/missing"))
+
+    def test_object_range(self):
+        self.plugin.put_object_stream("/stream", [b"0123", b"4567"])
+        self.assertEqual(b"345", self.plugin.get_object_range("/stream",
+                                                              3, 3))
+        self.assertEqual(b"67", self.plugin.get_object_range("/stream", 6))
+        self.assertEqual(b"", self.plugin.get_object_range("/stream", 9, 2))
+        self.plugin.create_object("/dict", {"key": "value"})
+        self.assertEqual(b'{"key"', self.plugin.get_object_range("/dict",
+                                                                 0, 6))
+        self.assertRaises(exception.BankObjectNotFound,
+                          self.plugin.get_object_range, "/missing", 0)
+
+    def test_stat_object(self):
+        self.plugin.create_object("/data/raw", b"\x00\x01" * 64)
+        self.plugin.put_object_stream("/stream", [b"0123", b"4567"])
+        stat = self.plugin.stat_object("/data/raw")
+        self.assertEqual(128, stat["size"])
+        self.assertEqual(hashlib.md5(b"\x00\x01" * 64).hexdigest(),
+                         stat["etag"])
+        self.assertEqual({"serialized": False}, stat["metadata"])
+        self.assertIsNotNone(stat["last_modified"])
+        self.assertEqual(hashlib.md5(b"01234567").hexdigest(),
+                         self.plugin.stat_object("/stream")["etag"])
+        self.assertRaises(exception.BankObjectNotFound,
+                          self.plugin.stat_object, "/missing")
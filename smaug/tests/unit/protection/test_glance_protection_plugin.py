@@ -11,21 +11,32 @@
 #    under the License.
 
 import collections
+import hashlib
 import mock
 
 from oslo_config import cfg
+from oslo_utils import timeutils
 from smaug.common import constants
 from smaug.context import RequestContext
+from smaug import exception
 from smaug.resource import Resource
 from smaug.services.protection.bank_plugin import Bank
 from smaug.services.protection.bank_plugin import BankPlugin
 from smaug.services.protection.bank_plugin import BankSection
+from smaug.services.protection.bank_plugins import memory_bank_plugin
+from smaug.services.protection.checkpoint import CheckpointCollection \
+    as RealCheckpointCollection
+from smaug.services.protection import chunk_store
 from smaug.services.protection.client_factory import ClientFactory
 from smaug.services.protection.protection_plugins. \
     image.image_protection_plugin import GlanceProtectionPlugin
 from smaug.services.protection.protection_plugins.image \
     import image_plugin_schemas
+from smaug.services.protection.protection_plugins.image \
+    import image_protection_plugin
 from smaug.tests import base
+from smaug.tests.unit.protection.fakes import fake_protection_plan
+from smaug.tests.unit.protection.test_bank import _InMemoryBankPlugin
 
 
 class FakeBankPlugin(BankPlugin):
@@ -68,6 +79,7 @@ Image = collections.namedtuple(
 
 class CheckpointCollection(object):
     def __init__(self):
+        self.id = "fake_checkpoint_id"
         self.bank_section = fake_bank_section
 
     def get_resource_bank_section(self, resource_id):
@@ -138,6 +150,138 @@ class GlanceProtectionPluginTest(base.TestCase):
         self.plugin.create_backup(self.cntxt, self.checkpoint,
                                   node=resource_node)
 
+    def test_create_backup_streams_data_blocks(self):
+        self.plugin.data_block_size_bytes = 4
+        glance_client = mock.MagicMock()
+        glance_client.images.get.return_value = Image(
+            disk_format="",
+            container_format="",
+            status="active"
+        )
+        glance_client.images.data.return_value = iter(
+            [b"ab", b"cdefg", b"hij"])
+        fake_bank_section.get_object = mock.MagicMock()
+        fake_bank_section.get_object.return_value = None
+        fake_bank_section.create_object = mock.MagicMock()
+        fake_bank_section.update_object = mock.MagicMock()
+
+        self.plugin._create_backup(glance_client, fake_bank_section, "123")
+        fake_bank_section.create_object.assert_has_calls([
+            mock.call("data_0", b"abcd"),
+            mock.call("data_1", b"efgh"),
+            mock.call("data_2", b"ij"),
+        ], any_order=True)
+        fake_bank_section.update_object.assert_any_call("manifest", {
+            "image_checksum": None,
+            "block_size": 4,
+            "complete": True,
+            "size": 10,
+            "chunks": [
+                {"name": "data_0", "size": 4,
+                 "checksum": hashlib.md5(b"abcd").hexdigest()},
+                {"name": "data_1", "size": 4,
+                 "checksum": hashlib.md5(b"efgh").hexdigest()},
+                {"name": "data_2", "size": 2,
+                 "checksum": hashlib.md5(b"ij").hexdigest()},
+            ]
+        })
+        fake_bank_section.update_object.assert_called_with(
+            "status", constants.RESOURCE_STATUS_AVAILABLE)
+
+    def test_create_backup_resumes_from_manifest(self):
+        self.plugin.data_block_size_bytes = 4
+        glance_client = mock.MagicMock()
+        glance_client.images.get.return_value = Image(
+            disk_format="",
+            container_format="",
+            status="active"
+        )
+        glance_client.images.data.return_value = iter([b"abcdefghij"])
+        fake_bank_section.get_object = mock.MagicMock()
+        fake_bank_section.get_object.return_value = {
+            "image_checksum": None,
+            "block_size": 4,
+            "complete": False,
+            "size": 0,
+            "chunks": [
+                {"name": "data_0", "size": 4,
+                 "checksum": hashlib.md5(b"abcd").hexdigest()},
+                {"name": "data_1", "size": 4,
+                 "checksum": hashlib.md5(b"XXXX").hexdigest()},
+            ],
+        }
+        fake_bank_section.create_object = mock.MagicMock()
+        fake_bank_section.update_object = mock.MagicMock()
+        fake_bank_section.stat_object = mock.MagicMock()
+
+        self.plugin._create_backup(glance_client, fake_bank_section, "123")
+        self.assertEqual(
+            [mock.call("data_1", b"efgh"), mock.call("data_2", b"ij")],
+            sorted(fake_bank_section.create_object.call_args_list))
+
+        # Recorded chunks missing from the bank are sent again
+        fake_bank_section.create_object.reset_mock()
+        fake_bank_section.stat_object.side_effect = (
+            exception.BankObjectNotFound(key="data_0"))
+        glance_client.images.data.return_value = iter([b"abcdefghij"])
+        self.plugin._create_backup(glance_client, fake_bank_section, "123")
+        self.assertEqual(
+            [mock.call("data_0", b"abcd"), mock.call("data_1", b"efgh"),
+             mock.call("data_2", b"ij")],
+            sorted(fake_bank_section.create_object.call_args_list))
+
+    def test_backup_progress_interval(self):
+        bank_section = mock.MagicMock()
+        progress = image_protection_plugin._BackupProgress(
+            bank_section, {"chunks": []}, interval=2)
+        for index in range(5):
+            progress.record({"name": "data_%d" % index})
+        self.assertEqual(2, bank_section.update_object.call_count)
+        self.assertEqual(
+            4, len(bank_section.update_object.call_args[0][1]["chunks"]))
+
+    def test_create_backup_reuses_unchanged_image(self):
+        self.plugin.data_block_size_bytes = 4
+        bank = Bank(memory_bank_plugin.MemoryBankPlugin())
+        collection = RealCheckpointCollection(bank)
+        glance_client = mock.MagicMock()
+        glance_client.images.get.return_value = mock.MagicMock(
+            status="active", checksum="image-checksum", size=6)
+        glance_client.images.data.return_value = iter([b"abcdef"])
+
+        with mock.patch("oslo_utils.timeutils.utcnow") as utcnow:
+            utcnow.return_value = timeutils.parse_isotime(
+                "2016-01-01T00:00:00")
+            previous = collection.create(fake_protection_plan())
+        previous_section = previous.get_resource_bank_section("123")
+        previous_section.create_object("metadata", {})
+        self.plugin._create_backup(glance_client, previous_section, "123",
+                                   previous)
+        previous.status = constants.CHECKPOINT_STATUS_AVAILABLE
+        previous.commit()
+
+        glance_client.images.data.reset_mock()
+        checkpoint = collection.create(fake_protection_plan())
+        bank_section = checkpoint.get_resource_bank_section("123")
+        bank_section.create_object("metadata", {})
+        self.plugin._create_backup(glance_client, bank_section, "123",
+                                   checkpoint)
+        self.assertFalse(glance_client.images.data.called)
+        manifest = bank_section.get_object("manifest")
+        self.assertEqual(previous_section.prefix, manifest["data_section"])
+        self.assertEqual(constants.RESOURCE_STATUS_AVAILABLE,
+                         bank_section.get_object("status"))
+
+        resource_node = ResourceNode(
+            value=Resource(id="123", type=constants.IMAGE_RESOURCE_TYPE,
+                           name="fake"),
+            child_nodes=[])
+        self.plugin.delete_backup(self.cntxt, previous, node=resource_node)
+        self.assertEqual(b"abcd", previous_section.get_object("data_0"))
+        self.plugin.delete_backup(self.cntxt, checkpoint, node=resource_node)
+        self.assertRaises(exception.BankObjectNotFound,
+                          previous_section.get_object, "data_0")
+
     def test_delete_backup(self):
         resource = Resource(id="123",
                             type=constants.IMAGE_RESOURCE_TYPE,
@@ -151,6 +295,189 @@ class GlanceProtectionPluginTest(base.TestCase):
         self.plugin.delete_backup(self.cntxt, self.checkpoint,
                                   node=resource_node)
 
+    def test_delete_backup_from_manifest(self):
+        resource = Resource(id="123",
+                            type=constants.IMAGE_RESOURCE_TYPE,
+                            name='fake')
+        resource_node = ResourceNode(value=resource,
+                                     child_nodes=[])
+
+        fake_bank_section.get_object = mock.MagicMock()
+        fake_bank_section.get_object.return_value = {
+            "size": 8,
+            "chunks": [{"name": "data_0", "size": 4, "checksum": ""},
+                       {"name": "data_1", "size": 4, "checksum": ""}],
+        }
+        fake_bank_section.list_objects = mock.MagicMock()
+        fake_bank_section.list_objects.return_value = []
+        fake_bank_section.update_object = mock.MagicMock()
+        fake_bank_section.delete_object = mock.MagicMock()
+        fake_bank_section.delete_objects = mock.MagicMock()
+        self.plugin.delete_backup(self.cntxt, self.checkpoint,
+                                  node=resource_node)
+        fake_bank_section.list_objects.assert_called_once_with(
+            prefix="refs", limit=1)
+        fake_bank_section.delete_objects.assert_called_once_with(
+            ["data_0", "data_1"])
+        fake_bank_section.delete_object.assert_has_calls([
+            mock.call("manifest"),
+            mock.call("metadata"),
+        ])
+
+    def test_restore_backup(self):
+        resource = Resource(id="123",
+                            type=constants.IMAGE_RESOURCE_TYPE,
+                            name='fake')
+        resource_node = ResourceNode(value=resource,
+                                     child_nodes=[])
+        bank_objects = {
+            "metadata": {
+                "resource_id": "123",
+                "image_metadata": {"disk_format": "raw",
+                                   "container_format": "bare"},
+            },
+            "manifest": {
+                "complete": True,
+                "size": 6,
+                "chunks": [
+                    {"name": "data_0", "size": 4,
+                     "checksum": hashlib.md5(b"abcd").hexdigest()},
+                    {"name": "data_1", "size": 2,
+                     "checksum": hashlib.md5(b"ef").hexdigest()},
+                ],
+            },
+            "data_0": b"abcd",
+            "data_1": b"ef",
+        }
+        fake_bank_section.get_object = mock.MagicMock()
+        fake_bank_section.get_object.side_effect = bank_objects.__getitem__
+
+        uploaded = []
+        glance_client = mock.MagicMock()
+        glance_client.images.create.return_value = mock.MagicMock(id="456")
+        glance_client.images.upload.side_effect = (
+            lambda image_id, data: uploaded.extend(data))
+        self.plugin._glance_client = mock.MagicMock()
+        self.plugin._glance_client.return_value = glance_client
+        heat_template = mock.MagicMock()
+
+        self.plugin.restore_backup(self.cntxt, self.checkpoint,
+                                   node=resource_node,
+                                   heat_template=heat_template,
+                                   restore_name="restored")
+        glance_client.images.create.assert_called_once_with(
+            name="restored", disk_format="raw", container_format="bare")
+        self.assertEqual([b"abcd", b"ef"], uploaded)
+        heat_template.put_parameter.assert_called_once_with("123", "456")
+
+    def test_restore_backup_range_reads(self):
+        self.plugin.range_size = 3
+        self.plugin.download_concurrency = 2
+        data = b"0123456789"
+        bank_section = BankSection(Bank(_InMemoryBankPlugin()), "/image")
+        bank_section.create_object("data_0", data)
+        bank_section.create_object("data_1", b"ab")
+        chunks = [
+            {"name": "data_0", "size": 10,
+             "checksum": hashlib.md5(data).hexdigest()},
+            {"name": "data_1", "size": 2,
+             "checksum": hashlib.md5(b"ab").hexdigest()},
+        ]
+        with mock.patch.object(bank_section, "get_object_range",
+                               wraps=bank_section.get_object_range) as reads:
+            self.assertEqual(
+                [b"012", b"345", b"678", b"9", b"ab"],
+                list(self.plugin._iter_chunk_data(bank_section, chunks)))
+        self.assertEqual(4, reads.call_count)
+
+        chunks[0]["checksum"] = hashlib.md5(b"bad").hexdigest()
+        self.assertRaises(exception.SmaugException, list,
+                          self.plugin._iter_chunk_data(bank_section, chunks))
+
+    def test_backup_through_chunk_store(self):
+        self.plugin.use_chunk_store = True
+        bank = Bank(memory_bank_plugin.MemoryBankPlugin())
+        collection = RealCheckpointCollection(bank)
+        glance_client = mock.MagicMock()
+        glance_client.images.get.return_value = mock.MagicMock(
+            status="active", checksum="image-checksum")
+        self.plugin._glance_client = mock.MagicMock()
+        self.plugin._glance_client.return_value = glance_client
+        resource_node = ResourceNode(
+            value=Resource(id="123", type=constants.IMAGE_RESOURCE_TYPE,
+                           name="fake"),
+            child_nodes=[])
+
+        checkpoints = []
+        for i in range(2):
+            checkpoint = collection.create(fake_protection_plan())
+            bank_section = checkpoint.get_resource_bank_section("123")
+            bank_section.create_object("metadata", {
+                "image_metadata": {"disk_format": "raw",
+                                   "container_format": "bare"}})
+            glance_client.images.data.return_value = iter([b"image-data"])
+            self.plugin._create_backup(glance_client, bank_section, "123",
+                                       checkpoint)
+            checkpoints.append(checkpoint)
+        # The data of the unchanged image is stored once
+        self.assertEqual(1, len(list(bank.iter_objects(prefix="/chunks"))))
+
+        uploaded = []
+        glance_client.images.upload.side_effect = (
+            lambda image_id, data: uploaded.extend(data))
+        self.plugin.restore_backup(self.cntxt, checkpoints[1],
+                                   node=resource_node,
+                                   heat_template=mock.MagicMock())
+        self.assertEqual([b"image-data"], uploaded)
+
+        store = chunk_store.ChunkStore(bank)
+        self.plugin.delete_backup(self.cntxt, checkpoints[0],
+                                  node=resource_node)
+        store.sweep(grace_period=0)
+        store.sweep(grace_period=0)
+        self.assertEqual(1, len(list(bank.iter_objects(prefix="/chunks"))))
+        self.plugin.delete_backup(self.cntxt, checkpoints[1],
+                                  node=resource_node)
+        store.sweep(grace_period=0)
+        self.assertEqual(1, store.sweep(grace_period=0))
+        self.assertEqual([], list(bank.iter_objects(prefix="/chunks")))
+
+    def test_chunk_store_backup_resumes(self):
+        self.override_config("chunk_store_chunk_size", 4)
+        self.plugin.use_chunk_store = True
+        self.plugin.progress_interval = 1
+        self.plugin.upload_concurrency = 2
+        bank = Bank(memory_bank_plugin.MemoryBankPlugin())
+        bank_section = BankSection(bank, "/resource-data/checkpoint/123")
+        image_info = mock.MagicMock(checksum="image-checksum")
+
+        def _interrupted():
+            yield b"abcdefgh"
+            raise IOError("glance connection lost")
+
+        self.assertRaises(IOError, self.plugin._backup_to_chunk_store,
+                          bank_section, image_info, _interrupted())
+        bank.flush()
+        manifest = bank_section.get_object("manifest")
+        self.assertFalse(manifest["complete"])
+        self.assertEqual(2, len(manifest["chunk_store"]["chunks"]))
+
+        put_chunk = mock.patch.object(chunk_store.ChunkStore, "_put_chunk",
+                                      autospec=True,
+                                      side_effect=chunk_store.ChunkStore.
+                                      _put_chunk)
+        with put_chunk as put_chunk:
+            self.plugin._backup_to_chunk_store(bank_section, image_info,
+                                               iter([b"abcdefghij"]))
+        # Only the chunk the interrupted attempt did not store is sent
+        self.assertEqual(["ij"], [call[0][2].decode()
+                                  for call in put_chunk.call_args_list])
+        manifest = bank_section.get_object("manifest")
+        self.assertTrue(manifest["complete"])
+        self.assertEqual(10, manifest["size"])
+        self.assertEqual([b"abcdefghij"], [b"".join(
+            chunk_store.ChunkStore(bank).read(manifest["chunk_store"]))])
+
     def test_get_supported_resources_types(self):
         types = self.plugin.get_supported_resources_types()
         self.assertEqual(types,
@@ -15,8 +15,12 @@ import mock
 from oslo_config import cfg
 from oslo_log import log as logging
 
+from smaug import context
 from smaug import exception
 from smaug.resource import Resource
+from smaug.services.protection.bank_plugin import Bank
+from smaug.services.protection.bank_plugins import memory_bank_plugin
+from smaug.services.protection.checkpoint import CheckpointCollection
 from smaug.services.protection.flows import worker as flow_manager
 from smaug.services.protection import manager
 from smaug.services.protection import protectable_registry
@@ -132,6 +136,37 @@ class ProtectionServiceTest(base.TestCase):
                           None,
                           fakes.fake_protection_plan())
 
+    @mock.patch.object(provider.ProviderRegistry, 'show_provider')
+    def test_checkpoints_of_other_projects(self, mock_provider):
+        collection = CheckpointCollection(
+            Bank(memory_bank_plugin.MemoryBankPlugin()))
+        mock_provider.return_value.get_checkpoint_collection.return_value = \
+            collection
+        checkpoint_ids = {}
+        for project_id in ("project1", "project2"):
+            plan = dict(fakes.fake_protection_plan(), project_id=project_id)
+            checkpoint_ids[project_id] = collection.create(plan).id
+        user_context = context.RequestContext('user', 'project1',
+                                              is_admin=False)
+        admin_context = context.RequestContext('admin', 'project1',
+                                               is_admin=True)
+
+        checkpoints = self.pro_manager.list_checkpoints(
+            user_context, 'fake_id', filters={'project_id': 'project2'})
+        self.assertEqual([checkpoint_ids["project1"]],
+                         [checkpoint["id"] for checkpoint in checkpoints])
+        self.assertEqual("project1", checkpoints[0]["project_id"])
+        self.assertEqual(2, len(self.pro_manager.list_checkpoints(
+            admin_context, 'fake_id')))
+
+        self.assertRaises(exception.CheckpointNotFound,
+                          self.pro_manager.show_checkpoint,
+                          user_context, 'fake_id',
+                          checkpoint_ids["project2"])
+        self.assertEqual("project2", self.pro_manager.show_checkpoint(
+            admin_context, 'fake_id', checkpoint_ids["project2"])[
+            "project_id"])
+
     def tearDown(self):
         flow_manager.Worker._load_engine = self.load_engine
         super(ProtectionServiceTest, self).tearDown()
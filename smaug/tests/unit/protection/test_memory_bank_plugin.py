@@ -0,0 +1,81 @@
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+
+import mock
+from oslo_config import cfg
+
+from smaug import exception
+from smaug.services.protection import bank_benchmark
+from smaug.services.protection.bank_plugin import Bank
+from smaug.services.protection.bank_plugins import memory_bank_plugin
+from smaug.tests import base
+
+CONF = cfg.CONF
+
+
+class MemoryBankPluginTest(base.TestCase):
+    def setUp(self):
+        super(MemoryBankPluginTest, self).setUp()
+        self.plugin = memory_bank_plugin.MemoryBankPlugin(CONF)
+
+    def test_create_get_delete_object(self):
+        value = {"key": ["value"]}
+        self.plugin.create_object("/key", value)
+        value["key"].append("changed")
+        self.assertEqual({"key": ["value"]}, self.plugin.get_object("/key"))
+        self.assertEqual(18, self.plugin.stat_object("/key")["size"])
+        self.plugin.delete_object("/key")
+        self.assertRaises(exception.BankObjectNotFound,
+                          self.plugin.get_object, "/key")
+        self.assertRaises(exception.BankDeleteObjectFailed,
+                          self.plugin.delete_object, "/key")
+
+    def test_list_objects(self):
+        for key in ("/b/2", "/a/1", "/b/1", "/b/3", "/c"):
+            self.plugin.create_object(key, "value")
+        self.assertEqual(["/b/1", "/b/2", "/b/3"],
+                         self.plugin.list_objects(prefix="/b/"))
+        self.assertEqual(["/b/2"],
+                         self.plugin.list_objects(prefix="/b/", limit=1,
+                                                  marker="/b/1"))
+        self.assertEqual(["/a/1", "/b/1", "/b/2", "/b/3", "/c"],
+                         list(Bank(self.plugin).iter_objects(page_size=2)))
+
+    def test_latency(self):
+        self.override_config("memory_bank_latency", 0.01,
+                             "memory_bank_plugin")
+        plugin = memory_bank_plugin.MemoryBankPlugin(CONF)
+        with mock.patch("eventlet.sleep") as sleep:
+            plugin.create_object("/key", "value")
+            plugin.get_object("/key")
+        sleep.assert_has_calls([mock.call(0.01), mock.call(0.01)])
+
+    def test_benchmark(self):
+        results = bank_benchmark.BankBenchmark(
+            self.plugin, operations=200, object_size=128, keys=10,
+            concurrency=4, seed=1).run()
+        self.assertEqual(200, results["operations"])
+        self.assertEqual(0, results["errors"])
+        self.assertEqual(200, sum(stats["count"] for stats in
+                                  results["by_operation"].values()))
+        read = results["by_operation"]["read"]
+        self.assertGreater(read["count"], 0)
+        self.assertLessEqual(read["p50"], read["p99"])
+        self.assertEqual([], self.plugin.list_objects())
+
+    def test_parse_mix(self):
+        self.assertEqual({"read": 1, "write": 2, "list": 0, "delete": 0},
+                         bank_benchmark.parse_mix("read=1, write=2"))
+        self.assertRaises(exception.InvalidInput,
+                          bank_benchmark.parse_mix, "scan=1")
+        self.assertRaises(exception.InvalidInput,
+                          bank_benchmark.parse_mix, "read=0")
@@ -1,59 +1,99 @@
-# Licensed under the Apache License, Version 2.0 (the "License"); you may
-# not use this file except in compliance with the License. You may obtain
-#    a copy of the License at
-#
-#         http://www.apache.org/licenses/LICENSE-2.0
-#
-#    Unless required by applicable law or agreed to in writing, software
-#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
-#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
-#    License for the specific language governing permissions and limitations
-#    under the License.
-
-import mock
-
-from oslo_config import cfg
-from smaug.services.protection import provider
-from smaug.tests import base
-
-CONF = cfg.CONF
-
-
-class ProviderRegistryTest(base.TestCase):
-    def setUp(self):
-        super(ProviderRegistryTest, self).setUp()
-
-    @mock.patch.object(provider.PluggableProtectionProvider, '_load_bank')
-    @mock.patch.object(provider.PluggableProtectionProvider, '_load_plugin')
-    def test_load_providers(self, mock_load_bank, mock_load_plugin):
-        pr = provider.ProviderRegistry()
-        self.assertEqual(mock_load_plugin.call_count, 1)
-        self.assertEqual(mock_load_bank.call_count, 1)
-        self.assertEqual(len(pr.providers), 1)
-
-        self.assertEqual(pr.providers['fake_id1'].name, 'fake_provider1')
-        self.assertNotIn('fake_provider2', pr.providers)
-
-    def test_provider_bank_config(self):
-        pr = provider.ProviderRegistry()
-        provider1 = pr.show_provider('fake_id1')
-        self.assertEqual(provider1.bank._plugin._config.fake_bank.fake_host,
-                         'thor')
-
-    def test_provider_plugin_config(self):
-        pr = provider.ProviderRegistry()
-        provider1 = pr.show_provider('fake_id1')
-        plugin_name = 'smaug.tests.unit.fake_protection.FakeProtectionPlugin'
-        self.assertEqual(
-            provider1.plugins[plugin_name]._config.fake_plugin.fake_user,
-            'user')
-
-    def test_list_provider(self):
-        pr = provider.ProviderRegistry()
-        self.assertEqual(1, len(pr.list_providers()))
-
-    def test_show_provider(self):
-        pr = provider.ProviderRegistry()
-        provider_list = pr.list_providers()
-        for provider_node in provider_list:
-            self.assertTrue(pr.show_provider(provider_node['id']))
+# Licensed under the Apache License, Version 2.0 (the "License"); you may
+# not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+
+import mock
+import os
+import shutil
+import tempfile
+
+from oslo_config import cfg
+from smaug.services.protection.bank_plugins import replicated_bank_plugin
+from smaug.services.protection import provider
+from smaug.tests import base
+
+CONF = cfg.CONF
+
+
+class ProviderRegistryTest(base.TestCase):
+    def setUp(self):
+        super(ProviderRegistryTest, self).setUp()
+
+    @mock.patch.object(provider.PluggableProtectionProvider, '_load_bank')
+    @mock.patch.object(provider.PluggableProtectionProvider, '_load_plugin')
+    def test_load_providers(self, mock_load_bank, mock_load_plugin):
+        pr = provider.ProviderRegistry()
+        self.assertEqual(mock_load_plugin.call_count, 1)
+        self.assertEqual(mock_load_bank.call_count, 1)
+        self.assertEqual(len(pr.providers), 1)
+
+        self.assertEqual(pr.providers['fake_id1'].name, 'fake_provider1')
+        self.assertNotIn('fake_provider2', pr.providers)
+
+    def test_provider_bank_config(self):
+        pr = provider.ProviderRegistry()
+        provider1 = pr.show_provider('fake_id1')
+        self.assertEqual(provider1.bank._plugin._config.fake_bank.fake_host,
+                         'thor')
+
+    def test_provider_plugin_config(self):
+        pr = provider.ProviderRegistry()
+        provider1 = pr.show_provider('fake_id1')
+        plugin_name = 'smaug.tests.unit.fake_protection.FakeProtectionPlugin'
+        self.assertEqual(
+            provider1.plugins[plugin_name]._config.fake_plugin.fake_user,
+            'user')
+
+    def test_load_replica_bank_config_file(self):
+        bank_path = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, bank_path)
+        replica_file = os.path.join(bank_path, "replica.conf")
+        with open(replica_file, "w") as f:
+            f.write("[DEFAULT]\n"
+                    "lease_expire_window = 300\n"
+                    "[file_system_bank_plugin]\n"
+                    "file_system_bank_path = %s\n" % bank_path)
+        provider_file = os.path.join(bank_path, "provider.conf")
+        with open(provider_file, "w") as f:
+            f.write("[provider]\n"
+                    "name = replicated\n"
+                    "id = replicated_id\n"
+                    "bank = smaug.services.protection.bank_plugins."
+                    "memory_bank_plugin.MemoryBankPlugin\n"
+                    "[replicated_bank_plugin]\n"
+                    "replica_banks = smaug.services.protection."
+                    "bank_plugins.file_system_bank_plugin."
+                    "FileSystemBankPlugin:%s\n"
+                    "repair_interval = 0\n" % replica_file)
+        provider_config = cfg.ConfigOpts()
+        provider_config(args=['--config-file=' + provider_file])
+        provider_config.register_opts(provider.provider_opts, 'provider')
+
+        pp = provider.PluggableProtectionProvider(provider_config)
+        bank_plugin = pp.bank._plugin
+        self.assertIsInstance(bank_plugin,
+                              replicated_bank_plugin.ReplicatedBankPlugin)
+        replica = bank_plugin.plugins[1]
+        self.assertEqual(bank_path, replica.bank_path)
+        self.assertEqual(300, replica.lease_expire_window)
+
+        pp.bank.create_object("/key", "value")
+        self.assertEqual("value", replica.get_object("/key"))
+
+    def test_list_provider(self):
+        pr = provider.ProviderRegistry()
+        self.assertEqual(1, len(pr.list_providers()))
+
+    def test_show_provider(self):
+        pr = provider.ProviderRegistry()
+        provider_list = pr.list_providers()
+        for provider_node in provider_list:
+            self.assertTrue(pr.show_provider(provider_node['id']))
@@ -0,0 +1,141 @@
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+
+import mock
+from oslo_config import cfg
+
+from smaug import exception
+from smaug.services.protection.bank_plugins import memory_bank_plugin
+from smaug.services.protection.bank_plugins import replicated_bank_plugin
+from smaug.tests import base
+
+CONF = cfg.CONF
+
+
+class ReplicatedBankPluginTest(base.TestCase):
+    def setUp(self):
+        super(ReplicatedBankPluginTest, self).setUp()
+        self.assertFalse(replicated_bank_plugin.is_enabled(CONF))
+        self.override_config("replica_banks", ["smaug-memory-bank-plugin"],
+                             "replicated_bank_plugin")
+        self.override_config("repair_interval", 0, "replicated_bank_plugin")
+        self.replicas = [memory_bank_plugin.MemoryBankPlugin()
+                         for _i in range(3)]
+
+    def _create_plugin(self, write_quorum=0):
+        self.override_config("write_quorum", write_quorum,
+                             "replicated_bank_plugin")
+        return replicated_bank_plugin.ReplicatedBankPlugin(CONF,
+                                                           self.replicas)
+
+    @staticmethod
+    def _wait_for_banks(plugin):
+        """Wait for the banks still busy after the write quorum"""
+        for pool in set(plugin._pending.values()):
+            pool.waitall()
+
+    def test_parse_replica(self):
+        self.assertEqual(("smaug-swift-bank-plugin", None),
+                         replicated_bank_plugin.parse_replica(
+                             "smaug-swift-bank-plugin"))
+        self.assertEqual(("smaug-swift-bank-plugin", "/etc/dr.conf"),
+                         replicated_bank_plugin.parse_replica(
+                             "smaug-swift-bank-plugin:/etc/dr.conf"))
+
+    def test_replicated_write_and_delete(self):
+        plugin = self._create_plugin()
+        plugin.create_object("/key", {"value": 1})
+        for replica in self.replicas:
+            self.assertEqual({"value": 1}, replica.get_object("/key"))
+        self.assertEqual({"value": 1}, plugin.get_object("/key"))
+        plugin.delete_objects(["/key"])
+        for replica in self.replicas:
+            self.assertEqual([], replica.list_objects())
+
+    def test_write_quorum_and_repair(self):
+        plugin = self._create_plugin(write_quorum=2)
+        with mock.patch.object(self.replicas[2], "create_object",
+                               side_effect=exception.BankCreateObjectFailed(
+                                   key="/key", reason="down")):
+            plugin.create_object("/key", b"data")
+        self.assertEqual({"/key": {2: "write"}}, plugin.get_lagging())
+        self.assertRaises(exception.BankObjectNotFound,
+                          self.replicas[2].get_object, "/key")
+
+        self.assertEqual(1, plugin.repair())
+        self.assertEqual({}, plugin.get_lagging())
+        self.assertEqual(b"data", self.replicas[2].get_object("/key"))
+
+    def test_repair_after_restart(self):
+        plugin = self._create_plugin(write_quorum=2)
+        with mock.patch.object(self.replicas[2], "create_object",
+                               side_effect=exception.BankCreateObjectFailed(
+                                   key="/key", reason="down")):
+            plugin.create_object("/key", b"data")
+            self._wait_for_banks(plugin)
+
+        restarted = self._create_plugin(write_quorum=2)
+        self.assertEqual({"/key": {2: "write"}}, restarted.get_lagging())
+        self.assertEqual(1, restarted.repair())
+        self.assertEqual({}, restarted.get_lagging())
+        self.assertEqual(b"data", self.replicas[2].get_object("/key"))
+        for replica in self.replicas:
+            self.assertEqual(["/key"], replica.list_objects())
+        self.assertEqual({}, self._create_plugin().get_lagging())
+
+    def test_write_quorum_not_reached(self):
+        plugin = self._create_plugin()
+        with mock.patch.object(self.replicas[1], "create_object",
+                               side_effect=exception.BankCreateObjectFailed(
+                                   key="/key", reason="down")):
+            self.assertRaises(exception.BankCreateObjectFailed,
+                              plugin.create_object, "/key", b"data")
+
+    def test_delete_missing_on_lagging_replica(self):
+        plugin = self._create_plugin(write_quorum=2)
+        with mock.patch.object(self.replicas[0], "create_object",
+                               side_effect=exception.BankCreateObjectFailed(
+                                   key="/key", reason="down")):
+            plugin.create_object("/key", b"data")
+        plugin.delete_object("/key")
+        self._wait_for_banks(plugin)
+        self.assertEqual({}, plugin.get_lagging())
+        for replica in self.replicas:
+            self.assertEqual([], replica.list_objects())
+
+    def test_read_fastest_healthy_replica(self):
+        plugin = self._create_plugin()
+        plugin.create_object("/key", b"data")
+        for index, latency in enumerate((0.3, 0.1, 0.2)):
+            plugin._replicas[index].latency = latency
+        with mock.patch.object(self.replicas[1], "get_object",
+                               side_effect=exception.BankGetObjectFailed(
+                                   key="/key", reason="down")) as failed:
+            self.assertEqual(b"data", plugin.get_object("/key"))
+            self.assertEqual(1, failed.call_count)
+            self.assertFalse(plugin._replicas[1].is_healthy())
+            with mock.patch.object(self.replicas[2], "get_object",
+                                   return_value=b"data") as preferred:
+                plugin.get_object("/key")
+                self.assertEqual(1, preferred.call_count)
+            self.assertEqual(1, failed.call_count)
+
+    def test_object_stream(self):
+        plugin = self._create_plugin()
+        plugin.put_object_stream("/stream", iter([b"ab", b"cd"]))
+        for replica in self.replicas:
+            self.assertEqual(b"abcd", replica.get_object("/stream"))
+        self.assertEqual([b"ab", b"cd"],
+                         list(plugin.get_object_stream("/stream",
+                                                       chunk_size=2)))
+        self.assertRaises(exception.BankObjectNotFound,
+                          plugin.get_object_stream, "/missing")
@@ -10,14 +10,18 @@
 #    License for the specific language governing permissions and limitations
 #    under the License.
 
+import hashlib
 import math
 import mock
 import os
 from oslo_config import cfg
 from oslo_utils import importutils
+from smaug import exception
+from smaug.services.protection.bank_plugins import swift_bank_plugin
 from smaug.services.protection.clients import swift
 from smaug.tests import base
 from smaug.tests.unit.protection.fake_swift_client import FakeSwiftClient
+from swiftclient import ClientException
 import time
 
 CONF = cfg.CONF
@@ -82,6 +86,8 @@ class SwiftBankPluginTest(base.TestCase):
                                    "smaug",
                                    "key")
         self.assertEqual(os.path.isfile(object_file), False)
+        self.assertRaises(exception.BankDeleteObjectFailed,
+                          self.swift_bank_plugin.delete_object, "key")
 
     def test_get_object(self):
         self.swift_bank_plugin.create_object("key", "value")
@@ -108,3 +114,130 @@ class SwiftBankPluginTest(base.TestCase):
         self.swift_bank_plugin.create_object("dict_object", {"key": "value"})
         value = self.swift_bank_plugin.get_object("dict_object")
         self.assertEqual(value, {"key": "value"})
+
+    def test_delete_objects(self):
+        for i in range(3):
+            self.swift_bank_plugin.create_object("key-%d" % i, "value")
+        self.swift_bank_plugin.delete_objects(["key-0", "key-1", "key-2",
+                                               "key-3"])
+        self.assertEqual(2, self.fake_connection.bulk_delete_requests)
+        self.assertEqual([], os.listdir(os.path.join(
+            self.fake_connection.swiftdir, "smaug")))
+
+    def test_object_stream(self):
+        data = [b"chunk-0", b"chunk-1", b"chunk-2"]
+        self.swift_bank_plugin.put_object_stream("stream", iter(data))
+        self.assertEqual(
+            [b"chunk-0c", b"hunk-1ch", b"unk-2"],
+            list(self.swift_bank_plugin.get_object_stream("stream",
+                                                          chunk_size=8)))
+
+    def test_object_range(self):
+        self.swift_bank_plugin.put_object_stream("stream", [b"0123456789"])
+        self.assertEqual(b"234", self.swift_bank_plugin.get_object_range(
+            "stream", 2, 3))
+        self.assertEqual(b"789", self.swift_bank_plugin.get_object_range(
+            "stream", 7))
+        self.assertEqual(b"", self.swift_bank_plugin.get_object_range(
+            "stream", 10, 3))
+        self.assertEqual(b"", self.swift_bank_plugin.get_object_range(
+            "stream", 0, 0))
+        self.assertRaises(exception.BankObjectNotFound,
+                          self.swift_bank_plugin.get_object_range,
+                          "missing", 0)
+
+    def test_stat_object(self):
+        self.swift_bank_plugin.create_object("key", "value")
+        stat = self.swift_bank_plugin.stat_object("key")
+        self.assertEqual(5, stat["size"])
+        self.assertEqual(hashlib.md5(b"value").hexdigest(), stat["etag"])
+        self.assertEqual({"serialized": "False"}, stat["metadata"])
+        self.assertIsNotNone(stat["last_modified"])
+        self.assertRaises(exception.BankObjectNotFound,
+                          self.swift_bank_plugin.stat_object, "missing")
+
+    def test_segmented_object(self):
+        self.swift_bank_plugin.segment_size = 4
+        segments_dir = os.path.join(self.fake_connection.swiftdir,
+                                    "smaug_segments")
+        self.swift_bank_plugin.create_object("large", b"0123456789")
+        self.assertEqual([b"0123456789"], list(
+            self.swift_bank_plugin.get_object_stream("large")))
+        self.assertEqual(3, len(self.fake_connection.get_container(
+            "smaug_segments", "large/slo/", None, None)[1]))
+
+        # Replacing the object deletes the segments of the old version
+        self.swift_bank_plugin.put_object_stream(
+            "large", iter([b"abc", b"defgh"]))
+        self.assertEqual([b"abcdefgh"], list(
+            self.swift_bank_plugin.get_object_stream("large")))
+        self.assertEqual(2, len(self.fake_connection.get_container(
+            "smaug_segments", "large/slo/", None, None)[1]))
+
+        self.swift_bank_plugin.put_object_stream("small", iter([b"abc"]))
+        self.assertEqual(2, len(self.fake_connection.get_container(
+            "smaug_segments", None, None, None)[1]))
+
+        # Replacing the object by a whole one deletes its segments as well
+        self.swift_bank_plugin.create_object("replaced", b"0123456789")
+        self.swift_bank_plugin.update_object("replaced", b"abc")
+        self.assertEqual([b"abc"], list(
+            self.swift_bank_plugin.get_object_stream("replaced")))
+        self.assertEqual([], self.fake_connection.get_container(
+            "smaug_segments", "replaced/slo/", None, None)[1])
+        self.swift_bank_plugin.delete_object("replaced")
+
+        self.swift_bank_plugin.create_object("other", b"0123456789")
+        get_container = mock.patch.object(
+            self.fake_connection, "get_container",
+            wraps=self.fake_connection.get_container)
+        with get_container as get_container:
+            # Deleting the manifests deletes their segments without listings
+            self.swift_bank_plugin.delete_object("large")
+            self.swift_bank_plugin.delete_objects(["other", "small"])
+        self.assertEqual(0, get_container.call_count)
+        self.assertRaises(exception.BankObjectNotFound,
+                          self.swift_bank_plugin.stat_object, "large")
+        self.assertEqual([], self.fake_connection.get_container(
+            "smaug_segments", None, None, None)[1])
+        self.assertTrue(os.path.isdir(segments_dir))
+
+    def test_capabilities_failure_not_cached(self):
+        get_capabilities = self.fake_connection.get_capabilities
+        self.swift_bank_plugin._capabilities = None
+        with mock.patch.object(
+                self.fake_connection, "get_capabilities",
+                side_effect=ClientException("unavailable", http_status=503)):
+            self.assertEqual(0, self.swift_bank_plugin._get_segment_size())
+        with mock.patch.object(self.fake_connection, "get_capabilities",
+                               wraps=get_capabilities) as mocked:
+            self.assertEqual(2,
+                             self.swift_bank_plugin._get_max_bulk_deletes())
+            self.swift_bank_plugin._get_max_bulk_deletes()
+        self.assertEqual(1, mocked.call_count)
+
+    def test_connection_pool(self):
+        connections = []
+
+        def _create_connection():
+            connections.append(mock.MagicMock())
+            return connections[-1]
+
+        pool = swift_bank_plugin._ConnectionPool(_create_connection,
+                                                 max_size=2, max_idle=60)
+        with pool.connection() as first:
+            with pool.connection() as second:
+                self.assertIsNot(first, second)
+        with pool.connection() as connection:
+            self.assertIn(connection, connections)
+        self.assertEqual(2, len(connections))
+
+        def _use_expired_token():
+            with pool.connection():
+                raise ClientException("expired", http_status=401)
+
+        self.assertRaises(ClientException, _use_expired_token)
+        self.assertEqual(2, pool.free())
+        with pool.connection() as connection:
+            self.assertIs(connections[-1], connection)
+        self.assertEqual(3, len(connections))
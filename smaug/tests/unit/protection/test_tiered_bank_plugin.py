@@ -0,0 +1,131 @@
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+
+import mock
+from oslo_config import cfg
+
+from smaug.services.protection.bank_plugins import memory_bank_plugin
+from smaug.services.protection.bank_plugins import tiered_bank_plugin
+from smaug.tests import base
+
+CONF = cfg.CONF
+
+
+def _data_key(checkpoint_id, name="data"):
+    return "/resource-data/%s/image/%s" % (checkpoint_id, name)
+
+
+class TieredBankPluginTest(base.TestCase):
+    def setUp(self):
+        super(TieredBankPluginTest, self).setUp()
+        self.assertFalse(tiered_bank_plugin.is_enabled(CONF))
+        self.override_config("local_bank_plugin",
+                             "smaug-memory-bank-plugin",
+                             "tiered_bank_plugin")
+        self.remote = memory_bank_plugin.MemoryBankPlugin()
+        self.local = memory_bank_plugin.MemoryBankPlugin()
+        self.plugin = tiered_bank_plugin.TieredBankPlugin(
+            CONF, self.remote, self.local)
+
+    def test_checkpoint_of_key(self):
+        self.assertIsNone(
+            tiered_bank_plugin.checkpoint_of_key(
+                "/checkpoints/cp.index.json"))
+        self.assertEqual(
+            "cp", tiered_bank_plugin.checkpoint_of_key(_data_key("cp")))
+        self.assertIsNone(
+            tiered_bank_plugin.checkpoint_of_key("/chunks/abc/data"))
+
+    def test_write_through_and_local_read(self):
+        self.plugin.create_object(_data_key("cp1"), b"data")
+        self.plugin.create_object("/chunks/abc/data", b"chunk")
+        self.assertEqual(b"data", self.remote.get_object(_data_key("cp1")))
+        self.assertEqual(b"data", self.local.get_object(_data_key("cp1")))
+        self.assertEqual([], self.local.list_objects(prefix="/chunks/"))
+
+        with mock.patch.object(self.remote, "get_object") as remote_get:
+            self.assertEqual(b"data",
+                             self.plugin.get_object(_data_key("cp1")))
+            self.assertFalse(remote_get.called)
+
+    def test_checkpoint_metadata_is_remote(self):
+        self.plugin.create_object(_data_key("cp1"), b"data")
+        self.remote.create_object("/checkpoints/cp2.index.json",
+                                  {"status": "protecting"})
+        self.assertEqual({"status": "protecting"}, self.plugin.get_object(
+            "/checkpoints/cp2.index.json"))
+        self.assertEqual([_data_key("cp1")], self.local.list_objects())
+
+        self.plugin.update_object("/checkpoints/cp2.index.json",
+                                  {"status": "available"})
+        self.remote.update_object("/checkpoints/cp2.index.json",
+                                  {"status": "deleted"})
+        self.assertEqual({"status": "deleted"}, self.plugin.get_object(
+            "/checkpoints/cp2.index.json"))
+        self.assertEqual([_data_key("cp1")], self.local.list_objects())
+
+    def test_evict_least_recently_used(self):
+        for checkpoint_id in ("cp1", "cp2"):
+            self.plugin.create_object(_data_key(checkpoint_id), b"data")
+        self.plugin.get_object(_data_key("cp1"))
+        self.plugin.create_object(_data_key("cp3"), b"data")
+        self.assertEqual([_data_key("cp1"), _data_key("cp3")],
+                         self.local.list_objects())
+        self.assertEqual(3, len(self.remote.list_objects()))
+
+        # Reading an evicted checkpoint brings it back
+        self.assertEqual(b"data", self.plugin.get_object(_data_key("cp2")))
+        self.assertEqual([_data_key("cp2"), _data_key("cp3")],
+                         self.local.list_objects())
+
+    def test_size_budget(self):
+        self.override_config("local_max_checkpoints", 0,
+                             "tiered_bank_plugin")
+        self.override_config("local_max_size", 10, "tiered_bank_plugin")
+        plugin = tiered_bank_plugin.TieredBankPlugin(
+            CONF, self.remote, self.local)
+        plugin.create_object(_data_key("cp1"), b"12345")
+        plugin.create_object(_data_key("cp2"), b"12345")
+        self.assertEqual(2, len(self.local.list_objects()))
+        plugin.create_object(_data_key("cp2", "more"), b"1")
+        self.assertEqual([_data_key("cp2", "data"), _data_key("cp2", "more")],
+                         self.local.list_objects())
+
+    def test_delete(self):
+        self.plugin.create_object(_data_key("cp1"), b"data")
+        self.plugin.create_object(_data_key("cp1", "other"), b"data")
+        self.plugin.delete_objects([_data_key("cp1")])
+        self.plugin.delete_object(_data_key("cp1", "other"))
+        self.assertEqual([], self.remote.list_objects())
+        self.assertEqual([], self.local.list_objects())
+
+    def test_object_stream(self):
+        self.plugin.put_object_stream(_data_key("cp1"), [b"ab", b"cd"])
+        self.assertEqual(b"abcd", self.remote.get_object(_data_key("cp1")))
+        self.assertEqual(b"abcd", self.local.get_object(_data_key("cp1")))
+
+        self.remote.create_object(_data_key("cp2"), b"efgh")
+        self.assertEqual([b"ef", b"gh"], list(self.plugin.get_object_stream(
+            _data_key("cp2"), chunk_size=2)))
+        self.assertEqual(b"efgh", self.local.get_object(_data_key("cp2")))
+
+    def test_index_local_bank(self):
+        self.local.create_object(_data_key("cp1"), b"old")
+        self.local.create_object(_data_key("cp2"), b"new")
+        self.local.create_object(_data_key("cp3"), b"newest")
+        plugin = tiered_bank_plugin.TieredBankPlugin(
+            CONF, self.remote, self.local)
+        self.assertEqual([_data_key("cp2"), _data_key("cp3")],
+                         self.local.list_objects())
+        with mock.patch.object(self.remote, "get_object") as remote_get:
+            self.assertEqual(b"new", plugin.get_object(_data_key("cp2")))
+            self.assertFalse(remote_get.called)